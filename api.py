@@ -0,0 +1,446 @@
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from arte_final import CHUNK_BYTES, ArchivoLocal, es_sha256
+from engine import (
+    EmailService, dtos_desde_campos, generar_orden_pdf, get_almacen_arte_final, get_config, limites_arte_final,
+    marcar_artes_entregados, resumen_taller_activo, volcar_resumen_taller,
+)
+from historial import CLAVE_CONTENIDO_CADUCIDAD_S, ENVIO_COMPLETADO, HistorialPedidos
+from metricas import METRICAS, contexto_log, span
+from outbox import OutboxQueue, OutboxWorker, order_record
+
+# =============================================================================
+# API HTTP/JSON DE ENTRADA DE PEDIDOS (ERP)
+# =============================================================================
+# Alta de órdenes sin pasar por el formulario: mismo motor, mismo outbox y
+# mismo historial que la interfaz. Los campos son los de la importación CSV.
+#
+#   PUT  /api/v1/arte-final   cuerpo = PDF          -> {"sha256": ...}
+#   POST /api/v1/pedidos      objeto JSON o lista   -> resultado por pedido
+#   GET  /api/v1/arte-final/<sha256>?exp=&firma=      -> PDF del almacén
+#   GET  /healthz, /metrics
+#
+# El arte final se sube una vez y los pedidos lo citan con `arte_final_sha256`.
+# Cada pedido tiene una clave de idempotencia (`Idempotency-Key`, el campo
+# `clave_idempotencia` o el hash de su contenido): reintentar una petición no
+# duplica órdenes ni correos. El hash del contenido de un pedido sin
+# `referencia_interna` caduca (CLAVE_CONTENIDO_CADUCIDAD_S), para que un pedido
+# fijo repetido otro día no se descarte como duplicado. Un lote se renderiza
+# en un pool de procesos y se encola y registra en una sola transacción; un
+# pedido que falla al renderizar o preparar su correo sólo se descarta él.
+# Una subida se borra cuando su contenido ya está en el almacén y ningún
+# pedido en curso la usa, y las que nadie cita caducan a las
+# `api_arte_caducidad_h` horas. La descarga de arte final no pide token: es
+# el enlace que recibe el taller por correo y va firmado y con caducidad
+# (`enlace_arte_final`); `api_url` debe ser la dirección con la que el taller
+# llega a esta API.
+#
+#   FLEXY_API_TOKEN=... python api.py --from pedidos@flexylabel.es --worker
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+ESTADO_CREADO = "creado"
+ESTADO_DUPLICADO = "duplicado"
+ESTADO_EN_CURSO = "en_curso"
+ESTADO_ERROR = "error"
+
+CODIGO_HTTP = {ESTADO_CREADO: 201, ESTADO_DUPLICADO: 200, ESTADO_EN_CURSO: 409, ESTADO_ERROR: 422}
+
+
+class ErrorPeticion(Exception):
+    def __init__(self, codigo: int, mensaje: str):
+        super().__init__(mensaje)
+        self.codigo = codigo
+
+
+def clave_pedido(campos: dict, clave: str = None):
+    """Clave de idempotencia explícita o, en su defecto, hash del contenido del pedido.
+
+    Devuelve `(clave, caducidad_s)`; sólo caduca el hash de un pedido sin referencia.
+    """
+    caducidad = None
+    if not clave:
+        contenido = json.dumps({k: v for k, v in campos.items() if k}, sort_keys=True, default=str)
+        clave = hashlib.sha256(contenido.encode()).hexdigest()
+        if not str(campos.get("referencia_interna") or "").strip():
+            caducidad = CLAVE_CONTENIDO_CADUCIDAD_S
+    return f"api:{clave}", caducidad
+
+
+def _render(cliente, specs, prod):
+    return bytes(generar_orden_pdf(cliente, specs, prod))
+
+
+class ServicioPedidos:
+    """Valida, renderiza y encola lotes de pedidos recibidos por la API."""
+
+    def __init__(self, outbox: OutboxQueue, historial: HistorialPedidos, mail_from: str,
+                 arte_dir: str = "api_arte_final", workers: int = None, worker: OutboxWorker = None):
+        self.outbox = outbox
+        self.historial = historial
+        self.mail_from = mail_from
+        self.arte_dir = os.path.abspath(arte_dir)
+        self.worker = worker
+        self._subidas_en_uso = {}  # ruta -> nº de pedidos en curso que la citan
+        self._lock_subidas = threading.Lock()
+        # spawn: un fork con los hilos del servidor y del worker del outbox puede bloquear al hijo
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        os.makedirs(self.arte_dir, exist_ok=True)
+        self.podar_subidas()
+
+    # --- Arte final ---
+    def guardar_arte_final(self, cuerpo, longitud: int) -> str:
+        """Vuelca la subida por bloques a `arte_dir/<sha256>.pdf`. Devuelve el sha256."""
+        max_mb, _ = limites_arte_final()
+        if longitud > max_mb * 2**20:
+            raise ErrorPeticion(413, f"El arte final supera el máximo de {max_mb} MB")
+        self.podar_subidas()
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=self.arte_dir)
+        try:
+            with os.fdopen(fd, "wb") as destino:
+                pendiente = longitud
+                while pendiente:
+                    bloque = cuerpo.read(min(CHUNK_BYTES, pendiente))
+                    if not bloque:
+                        raise ErrorPeticion(400, "Cuerpo incompleto")
+                    digest.update(bloque)
+                    destino.write(bloque)
+                    pendiente -= len(bloque)
+            sha256 = digest.hexdigest()
+            os.replace(tmp, os.path.join(self.arte_dir, f"{sha256}.pdf"))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return sha256
+
+    def podar_subidas(self):
+        """Borra las subidas (y temporales de subidas cortadas) sin usar desde hace `api_arte_caducidad_h`."""
+        limite = time.time() - float(get_config("api_arte_caducidad_h", 24)) * 3600
+        with self._lock_subidas:
+            for entrada in os.scandir(self.arte_dir):
+                if entrada.path in self._subidas_en_uso:
+                    continue
+                try:
+                    if entrada.stat().st_mtime < limite:
+                        os.remove(entrada.path)
+                except FileNotFoundError:
+                    pass
+
+    def _arte_final(self, sha256: str, reservadas: list):
+        """Copia del almacén o, si aún no se ha usado, la subida pendiente de la API.
+
+        Una subida se añade a `reservadas` hasta `_soltar_subidas`, para que
+        otra petición no la borre mientras este pedido la lee.
+        """
+        if not sha256:
+            return None
+        if not es_sha256(sha256):
+            # Nunca se compone una ruta con un valor del cliente que no sea un hash
+            raise ValueError("arte_final_sha256 debe ser un sha256 en hexadecimal (64 caracteres)")
+        path = get_almacen_arte_final().buscar(sha256)
+        if path is None:
+            path = os.path.join(self.arte_dir, f"{sha256}.pdf")
+            with self._lock_subidas:
+                if not os.path.exists(path):
+                    raise ValueError(f"arte final desconocido '{sha256}' (súbalo antes con PUT /api/v1/arte-final)")
+                self._subidas_en_uso[path] = self._subidas_en_uso.get(path, 0) + 1
+            reservadas.append(path)
+        return ArchivoLocal(path)
+
+    def _soltar_subidas(self, paths):
+        """Libera las subidas reservadas por `_arte_final`.
+
+        La última petición que suelta una subida la borra si su contenido ya
+        está en el almacén: los pedidos siguientes lo encuentran allí.
+        """
+        almacen = get_almacen_arte_final()
+        with self._lock_subidas:
+            for path in paths:
+                self._subidas_en_uso[path] -= 1
+                if self._subidas_en_uso[path]:
+                    continue
+                del self._subidas_en_uso[path]
+                if almacen.buscar(os.path.basename(path)[:-len(".pdf")]):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    # --- Pedidos ---
+    def recibir(self, pedidos: list, clave_base: str = None) -> list:
+        """Procesa un lote. Devuelve un resultado `{estado, referencia | error}` por pedido."""
+        resultados = [None] * len(pedidos)
+        subidas = []  # subidas de la API que citan estos pedidos
+        try:
+            self._recibir(pedidos, clave_base, resultados, subidas)
+        finally:
+            self._soltar_subidas(subidas)
+
+        for resultado in resultados:
+            METRICAS.incrementar("api_pedidos_total", ayuda="Pedidos recibidos por la API, por resultado",
+                                 estado=resultado["estado"])
+        return resultados
+
+    def _recibir(self, pedidos, clave_base, resultados, subidas):
+        aceptados = []  # (índice, clave, dtos)
+        for i, campos in enumerate(pedidos):
+            if not isinstance(campos, dict):
+                resultados[i] = {"estado": ESTADO_ERROR, "error": "cada pedido debe ser un objeto JSON"}
+                continue
+            clave_explicita = campos.get("clave_idempotencia") or (
+                clave_base if len(pedidos) == 1 else f"{clave_base}:{i}" if clave_base else None
+            )
+            clave, caducidad = clave_pedido(campos, clave_explicita)
+            previo = self.historial.reservar_envio(clave, caducidad)
+            if previo is not None:
+                completado = previo["estado"] == ENVIO_COMPLETADO
+                resultados[i] = {"estado": ESTADO_DUPLICADO if completado else ESTADO_EN_CURSO,
+                                 "referencia": previo["referencia"]}
+                continue
+            try:
+                arte = self._arte_final(str(campos.get("arte_final_sha256") or "").strip().lower(), subidas)
+                dtos = dtos_desde_campos(campos, self.historial.siguiente_referencia, arte)
+            except (ValueError, TypeError) as e:
+                self.historial.liberar_envio(clave)
+                resultados[i] = {"estado": ESTADO_ERROR, "error": str(e)}
+                continue
+            aceptados.append((i, clave, dtos))
+
+        if aceptados:
+            try:
+                errores = self._encolar(aceptados)
+            except Exception:
+                for _, clave, _ in aceptados:
+                    self.historial.liberar_envio(clave)
+                raise
+            for i, clave, (cliente, _, _) in aceptados:
+                if i in errores:
+                    self.historial.liberar_envio(clave)
+                    resultados[i] = {"estado": ESTADO_ERROR, "error": errores[i]}
+                else:
+                    resultados[i] = {"estado": ESTADO_CREADO, "referencia": cliente.referencia_interna}
+
+    def _encolar(self, aceptados) -> dict:
+        """Renderiza y encola los pedidos aceptados. Devuelve `{índice: error}` de los descartados.
+
+        Un fallo de render o de correo sólo descarta su pedido; el resto se
+        encola y registra en una transacción.
+        """
+        with span("api_render"):
+            futuros = [self.pool.submit(_render, *dtos) for _, _, dtos in aceptados]
+            wait(futuros)
+        lote, pedidos_lote, claves_lote, errores = [], [], [], {}
+        resumen = resumen_taller_activo()
+        for (i, clave, (cliente, specs, prod)), futuro in zip(aceptados, futuros):
+            with contexto_log(referencia=cliente.referencia_interna):
+                try:
+                    pdf_data = futuro.result()
+                except Exception as e:
+                    logger.error(f"Error al renderizar el pedido {cliente.referencia_interna}: {e}")
+                    errores[i] = f"render: {e}"
+                    continue
+                try:
+                    mensajes, arte_sha256 = EmailService.preparar_mensajes(cliente, prod, pdf_data, self.mail_from,
+                                                                           specs, taller=not resumen)
+                except Exception as e:
+                    logger.error(f"Error al preparar el correo del pedido {cliente.referencia_interna}: {e}")
+                    errores[i] = f"correo: {e}"
+                    continue
+            lote.append((order_record(cliente, specs, prod), mensajes))
+            pedidos_lote.append((cliente, specs, prod, arte_sha256))
+            claves_lote.append((clave, cliente.referencia_interna))
+        if lote:
+            with span("encolado"):
+                self.outbox.enqueue_many(lote)
+                if not resumen:
+                    marcar_artes_entregados(sha for _, _, _, sha in pedidos_lote)
+                self.historial.registrar_lote(pedidos_lote, pendiente_taller=resumen)
+                self.historial.completar_envios(claves_lote)
+            if self.worker:
+                self.worker.wake()
+        return errores
+
+
+def crear_servidor(servicio: ServicioPedidos, host: str, puerto: int, token: str = None,
+                   max_json_bytes: int = 8 * 2**20) -> ThreadingHTTPServer:
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _responder(self, codigo: int, cuerpo, content_type: str = "application/json; charset=utf-8"):
+            datos = cuerpo if isinstance(cuerpo, bytes) else json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def _autorizado(self) -> bool:
+            if not token:
+                return True
+            esperado = f"Bearer {token}".encode()
+            return hmac.compare_digest(self.headers.get("Authorization", "").encode(), esperado)
+
+        def _longitud(self) -> int:
+            try:
+                return int(self.headers["Content-Length"])
+            except (TypeError, ValueError):
+                raise ErrorPeticion(411, "Falta Content-Length")
+
+        def _atender(self, accion):
+            try:
+                if not self._autorizado():
+                    raise ErrorPeticion(401, "Token no válido")
+                accion()
+            except ErrorPeticion as e:
+                # Cuerpo no leído: la conexión no se puede reutilizar
+                self.close_connection = True
+                self._responder(e.codigo, {"error": str(e)})
+            except Exception as e:
+                logger.error(f"Error en la API ({self.path}): {e}")
+                self.close_connection = True
+                self._responder(500, {"error": "Error interno"})
+
+        def _descargar_arte_final(self, sha256: str, query: str):
+            parametros = parse_qs(query)
+            try:
+                caduca_en = int(parametros["exp"][0])
+                firma = parametros["firma"][0]
+            except (KeyError, ValueError):
+                return self._responder(403, {"error": "Enlace no válido"})
+            almacen = get_almacen_arte_final()
+            if not es_sha256(sha256) or not firma.isascii() or not almacen.enlace_valido(sha256, caduca_en, firma):
+                return self._responder(403, {"error": "Enlace no válido o caducado"})
+            path = almacen.buscar(sha256)
+            if not path:
+                return self._responder(404, {"error": "El arte final ya no está en el almacén"})
+            with open(path, "rb") as f:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+                self.send_header("Content-Disposition", f'attachment; filename="ARTE_FINAL_{sha256[:12]}.pdf"')
+                self.end_headers()
+                while True:
+                    bloque = f.read(CHUNK_BYTES)
+                    if not bloque:
+                        break
+                    self.wfile.write(bloque)
+
+        def do_GET(self):
+            ruta, _, query = self.path.partition("?")
+            if ruta.startswith("/api/v1/arte-final/"):
+                self._descargar_arte_final(ruta[len("/api/v1/arte-final/"):], query)
+            elif ruta == "/healthz":
+                self._responder(200, {"ok": True, "outbox_pendientes": servicio.outbox.depth()})
+            elif ruta == "/metrics":
+                self._responder(200, METRICAS.exportar_prometheus().encode("utf-8"),
+                                "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self._responder(404, {"error": "No encontrado"})
+
+        def do_PUT(self):
+            if self.path.split("?")[0] != "/api/v1/arte-final":
+                return self._responder(404, {"error": "No encontrado"})
+
+            def accion():
+                sha256 = servicio.guardar_arte_final(self.rfile, self._longitud())
+                self._responder(201, {"sha256": sha256})
+            self._atender(accion)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/api/v1/pedidos":
+                return self._responder(404, {"error": "No encontrado"})
+
+            def accion():
+                longitud = self._longitud()
+                if longitud > max_json_bytes:
+                    raise ErrorPeticion(413, f"Petición mayor de {max_json_bytes // 2**20} MB")
+                try:
+                    cuerpo = json.loads(self.rfile.read(longitud))
+                except ValueError as e:
+                    return self._responder(400, {"error": f"JSON no válido: {e}"})
+                with span("api_pedidos"):
+                    if isinstance(cuerpo, list):
+                        self._responder(200, {"pedidos": servicio.recibir(cuerpo, self.headers.get("Idempotency-Key"))})
+                    else:
+                        resultado = servicio.recibir([cuerpo], self.headers.get("Idempotency-Key"))[0]
+                        self._responder(CODIGO_HTTP[resultado["estado"]], resultado)
+            self._atender(accion)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, int(puerto)), _Handler)
+    servidor.daemon_threads = True
+    return servidor
+
+
+def main(argv=None):
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="API HTTP/JSON de entrada de pedidos")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=int(get_config("api_puerto", 8600)))
+    parser.add_argument("--from", dest="mail_from", default=os.environ.get("FLEXY_SMTP_USER", ""),
+                        help="remitente de los correos (por defecto $FLEXY_SMTP_USER)")
+    parser.add_argument("--outbox", default=get_config("outbox_db", "outbox.db"))
+    parser.add_argument("--historial", default=get_config("historial_db", "historial.db"))
+    parser.add_argument("--arte-dir", default=get_config("api_arte_dir", "api_arte_final"),
+                        help="subidas de arte final pendientes de usar")
+    parser.add_argument("--workers", type=int, default=None, help="procesos de render (por defecto nº de CPUs)")
+    parser.add_argument("--worker", action="store_true",
+                        help="entrega el outbox en este proceso (credenciales en FLEXY_SMTP_*)")
+    args = parser.parse_args(argv)
+
+    token = get_config("api_token")
+    if not args.mail_from:
+        parser.error("indique --from o FLEXY_SMTP_USER")
+    if not token and args.host not in ("127.0.0.1", "localhost", "::1"):
+        parser.error("defina FLEXY_API_TOKEN para escuchar fuera de localhost")
+
+    outbox = OutboxQueue(args.outbox)
+    historial = HistorialPedidos(args.historial)
+    worker = None
+    if args.worker:
+        from smtp_pool import SMTPConfig, SMTPConnectionPool
+        worker = OutboxWorker(outbox, SMTPConnectionPool(SMTPConfig(
+            host=get_config("smtp_host", "smtp.gmail.com"),
+            port=int(get_config("smtp_port", 465)),
+            user=args.mail_from,
+            password=os.environ.get("FLEXY_SMTP_PASSWORD", ""),
+            use_ssl=bool(get_config("smtp_ssl", True)),
+        )), tareas=[lambda: volcar_resumen_taller(outbox, historial, args.mail_from)])
+        worker.start()
+    METRICAS.registrar_gauge("outbox_pendientes", outbox.depth, "Mensajes pendientes en el outbox")
+
+    servicio = ServicioPedidos(outbox, historial, args.mail_from,
+                               args.arte_dir, args.workers, worker)
+    servidor = crear_servidor(servicio, args.host, args.puerto, token)
+    logger.info(f"API de pedidos en http://{args.host}:{args.puerto}/api/v1/pedidos")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.pool.shutdown()
+        if worker:
+            worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,32 @@
 import streamlit as st
-from fpdf import FPDF
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
 import datetime
-import os
-import math
 import base64
+import functools
+import hashlib
+import io
 import logging
+import os
+import re
+import time
+import uuid
 from dataclasses import dataclass
 
+import engine
+from engine import (
+    MANDRILES, MATERIALES, CalculadoraProduccion, ClienteDTO, EspecificacionesDTO, ProduccionDTO,
+    encolar_orden, generar_etiquetas_rollo, generar_orden_pdf, get_config, get_historial, limites_arte_final,
+    pedido_a_dtos, resumen_taller_activo, volcar_resumen_taller,
+)
+from arte_final import tamano_arte_final
+from historial import ENVIO_COMPLETADO
+from metricas import METRICAS, ExportadorMetricas, contexto_log, span
+from outbox import OutboxQueue, OutboxWorker
+from smtp_pool import SMTPConfig, SMTPConnectionPool
+from trabajos import (
+    TRABAJO_COMPLETADO, TRABAJO_ENCOLANDO, TRABAJO_EN_COLA, TRABAJO_ERROR, TRABAJO_RENDER,
+    GestorTrabajos, LimiteTrabajos,
+)
+
 # =============================================================================
 # 1. CONFIGURACIÓN ESTRUCTURAL (CORE)
 # =============================================================================
@@ -29,492 +44,603 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# --- DTOs (Data Transfer Objects) ---
-@dataclass
-class ClienteDTO:
-    razon_social: str
-    email_contacto: str
-    referencia_interna: str
-
-@dataclass
-class EspecificacionesDTO:
-    ancho_mm: float
-    largo_mm: float
-    cantidad_total: int
-    material: str
-    mandril: str
-    uds_rollo: int
-
-@dataclass
-class ProduccionDTO:
-    sentido_bobinado: str
-    notas_maquinista: str
-    arte_final: any
+def _secreto(key: str, default=None):
+    """Ajuste opcional de `st.secrets`; sin secrets.toml se usa el valor por defecto."""
+    try:
+        return st.secrets.get(key, default)
+    except FileNotFoundError:
+        return default
+
+
+# La lógica (DTOs, cálculo, PDF, correo) vive en `engine`, sin Streamlit
+engine.configurar(_secreto)
 
 # =============================================================================
 # 2. MOTOR GRÁFICO VECTORIAL (SVG GENERATOR - REFINADO)
 # =============================================================================
-def get_winding_svg(position_id: int) -> str:
-    """Genera gráficos SVG técnicos con estética mejorada."""
-    colors = {
-        "bg": "#0f172a", "label": "#f8fafc", "arrow": "#0ea5e9", "text": "#94a3b8", "border": "#334155"
-    }
-    
-    # Base más limpia
-    base_svg = f"""
-    <svg width="100%" height="130" viewBox="0 0 100 130" xmlns="http://www.w3.org/2000/svg">
+@dataclass(frozen=True)
+class PaletaBobinado:
+    bg: str = "#0f172a"
+    label: str = "#f8fafc"
+    arrow: str = "#0ea5e9"
+    text: str = "#94a3b8"
+    border: str = "#334155"
+    interior: str = "#f43f5e"
+    exterior: str = "#10b981"
+
+
+PALETA_BOBINADO = PaletaBobinado()
+
+SVG_DEFS = """
         <defs>
             <filter id="glow" x="-20%" y="-20%" width="140%" height="140%">
                 <feGaussianBlur stdDeviation="2" result="blur" />
                 <feComposite in="SourceGraphic" in2="blur" operator="over" />
             </filter>
-        </defs>
-        <circle cx="50" cy="50" r="35" stroke="{colors['border']}" stroke-width="2" fill="#1e293b" />
-        <circle cx="50" cy="50" r="10" stroke="{colors['border']}" stroke-width="2" fill="{colors['bg']}" />
+        </defs>"""
+
+
+def _winding_svg_body(position_id: int, colors: PaletaBobinado) -> str:
+    """Elementos SVG de una posición de bobinado (sin el <svg> contenedor)."""
+    # Base más limpia
+    base_svg = f"""
+        <circle cx="50" cy="50" r="35" stroke="{colors.border}" stroke-width="2" fill="#1e293b" />
+        <circle cx="50" cy="50" r="10" stroke="{colors.border}" stroke-width="2" fill="{colors.bg}" />
     """
 
     is_in = position_id > 4
     arrow_path = ""
     label_rect = ""
-    
+
     # Lógica de dibujo
     if position_id in [1, 5]: # TOP
-        arrow_path = f'<path d="M50 15 L50 5 M45 10 L50 5 L55 10" stroke="{colors["arrow"]}" stroke-width="3" fill="none" filter="url(#glow)"/>'
-        label_rect = f'<rect x="35" y="15" width="30" height="20" fill="white" stroke="{colors["arrow"]}"/>' if not is_in else ''
+        arrow_path = f'<path d="M50 15 L50 5 M45 10 L50 5 L55 10" stroke="{colors.arrow}" stroke-width="3" fill="none" filter="url(#glow)"/>'
+        label_rect = f'<rect x="35" y="15" width="30" height="20" fill="white" stroke="{colors.arrow}"/>' if not is_in else ''
     elif position_id in [2, 6]: # BOTTOM
-        arrow_path = f'<path d="M50 85 L50 95 M45 90 L50 95 L55 90" stroke="{colors["arrow"]}" stroke-width="3" fill="none" filter="url(#glow)"/>'
-        label_rect = f'<rect x="35" y="65" width="30" height="20" fill="white" stroke="{colors["arrow"]}"/>' if not is_in else ''
+        arrow_path = f'<path d="M50 85 L50 95 M45 90 L50 95 L55 90" stroke="{colors.arrow}" stroke-width="3" fill="none" filter="url(#glow)"/>'
+        label_rect = f'<rect x="35" y="65" width="30" height="20" fill="white" stroke="{colors.arrow}"/>' if not is_in else ''
     elif position_id in [3, 7]: # RIGHT
-        arrow_path = f'<path d="M85 50 L95 50 M90 45 L95 50 L90 55" stroke="{colors["arrow"]}" stroke-width="3" fill="none" filter="url(#glow)"/>'
-        label_rect = f'<rect x="65" y="35" width="20" height="30" fill="white" stroke="{colors["arrow"]}"/>' if not is_in else ''
+        arrow_path = f'<path d="M85 50 L95 50 M90 45 L95 50 L90 55" stroke="{colors.arrow}" stroke-width="3" fill="none" filter="url(#glow)"/>'
+        label_rect = f'<rect x="65" y="35" width="20" height="30" fill="white" stroke="{colors.arrow}"/>' if not is_in else ''
     elif position_id in [4, 8]: # LEFT
-        arrow_path = f'<path d="M15 50 L5 50 M10 45 L5 50 L10 55" stroke="{colors["arrow"]}" stroke-width="3" fill="none" filter="url(#glow)"/>'
-        label_rect = f'<rect x="15" y="35" width="20" height="30" fill="white" stroke="{colors["arrow"]}"/>' if not is_in else ''
-    
+        arrow_path = f'<path d="M15 50 L5 50 M10 45 L5 50 L10 55" stroke="{colors.arrow}" stroke-width="3" fill="none" filter="url(#glow)"/>'
+        label_rect = f'<rect x="15" y="35" width="20" height="30" fill="white" stroke="{colors.arrow}"/>' if not is_in else ''
+
     winding_type = "INTERIOR" if is_in else "EXTERIOR"
-    color_type = "#f43f5e" if is_in else "#10b981"
-    
-    svg_content = base_svg + label_rect + arrow_path + f"""
-        <rect x="20" y="105" width="60" height="20" rx="4" fill="#0f172a" stroke="{colors['border']}" />
+    color_type = colors.interior if is_in else colors.exterior
+
+    return base_svg + label_rect + arrow_path + f"""
+        <rect x="20" y="105" width="60" height="20" rx="4" fill="{colors.bg}" stroke="{colors.border}" />
         <text x="50" y="119" font-family="sans-serif" font-size="10" fill="white" text-anchor="middle" font-weight="bold">POS {position_id}</text>
         <text x="50" y="54" font-family="sans-serif" font-size="7" fill="{color_type}" text-anchor="middle" font-weight="bold">{winding_type}</text>
-    </svg>
     """
+
+
+def _svg_data_uri(svg_content: str) -> str:
     b64 = base64.b64encode(svg_content.encode('utf-8')).decode("utf-8")
     return f"data:image/svg+xml;base64,{b64}"
 
+
+@functools.lru_cache(maxsize=64)
+def get_winding_svg(position_id: int, palette: PaletaBobinado = PALETA_BOBINADO) -> str:
+    """Genera gráficos SVG técnicos con estética mejorada (cacheado por posición y paleta)."""
+    svg_content = f"""
+    <svg width="100%" height="130" viewBox="0 0 100 130" xmlns="http://www.w3.org/2000/svg">{SVG_DEFS}
+    {_winding_svg_body(position_id, palette)}
+    </svg>
+    """
+    return _svg_data_uri(svg_content)
+
+
+@functools.lru_cache(maxsize=8)
+def get_winding_sprite_sheet(palette: PaletaBobinado = PALETA_BOBINADO) -> str:
+    """Las 8 posiciones en una sola imagen: una petición en lugar de 8 data URIs."""
+    panels = "".join(
+        f'<g transform="translate({(i - 1) * 100} 0)">{_winding_svg_body(i, palette)}</g>'
+        for i in range(1, 9)
+    )
+    svg_content = f"""
+    <svg width="100%" viewBox="0 0 800 130" xmlns="http://www.w3.org/2000/svg">{SVG_DEFS}
+    {panels}
+    </svg>
+    """
+    return _svg_data_uri(svg_content)
+
+
+# Precalculado al importar: los reruns sólo consultan la caché
+for _pos in range(1, 9):
+    get_winding_svg(_pos)
+get_winding_sprite_sheet()
+
 # =============================================================================
 # 3. ESTILOS CSS "DYNAMIC INDUSTRIAL" (V6.0)
 # =============================================================================
-def inject_dynamic_css():
-    st.markdown("""
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;700&family=JetBrains+Mono:wght@500;800&display=swap');
-
-            /* FONDO & BASE */
-            .stApp {
-                background-color: #0b1121;
-                background-image: 
-                    radial-gradient(at 0% 0%, rgba(56, 189, 248, 0.1) 0px, transparent 50%),
-                    radial-gradient(at 100% 100%, rgba(236, 72, 153, 0.05) 0px, transparent 50%);
-                font-family: 'Inter', sans-serif;
-            }
-
-            /* ENCABEZADOS DE SECCIÓN */
-            .section-header {
-                display: flex;
-                align-items: center;
-                margin-top: 2rem;
-                margin-bottom: 1rem;
-                border-bottom: 1px solid rgba(148, 163, 184, 0.2);
-                padding-bottom: 0.5rem;
-            }
-            .section-number {
-                background: linear-gradient(135deg, #0ea5e9, #2563eb);
-                color: white;
-                width: 32px;
-                height: 32px;
-                border-radius: 8px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                font-weight: 800;
-                margin-right: 12px;
-                font-family: 'JetBrains Mono', monospace;
-                box-shadow: 0 4px 6px -1px rgba(37, 99, 235, 0.3);
-            }
-            .section-title {
-                font-size: 1.1rem;
-                font-weight: 700;
-                color: #e2e8f0;
-                letter-spacing: 0.05em;
-            }
-
-            /* CONTENEDOR PRINCIPAL "GLASS" */
-            div[data-testid="stForm"] {
-                background: rgba(30, 41, 59, 0.4);
-                backdrop-filter: blur(12px);
-                -webkit-backdrop-filter: blur(12px);
-                border: 1px solid rgba(255, 255, 255, 0.08);
-                border-radius: 20px;
-                padding: 3rem;
-                box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.5);
-            }
-
-            /* INPUTS DINÁMICOS */
-            input, select, textarea, div[data-baseweb="select"] > div {
-                background-color: rgba(15, 23, 42, 0.6) !important;
-                color: #f8fafc !important;
-                border: 1px solid #334155 !important;
-                border-radius: 8px !important;
-                transition: all 0.3s ease !important;
-            }
-            input:focus, textarea:focus, div[data-baseweb="select"] > div:focus-within {
-                border-color: #38bdf8 !important;
-                box-shadow: 0 0 15px rgba(56, 189, 248, 0.2) !important;
-                background-color: rgba(15, 23, 42, 0.9) !important;
-            }
-            
-            /* LABELS */
-            label {
-                color: #94a3b8 !important;
-                font-size: 0.8rem !important;
-                font-weight: 600 !important;
-                text-transform: uppercase;
-                letter-spacing: 0.05em;
-            }
-
-            /* TARJETAS DE MÉTRICAS (HUD STYLE) */
-            .hud-container {
-                display: flex;
-                gap: 20px;
-                margin-top: 25px;
-            }
-            .hud-card {
-                flex: 1;
-                background: linear-gradient(180deg, rgba(30, 41, 59, 0.5) 0%, rgba(15, 23, 42, 0.8) 100%);
-                border: 1px solid #334155;
-                border-top: 3px solid #0ea5e9;
-                border-radius: 12px;
-                padding: 20px;
-                position: relative;
-                overflow: hidden;
-            }
-            .hud-card::before {
-                content: "";
-                position: absolute;
-                top: 0; left: 0; right: 0; height: 1px;
-                background: linear-gradient(90deg, transparent, rgba(56, 189, 248, 0.5), transparent);
-            }
-            .hud-value {
-                font-family: 'JetBrains Mono', monospace;
-                font-size: 1.8rem;
-                font-weight: 700;
-                color: #38bdf8;
-                text-shadow: 0 0 10px rgba(56, 189, 248, 0.3);
-            }
-            .hud-label {
-                font-size: 0.75rem;
-                color: #64748b;
-                text-transform: uppercase;
-                margin-bottom: 5px;
-            }
-
-            /* BOTÓN DE ACCIÓN */
-            .stButton > button {
-                background: linear-gradient(90deg, #0284c7, #2563eb);
-                color: white;
-                font-weight: 700;
-                text-transform: uppercase;
-                letter-spacing: 1px;
-                padding: 1.2rem;
-                border-radius: 10px;
-                border: none;
-                width: 100%;
-                margin-top: 2rem;
-                box-shadow: 0 10px 20px -5px rgba(37, 99, 235, 0.4);
-                transition: transform 0.2s, box-shadow 0.2s;
-            }
-            .stButton > button:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 15px 30px -5px rgba(37, 99, 235, 0.6);
-                background: linear-gradient(90deg, #0ea5e9, #3b82f6);
-            }
-            
-            /* Checkbox bobinado personalizado */
-            .stCheckbox label {
-                color: #cbd5e1 !important;
-            }
-        </style>
-    """, unsafe_allow_html=True)
+CSS_ESTATICO = "css/flexylabel.css"  # relativo a ./static, servido en /app/static
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", CSS_ESTATICO)
 
-# =============================================================================
-# 4. MOTOR DE PDF
-# =============================================================================
-class EnterprisePDF(FPDF):
-    def __init__(self):
-        super().__init__()
-        self.set_auto_page_break(auto=True, margin=15)
-
-    def header(self):
-        self.set_fill_color(15, 23, 42)
-        self.rect(0, 0, 210, 45, 'F')
-        self.set_xy(10, 12)
-        self.set_font('Helvetica', 'B', 24)
-        self.set_text_color(255, 255, 255)
-        self.cell(0, 15, 'FLEXYLABEL PRODUCTION', ln=True)
-        self.set_font('Helvetica', '', 10)
-        self.set_text_color(56, 189, 248) # Cyan Accent
-        self.cell(0, 5, 'SISTEMA DE GESTIÓN DE ORDENES DE TRABAJO v6.0', ln=True)
-        self.ln(20)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Helvetica', 'I', 8)
-        self.set_text_color(128, 128, 128)
-        self.cell(0, 10, f'Página {self.page_no()} | Generado por FlexyLabel Enterprise', 0, 0, 'C')
-
-    def chapter_title(self, label):
-        self.set_font('Helvetica', 'B', 12)
-        self.set_fill_color(241, 245, 249)
-        self.set_text_color(15, 23, 42)
-        self.ln(5)
-        self.cell(0, 10, f"  {label.upper()}", 0, 1, 'L', True)
-        self.ln(2)
-
-    def chapter_body_row(self, label, value, label2=None, value2=None):
-        self.set_font('Helvetica', 'B', 10)
-        self.set_text_color(71, 85, 105)
-        self.cell(40, 8, f"{label}:", 0)
-        self.set_font('Helvetica', '', 10)
-        self.set_text_color(15, 23, 42)
-        self.cell(55, 8, f"{value}", 0)
-        if label2 and value2:
-            self.set_font('Helvetica', 'B', 10)
-            self.set_text_color(71, 85, 105)
-            self.cell(40, 8, f"{label2}:", 0)
-            self.set_font('Helvetica', '', 10)
-            self.set_text_color(15, 23, 42)
-            self.cell(0, 8, f"{value2}", 0)
-        self.ln(8)
-
-    def add_notes(self, text):
-        self.ln(5)
-        self.set_font('Helvetica', '', 10)
-        self.set_text_color(50, 50, 50)
-        self.multi_cell(0, 5, text)
 
-# =============================================================================
-# 5. SERVICIO DE CORREO (DUAL SEND - FIXED)
-# =============================================================================
-class EmailService:
-    @staticmethod
-    def send_production_order(client_data: ClienteDTO, prod_data: ProduccionDTO, pdf_path: str):
-        try:
-            user = st.secrets["email_usuario"]
-            pwd = st.secrets["email_password"]
-            
-            # --- 1. EMAIL TALLER ---
-            msg_taller = MIMEMultipart()
-            msg_taller['From'] = user
-            msg_taller['To'] = "covet@etiquetes.com"
-            msg_taller['Subject'] = f"🏭 [PROD] {client_data.razon_social} | REF: {client_data.referencia_interna}"
-            
-            msg_taller.attach(MIMEText(f"Nueva orden generada.\nCliente: {client_data.razon_social}\nRef: {client_data.referencia_interna}", 'plain'))
-
-            with open(pdf_path, "rb") as f:
-                pdf_data = f.read()
-                
-                # Adjunto Ficha Taller
-                part_taller = MIMEBase('application', 'octet-stream')
-                part_taller.set_payload(pdf_data)
-                encoders.encode_base64(part_taller)
-                part_taller.add_header('Content-Disposition', f'attachment; filename="Ficha_{client_data.referencia_interna}.pdf"')
-                msg_taller.attach(part_taller)
-
-            # Adjunto Arte Final Taller
-            if prod_data.arte_final:
-                af_part = MIMEBase('application', 'octet-stream')
-                af_part.set_payload(prod_data.arte_final.getvalue())
-                encoders.encode_base64(af_part)
-                af_part.add_header('Content-Disposition', f'attachment; filename="ARTE_FINAL.pdf"')
-                msg_taller.attach(af_part)
-
-            # --- 2. EMAIL CLIENTE ---
-            msg_cliente = MIMEMultipart()
-            msg_cliente['From'] = user
-            msg_cliente['To'] = client_data.email_contacto
-            msg_cliente['Subject'] = f"✅ Pedido Recibido: {client_data.referencia_interna} - FlexyLabel"
-
-            msg_cliente.attach(MIMEText(f"Hola,\n\nSu pedido para {client_data.razon_social} está en marcha.\nAdjuntamos ficha técnica.", 'plain'))
-
-            # Adjunto Ficha Cliente
-            part_cliente = MIMEBase('application', 'octet-stream')
-            part_cliente.set_payload(pdf_data)
-            encoders.encode_base64(part_cliente)
-            part_cliente.add_header('Content-Disposition', f'attachment; filename="Ficha_Tecnica.pdf"')
-            msg_cliente.attach(part_cliente)
-
-            # --- ENVÍO ---
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-                server.login(user, pwd)
-                server.send_message(msg_taller)
-                server.send_message(msg_cliente)
-                
-            return True
-        except Exception as e:
-            logger.error(f"Error SMTP: {e}")
-            st.error(f"Error SMTP: {e}")
-            return False
+@functools.lru_cache(maxsize=1)
+def _css_version() -> str:
+    """Hash corto del contenido del CSS: cambia la URL sólo cuando cambia el fichero."""
+    with open(CSS_PATH, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+@functools.lru_cache(maxsize=1)
+def _css_inline() -> str:
+    """Respaldo sin servidor estático: el mismo CSS, leído una vez por proceso.
+
+    Sin /app/static los woff2 no se pueden descargar: se quitan las
+    @font-face y quedan las fuentes instaladas o la pila del sistema.
+    """
+    with open(CSS_PATH, encoding="utf-8") as f:
+        css = re.sub(r"@font-face\s*{[^}]*}\s*", "", f.read())
+    return f"<style>{css}</style>"
+
+
+def inject_dynamic_css():
+    # Un <link> de ~100 bytes por rerun; el navegador descarga y cachea la hoja una vez
+    if st.get_option("server.enableStaticServing"):
+        st.markdown(f'<link rel="stylesheet" href="app/static/{CSS_ESTATICO}?v={_css_version()}">',
+                    unsafe_allow_html=True)
+    else:
+        st.markdown(_css_inline(), unsafe_allow_html=True)
+
+
+# Plantillas HTML compiladas una vez: el rerun sólo sustituye los valores
+CABECERA_HTML = (
+    '<div class="app-header"><div>'
+    '<h1 class="app-title">FLEXYLABEL</h1>'
+    '<p class="app-subtitle">PRODUCTION CONTROL UNIT v6.0</p>'
+    '</div><div><span class="status-badge">SYSTEM ONLINE</span></div></div>'
+)
+SECCION_HTML = ('<div class="section-header"><div class="section-number">{}</div>'
+                '<div class="section-title">{}</div></div>').format
+HUD_HTML = (
+    '<div class="hud-container">'
+    '<div class="hud-card"><div class="hud-label">METROS LINEALES</div><div class="hud-value">{ml} m</div></div>'
+    '<div class="hud-card"><div class="hud-label">SUPERFICIE TOTAL</div><div class="hud-value">{m2} m²</div></div>'
+    '<div class="hud-card hud-indigo"><div class="hud-label">ROLLOS · Ø EXTERIOR</div>'
+    '<div class="hud-value">{rollos} · {diametro:.0f} mm</div></div>'
+    '<div class="hud-card hud-ambar"><div class="hud-label">CONSUMO REAL (IMPOSICIÓN)</div>'
+    '<div class="hud-value">{imp_valor}</div><div class="hud-label hud-detalle">{imp_detalle}</div></div>'
+    '</div>'
+).format
+BOBINADO_ACTIVO_HTML = ('<div class="bobinado-activo"><span class="bobinado-activo-label">CONFIGURACIÓN ACTIVA:</span>'
+                        '<span class="bobinado-activo-valor">POSICIÓN {}</span></div>').format
 
 # =============================================================================
-# 6. LÓGICA DE NEGOCIO
+# 4. RECURSOS DEL PROCESO (OUTBOX, TRABAJOS, MÉTRICAS)
 # =============================================================================
-class CalculadoraProduccion:
-    @staticmethod
-    def calcular_consumos(specs: EspecificacionesDTO):
-        gap = 3 
-        ml = (specs.cantidad_total * (specs.largo_mm + gap)) / 1000
-        m2 = (specs.ancho_mm * specs.largo_mm * specs.cantidad_total) / 1_000_000
-        return round(ml, 2), round(m2, 2)
+@st.cache_resource
+def get_outbox():
+    """Outbox, pool SMTP y worker de entrega compartidos por todas las sesiones del proceso."""
+    smtp_config = SMTPConfig(
+        host=get_config("smtp_host", "smtp.gmail.com"),
+        port=int(get_config("smtp_port", 465)),
+        user=st.secrets["email_usuario"],
+        password=st.secrets["email_password"],
+        use_ssl=bool(get_config("smtp_ssl", True)),
+    )
+    pool = SMTPConnectionPool(
+        smtp_config,
+        max_size=int(get_config("smtp_pool_size", 2)),
+        max_age=float(get_config("smtp_max_session_age", 300)),
+    )
+    outbox = OutboxQueue(get_config("outbox_db", "outbox.db"))
+    worker = OutboxWorker(outbox, pool, tareas=[
+        functools.partial(volcar_resumen_taller, outbox, get_historial(), st.secrets["email_usuario"]),
+    ])
+    worker.start()
+    METRICAS.registrar_gauge("outbox_pendientes", outbox.depth, "Mensajes pendientes en el outbox")
+    METRICAS.registrar_gauge(
+        "smtp_pool_eventos", lambda: {(("evento", k),): v for k, v in pool.stats.items()},
+        "Eventos acumulados del pool SMTP (conexiones, reutilizaciones, reconexiones...)",
+    )
+    return outbox, worker
+
+
+@st.cache_resource
+def get_gestor_trabajos() -> GestorTrabajos:
+    """Pools de render (procesos) y de E/S (hilos) compartidos por todas las sesiones."""
+    gestor = GestorTrabajos(
+        procesos=get_config("render_procesos"),
+        hilos=int(get_config("io_hilos", 4)),
+        max_por_sesion=int(get_config("trabajos_por_sesion", 2)),
+        max_pendientes=get_config("trabajos_max_pendientes"),
+    )
+    METRICAS.registrar_gauge("trabajos_activos", gestor.activos, "Órdenes en render o encolado")
+    return gestor
+
+
+@st.cache_resource
+def get_exportador_metricas():
+    """Exporta las métricas en texto Prometheus: fichero (`metricas_fichero`) y/o HTTP (`metricas_puerto`)."""
+    fichero = get_config("metricas_fichero")
+    puerto = get_config("metricas_puerto")
+    if not fichero and not puerto:
+        return None
+    exportador = ExportadorMetricas(fichero=fichero, puerto=puerto,
+                                    intervalo=float(get_config("metricas_intervalo", 15)))
+    exportador.start()
+    return exportador
+
+
+def render_outbox_metrics():
+    """Panel lateral con la profundidad de la cola y la latencia de entrega."""
+    try:
+        outbox, _ = get_outbox()
+        m = outbox.metrics()
+    except Exception as e:
+        logger.error(f"Outbox no disponible: {e}")
+        return
+    with st.sidebar:
+        st.markdown("**OUTBOX SMTP**")
+        st.metric("En cola", m["queue_depth"])
+        st.metric("Enviados", m["sent_total"])
+        st.metric("Fallidos", m["failed_total"])
+        if m["delivery_latency_p50_s"] is not None:
+            st.metric("Latencia entrega p50 / p95", f'{m["delivery_latency_p50_s"]} s / {m["delivery_latency_p95_s"]} s')
 
 # =============================================================================
-# 7. INTERFAZ DE USUARIO (MAIN APP)
+# 5. INTERFAZ DE USUARIO (MAIN APP)
 # =============================================================================
 def main():
+    get_exportador_metricas()
+    with span("rerun"):
+        _main()
+
+
+def _main():
     inject_dynamic_css()
+    render_outbox_metrics()
     
     if 'winding_pos' not in st.session_state:
         st.session_state.winding_pos = "3"
 
     # Encabezado Minimalista
-    st.markdown("""
-        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; padding: 0 20px;">
-            <div>
-                <h1 style="font-weight: 800; font-size: 2.5rem; margin:0; background: linear-gradient(90deg, #38bdf8, #818cf8); -webkit-background-clip: text; -webkit-text-fill-color: transparent;">FLEXYLABEL</h1>
-                <p style="color: #94a3b8; margin:0; font-family:'JetBrains Mono'; font-size: 0.9rem;">PRODUCTION CONTROL UNIT v6.0</p>
-            </div>
-            <div style="text-align:right;">
-                <span style="background: rgba(16, 185, 129, 0.2); color: #34d399; padding: 5px 12px; border-radius: 20px; font-size: 0.8rem; font-weight: bold; border: 1px solid rgba(52, 211, 153, 0.3);">SYSTEM ONLINE</span>
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
-
-    c_main = st.container()
-
-    with c_main:
-        with st.form("production_form"):
-            
-            # SECCIÓN 1
-            st.markdown('<div class="section-header"><div class="section-number">1</div><div class="section-title">DATOS CLIENTE</div></div>', unsafe_allow_html=True)
-            c1, c2, c3 = st.columns([3, 3, 2])
-            cliente_input = c1.text_input("Razón Social", placeholder="Empresa S.L.")
-            email_input = c2.text_input("Email Contacto", placeholder="nombre@dominio.com")
-            ref_input = c3.text_input("Ref. Pedido", value=f"ORD-{datetime.date.today().year}-X")
-
-            # SECCIÓN 2
-            st.markdown('<div class="section-header"><div class="section-number">2</div><div class="section-title">ESPECIFICACIONES</div></div>', unsafe_allow_html=True)
-            c4, c5, c6 = st.columns(3)
-            ancho_val = c4.number_input("Ancho (mm)", min_value=10, value=100)
-            largo_val = c5.number_input("Largo (mm)", min_value=10, value=100)
-            cant_val = c6.number_input("Total (Uds)", min_value=100, value=5000, step=100)
-
-            c7, c8, c9 = st.columns(3)
-            mat_val = c7.selectbox("Material", ["PP Blanco", "PP Transparente", "Couché", "Térmico Eco", "Térmico Top", "Verjurado Cream"])
-            mandril_val = c8.selectbox("Mandril", ["Ø 76 mm", "Ø 40 mm", "Ø 25 mm"])
-            etq_rollo_val = c9.number_input("Uds / Rollo", min_value=100, value=1000)
-
-            # SECCIÓN 3: BOBINADO (VISUAL)
-            st.markdown('<div class="section-header"><div class="section-number">3</div><div class="section-title">SENTIDO DE SALIDA</div></div>', unsafe_allow_html=True)
-            
-            # Contenedor con borde sutil para agrupar visualmente el bobinado
-            st.markdown('<div style="background: rgba(0,0,0,0.2); padding: 20px; border-radius: 12px; border: 1px solid rgba(255,255,255,0.05);">', unsafe_allow_html=True)
-            cols_svg = st.columns(8)
-            for i in range(1, 9):
-                with cols_svg[i-1]:
-                    svg_data = get_winding_svg(i)
-                    st.image(svg_data, use_container_width=True)
-                    # Custom selection logic
-                    is_active = (str(i) == st.session_state.winding_pos)
-                    if st.checkbox(f"P{i}", value=is_active, key=f"chk_{i}"):
-                        st.session_state.winding_pos = str(i)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Feedback visual
-            st.markdown(f"""
-                <div style="margin-top: 15px; display: flex; align-items: center; justify-content: center; gap: 10px;">
-                    <span style="color: #94a3b8; font-size: 0.9rem;">CONFIGURACIÓN ACTIVA:</span>
-                    <span style="color: #38bdf8; font-family: 'JetBrains Mono'; font-weight: 800; font-size: 1.2rem;">POSICIÓN {st.session_state.winding_pos}</span>
-                </div>
-            """, unsafe_allow_html=True)
-
-            # SECCIÓN 4
-            st.markdown('<div class="section-header"><div class="section-number">4</div><div class="section-title">ARCHIVOS</div></div>', unsafe_allow_html=True)
-            c10, c11 = st.columns([1, 1])
-            archivo_af = c10.file_uploader("Subir Arte Final (PDF)", type=["pdf"])
-            notas_prod = c11.text_area("Notas Técnicas", height=100, placeholder="Instrucciones para operador...")
-
-            # HUD DE MÉTRICAS
-            calc = CalculadoraProduccion()
-            specs_obj = EspecificacionesDTO(ancho_val, largo_val, cant_val, mat_val, mandril_val, etq_rollo_val)
-            ml_res, m2_res = calc.calcular_consumos(specs_obj)
-
-            st.markdown(f"""
-                <div class="hud-container">
-                    <div class="hud-card">
-                        <div class="hud-label">METROS LINEALES</div>
-                        <div class="hud-value">{ml_res} m</div>
-                    </div>
-                    <div class="hud-card">
-                        <div class="hud-label">SUPERFICIE TOTAL</div>
-                        <div class="hud-value">{m2_res} m²</div>
-                    </div>
-                    <div class="hud-card" style="border-top-color: #818cf8;">
-                        <div class="hud-label">ESTADO BOBINA</div>
-                        <div class="hud-value" style="color: #818cf8;">P-{st.session_state.winding_pos}</div>
-                    </div>
-                </div>
-            """, unsafe_allow_html=True)
-
-            submit_btn = st.form_submit_button("🚀 INICIAR ORDEN DE PRODUCCIÓN")
-
-            if submit_btn:
-                if not cliente_input or not archivo_af or not email_input:
-                    st.error("⚠️ FALTAN DATOS CRÍTICOS: Revise Cliente, Email y Archivo.")
+    st.markdown(CABECERA_HTML, unsafe_allow_html=True)
+
+    tab_orden, tab_historial = st.tabs(["🚀 NUEVA ORDEN", "🗂️ HISTORIAL"])
+    with tab_historial:
+        _render_historial()
+
+    with tab_orden, st.container(key="production_form"):
+        _render_datos_cliente()
+        _render_especificaciones()
+        _render_bobinado()
+        _render_archivos()
+
+        submit_btn = st.button("🚀 INICIAR ORDEN DE PRODUCCIÓN", key="submit_order")
+
+        if submit_btn:
+            ss = st.session_state
+            max_mb, _ = limites_arte_final()
+            with span("validacion"):
+                if not ss.f_cliente or not ss.f_arte_final or not ss.f_email:
+                    error = "⚠️ FALTAN DATOS CRÍTICOS: Revise Cliente, Email y Archivo."
+                elif tamano_arte_final(ss.f_arte_final) > max_mb * 2**20:
+                    error = f"⚠️ ARTE FINAL DEMASIADO GRANDE: máximo {max_mb} MB."
                 else:
-                    with st.spinner("⏳ PROCESANDO ORDEN..."):
-                        # DTOs
-                        cliente_dto = ClienteDTO(cliente_input, email_input, ref_input)
-                        prod_dto = ProduccionDTO(st.session_state.winding_pos, notas_prod, archivo_af)
-
-                        # Generar PDF
-                        pdf = EnterprisePDF()
-                        pdf.add_page()
-                        pdf.chapter_title("Datos Generales")
-                        pdf.chapter_body_row("Cliente", cliente_dto.razon_social, "Ref", cliente_dto.referencia_interna)
-                        pdf.chapter_body_row("Email", cliente_dto.email_contacto, "Fecha", datetime.date.today().strftime("%d/%m/%Y"))
-                        
-                        pdf.chapter_title("Especificaciones")
-                        pdf.chapter_body_row("Material", specs_obj.material, "Mandril", specs_obj.mandril)
-                        pdf.chapter_body_row("Medidas", f"{specs_obj.ancho_mm} x {specs_obj.largo_mm} mm", "Cantidad", f"{specs_obj.cantidad_total}")
-                        
-                        pdf.chapter_title("Configuración")
-                        pdf.chapter_body_row("Bobinado", f"POSICIÓN {prod_dto.sentido_bobinado}", "Uds/Rollo", str(specs_obj.uds_rollo))
-                        pdf.chapter_body_row("Metraje", f"{ml_res} m", "Área", f"{m2_res} m2")
-                        
-                        if prod_dto.notas_maquinista:
-                            pdf.chapter_title("Notas")
-                            pdf.add_notes(prod_dto.notas_maquinista)
-
-                        temp_pdf_name = f"OT_{cliente_dto.referencia_interna}.pdf"
-                        pdf.output(temp_pdf_name)
-
-                        # Enviar (Sin globos, con mensaje profesional)
-                        email_service = EmailService()
-                        if email_service.send_production_order(cliente_dto, prod_dto, temp_pdf_name):
-                            st.success(f"✅ ORDEN PROCESADA CORRECTAMENTE. Notificación enviada a Taller y Cliente.", icon="✅")
-                            if os.path.exists(temp_pdf_name):
-                                os.remove(temp_pdf_name)
+                    error = None
+            if error:
+                METRICAS.incrementar("validaciones_rechazadas_total", ayuda="Envíos rechazados en la validación")
+                st.error(error)
+            else:
+                _procesar_envio()
+
+        _render_trabajos()
+
+
+def clave_envio() -> str:
+    """Clave de idempotencia: el mismo formulario en la misma sesión da la misma clave."""
+    ss = st.session_state
+    if "f_nonce" not in ss:
+        ss.f_nonce = uuid.uuid4().hex
+    partes = (
+        ss.f_nonce, ss.f_cliente, ss.f_email, ss.f_ref, ss.f_ancho, ss.f_largo, ss.f_cantidad,
+        ss.f_material, ss.f_mandril, ss.f_uds_rollo, ss.winding_pos, ss.f_notas,
+        getattr(ss.f_arte_final, "file_id", ""),
+    )
+    return hashlib.sha256("\x1f".join(map(str, partes)).encode()).hexdigest()
+
+
+def _nueva_orden():
+    st.session_state.f_nonce = uuid.uuid4().hex
+
+
+def _sesion_id() -> str:
+    if "sesion_id" not in st.session_state:
+        st.session_state.sesion_id = uuid.uuid4().hex
+    return st.session_state.sesion_id
+
+
+def _despachar(cliente_dto: ClienteDTO, specs_obj: EspecificacionesDTO, prod_dto: ProduccionDTO,
+               al_completar=None, al_fallar=None, registrar: bool = True, fecha: datetime.date = None):
+    """Envía la orden al gestor de trabajos: render en un proceso, correo y encolado en un hilo."""
+    outbox, worker = get_outbox()
+    mail_from = st.secrets["email_usuario"]
+
+    def encolar(pdf_data):
+        encolar_orden(outbox, mail_from, cliente_dto, prod_dto, pdf_data, specs_obj, registrar)
+        if al_completar:
+            al_completar()
+        worker.wake()
+
+    return get_gestor_trabajos().enviar(_sesion_id(), cliente_dto, specs_obj, prod_dto, encolar,
+                                        al_fallar=al_fallar, fecha=fecha)
+
+
+def _procesar_envio():
+    """Despacha la orden una sola vez por clave de envío.
+
+    Un doble clic o un rerun mientras la orden está en curso encuentra la clave
+    reservada y muestra el resultado previo sin volver a renderizar ni enviar.
+    La clave se completa (o se libera si falla) al terminar el trabajo.
+    """
+    ss = st.session_state
+    historial = get_historial()
+    clave = clave_envio()
+    previo = historial.reservar_envio(clave)
+    if previo is not None:
+        METRICAS.incrementar("envios_duplicados_total", ayuda="Envíos descartados por clave de idempotencia")
+        if previo["estado"] == ENVIO_COMPLETADO:
+            st.info(f"ℹ️ ESTA ORDEN YA SE ENVIÓ COMO {previo['referencia']}. No se ha vuelto a generar ni enviar.")
+            st.button("➕ NUEVA ORDEN CON LOS MISMOS DATOS", key="nueva_orden", on_click=_nueva_orden)
+        else:
+            st.warning("⏳ ESTA ORDEN YA SE ESTÁ PROCESANDO. Espere la confirmación.")
+        return
+
+    try:
+        with contexto_log(clave=clave[:12]), span("despacho"):
+            # Antes de consumir un número de la secuencia de referencias
+            get_gestor_trabajos().comprobar(_sesion_id())
+
+            # DTOs (referencia única de la secuencia del servidor si no se indica una)
+            with span("dtos"):
+                referencia = ss.f_ref.strip() or historial.siguiente_referencia()
+                cliente_dto = ClienteDTO(ss.f_cliente, ss.f_email, referencia)
+                specs_obj = especificaciones_actuales()
+                prod_dto = ProduccionDTO(ss.winding_pos, ss.f_notas, ss.f_arte_final)
+
+            _despachar(cliente_dto, specs_obj, prod_dto,
+                       al_completar=lambda: historial.completar_envio(clave, referencia),
+                       al_fallar=lambda: historial.liberar_envio(clave))
+    except LimiteTrabajos as e:
+        historial.liberar_envio(clave)
+        st.warning(f"⏳ {e}")
+        return
+    except Exception as e:
+        historial.liberar_envio(clave)
+        logger.error(f"Error al despachar orden: {e}")
+        st.error(f"Error al encolar orden: {e}")
+        return
+
+    if resumen_taller_activo():
+        st.success(f"✅ ORDEN {referencia} EN PROCESO. El cliente recibirá la confirmación al terminar; "
+                   "el Taller, en el próximo resumen.", icon="✅")
+    else:
+        st.success(f"✅ ORDEN {referencia} EN PROCESO. Se notificará a Taller y Cliente al terminar.", icon="✅")
+
+
+ICONOS_TRABAJO = {
+    TRABAJO_EN_COLA: "🕓", TRABAJO_RENDER: "⚙️", TRABAJO_ENCOLANDO: "📨",
+    TRABAJO_COMPLETADO: "✅", TRABAJO_ERROR: "❌",
+}
+
+
+def _panel_trabajos(trabajos):
+    for t in trabajos[-5:]:
+        texto = f"{ICONOS_TRABAJO[t.estado]} {t.referencia} · {t.estado.replace('_', ' ').upper()} · {t.duracion_s:.1f} s"
+        if t.error:
+            st.error(f"{texto} — {t.error}")
+        else:
+            st.caption(texto)
+
+
+@st.fragment(run_every=1.0)
+def _panel_trabajos_vivo():
+    trabajos = get_gestor_trabajos().de_sesion(_sesion_id())
+    _panel_trabajos(trabajos)
+    if not any(t.activo for t in trabajos):
+        st.rerun()  # rerun completo: deja de refrescar
+
+
+def _render_trabajos():
+    """Estado de las órdenes de la sesión; se refresca cada segundo mientras haya alguna en curso."""
+    trabajos = get_gestor_trabajos().de_sesion(_sesion_id())
+    if any(t.activo for t in trabajos):
+        _panel_trabajos_vivo()
+    elif trabajos:
+        _panel_trabajos(trabajos)
+
+
+# --- Fragmentos: cada sección se re-ejecuta sola al interactuar con ella ---
+@st.fragment
+def _render_datos_cliente():
+    # SECCIÓN 1
+    st.markdown(SECCION_HTML(1, "DATOS CLIENTE"), unsafe_allow_html=True)
+    c1, c2, c3 = st.columns([3, 3, 2])
+    c1.text_input("Razón Social", placeholder="Empresa S.L.", key="f_cliente")
+    c2.text_input("Email Contacto", placeholder="nombre@dominio.com", key="f_email")
+    c3.text_input("Ref. Pedido", placeholder=f"ORD-{datetime.date.today().year}-… (automática)", key="f_ref")
+
+
+def especificaciones_actuales() -> EspecificacionesDTO:
+    ss = st.session_state
+    return EspecificacionesDTO(ss.f_ancho, ss.f_largo, ss.f_cantidad, ss.f_material, ss.f_mandril, ss.f_uds_rollo)
+
+
+@st.fragment
+def _render_especificaciones():
+    # SECCIÓN 2
+    st.markdown(SECCION_HTML(2, "ESPECIFICACIONES"), unsafe_allow_html=True)
+    c4, c5, c6 = st.columns(3)
+    c4.number_input("Ancho (mm)", min_value=10, value=100, key="f_ancho")
+    c5.number_input("Largo (mm)", min_value=10, value=100, key="f_largo")
+    c6.number_input("Total (Uds)", min_value=100, value=5000, step=100, key="f_cantidad")
+
+    c7, c8, c9 = st.columns(3)
+    c7.selectbox("Material", MATERIALES, key="f_material")
+    c8.selectbox("Mandril", MANDRILES, key="f_mandril")
+    c9.number_input("Uds / Rollo", min_value=100, value=1000, key="f_uds_rollo")
+
+    # HUD DE MÉTRICAS
+    specs_obj = especificaciones_actuales()
+    ml_res, m2_res = CalculadoraProduccion.calcular_consumos(specs_obj)
+    rollos_res, diametro_res = CalculadoraProduccion.calcular_rollos(specs_obj)
+    imp = CalculadoraProduccion.optimizar_imposicion(specs_obj.ancho_mm, specs_obj.largo_mm, specs_obj.cantidad_total, specs_obj.material)
+    if imp:
+        imp_valor = f"{imp.m2_consumidos} m²"
+        imp_detalle = f"{imp.calles} calles · banda {imp.ancho_banda_mm:.0f} mm · Z{imp.z_cilindro} · merma {imp.merma_pct}%"
+    else:
+        imp_valor, imp_detalle = "—", "No cabe en ningún ancho de banda"
+
+    st.markdown(HUD_HTML(ml=ml_res, m2=m2_res, rollos=rollos_res, diametro=diametro_res,
+                         imp_valor=imp_valor, imp_detalle=imp_detalle), unsafe_allow_html=True)
+
+
+def _seleccionar_bobinado(pos: int):
+    """Selección exclusiva: marcar una posición desmarca las demás."""
+    if st.session_state[f"chk_{pos}"]:
+        st.session_state.winding_pos = str(pos)
+    for i in range(1, 9):
+        st.session_state[f"chk_{i}"] = (str(i) == st.session_state.winding_pos)
+
+
+@st.fragment
+def _render_bobinado():
+    # SECCIÓN 3: BOBINADO (VISUAL)
+    st.markdown(SECCION_HTML(3, "SENTIDO DE SALIDA"), unsafe_allow_html=True)
+
+    # Contenedor con borde sutil para agrupar visualmente el bobinado
+    st.markdown('<div class="bobinado-panel">', unsafe_allow_html=True)
+    sprite_sheet = get_config("winding_sprite_sheet", True)
+    if sprite_sheet:
+        st.image(get_winding_sprite_sheet(), width="stretch")
+    cols_svg = st.columns(8)
+    for i in range(1, 9):
+        with cols_svg[i-1]:
+            if not sprite_sheet:
+                st.image(get_winding_svg(i), width="stretch")
+            if f"chk_{i}" not in st.session_state:
+                st.session_state[f"chk_{i}"] = (str(i) == st.session_state.winding_pos)
+            st.checkbox(f"P{i}", key=f"chk_{i}", on_change=_seleccionar_bobinado, args=(i,))
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Feedback visual (dentro del fragmento para refrescarse junto al selector)
+    st.markdown(BOBINADO_ACTIVO_HTML(st.session_state.winding_pos), unsafe_allow_html=True)
+
+
+@st.fragment
+def _render_archivos():
+    # SECCIÓN 4
+    st.markdown(SECCION_HTML(4, "ARCHIVOS"), unsafe_allow_html=True)
+    c10, c11 = st.columns([1, 1])
+    c10.file_uploader("Subir Arte Final (PDF)", type=["pdf"], key="f_arte_final")
+    c11.text_area("Notas Técnicas", height=100, placeholder="Instrucciones para operador...", key="f_notas")
+
+
+def _ficha_pdf(cliente_dto, specs_obj, prod_dto, fecha) -> bytes:
+    return bytes(generar_orden_pdf(cliente_dto, specs_obj, prod_dto, fecha=fecha))
+
+
+def _etiquetas_rollo_pdf(cliente_dto, specs_obj, prod_dto) -> bytes:
+    buffer = io.BytesIO()
+    generar_etiquetas_rollo(buffer, cliente_dto, specs_obj, prod_dto)
+    return buffer.getvalue()
+
+
+def _reiniciar_paginas():
+    st.session_state.h_cursores = [None]
+
+
+def _pagina_anterior():
+    st.session_state.h_cursores.pop()
+
+
+def _pagina_siguiente(cursor):
+    st.session_state.h_cursores.append(cursor)
+
+
+@st.fragment
+def _render_historial():
+    ss = st.session_state
+    if "h_cursores" not in ss:
+        _reiniciar_paginas()
+
+    c1, c2, c3 = st.columns([3, 2, 2])
+    c1.text_input("Buscar", placeholder="Referencia o razón social (prefijo)", key="h_texto", on_change=_reiniciar_paginas)
+    c2.selectbox("Material", ["Todos"] + MATERIALES, key="h_material", on_change=_reiniciar_paginas)
+    c3.date_input("Fechas", value=(), format="DD/MM/YYYY", key="h_fechas", on_change=_reiniciar_paginas)
+
+    fechas = tuple(ss.h_fechas or ())
+    t0 = time.perf_counter()
+    filas, siguiente = get_historial().buscar(
+        texto=ss.h_texto.strip() or None,
+        material=None if ss.h_material == "Todos" else ss.h_material,
+        desde=fechas[0] if fechas else None,
+        hasta=fechas[-1] if fechas else None,
+        limite=int(get_config("historial_pagina", 25)),
+        cursor=ss.h_cursores[-1],
+    )
+    consulta_ms = (time.perf_counter() - t0) * 1000
+
+    tabla = st.dataframe(
+        [{
+            "Fecha": datetime.datetime.fromtimestamp(f["created_at"]).strftime("%d/%m/%Y %H:%M"),
+            "Ref": f["referencia_interna"],
+            "Cliente": f["razon_social"],
+            "Material": f["material"],
+            "Medidas (mm)": f"{f['ancho_mm']:g} x {f['largo_mm']:g}",
+            "Cantidad": f["cantidad_total"],
+        } for f in filas],
+        hide_index=True, width="stretch",
+        on_select="rerun", selection_mode="single-row", key="h_tabla",
+    )
+    p1, p2, p3 = st.columns([1, 4, 1])
+    p1.button("◀ Anterior", disabled=len(ss.h_cursores) == 1, key="h_anterior", on_click=_pagina_anterior)
+    p2.caption(f"Página {len(ss.h_cursores)} · {len(filas)} pedidos · consulta {consulta_ms:.1f} ms")
+    p3.button("Siguiente ▶", disabled=siguiente is None, key="h_siguiente", on_click=_pagina_siguiente, args=(siguiente,))
+
+    seleccion = tabla.selection.rows
+    if not seleccion or seleccion[0] >= len(filas):
+        return
+    fila = filas[seleccion[0]]
+    cliente_dto, specs_obj, prod_dto = pedido_a_dtos(fila)
+    fecha = datetime.date.fromtimestamp(fila["created_at"])
+
+    a1, a2, a3 = st.columns(3)
+    a1.download_button(
+        "🖨️ REIMPRIMIR FICHA",
+        # Como las etiquetas: el PDF se genera al pulsar, no en cada rerun del historial
+        data=functools.partial(_ficha_pdf, cliente_dto, specs_obj, prod_dto, fecha),
+        file_name=f"Ficha_{cliente_dto.referencia_interna}.pdf",
+        mime="application/pdf",
+        key="h_reimprimir",
+        on_click="ignore",
+    )
+    a3.download_button(
+        "🏷️ ETIQUETAS DE ROLLO",
+        # Se generan sólo al pulsar: una orden grande puede tener miles de rollos
+        data=functools.partial(_etiquetas_rollo_pdf, cliente_dto, specs_obj, prod_dto),
+        file_name=f"Etiquetas_{cliente_dto.referencia_interna}.pdf",
+        mime="application/pdf",
+        key="h_etiquetas",
+        on_click="ignore",
+    )
+    if a2.button("📨 REENVIAR A TALLER Y CLIENTE", key="h_reenviar"):
+        if fila["arte_sha256"] and prod_dto.arte_final is None:
+            st.warning("El arte final ya no está en el almacén; se reenvía sólo la ficha.")
+        try:
+            _despachar(cliente_dto, specs_obj, prod_dto, registrar=False, fecha=fecha)
+            st.success(f"✅ REENVÍO DE {cliente_dto.referencia_interna} EN PROCESO. Estado en la pestaña NUEVA ORDEN.")
+        except LimiteTrabajos as e:
+            st.warning(f"⏳ {e}")
+        except Exception as e:
+            logger.error(f"Error al reenviar orden: {e}")
+            st.error(f"Error al encolar orden: {e}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,236 @@
+import hmac
+import os
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+# =============================================================================
+# ARTE FINAL: ALMACÉN DIRECCIONADO POR CONTENIDO, LÍMITE DE TAMAÑO Y ENLACES
+# =============================================================================
+# El PDF subido nunca se copia entero en memoria: se vuelca por bloques al
+# almacén mientras se calcula su SHA-256. Cada arte final se guarda una sola
+# vez (`<sha256>.pdf`); los pedidos repetidos con el mismo fichero no se
+# vuelven a codificar ni adjuntar, sólo se referencia la copia almacenada.
+# Un fichero cuenta como recibido por el taller cuando el correo que lo
+# adjunta ya está en el outbox (`marcar_entregados`), no al guardarlo: si ese
+# primer envío falla, el siguiente intento lo vuelve a adjuntar.
+# El almacén no es público: los enlaces de descarga apuntan a la API
+# (GET /api/v1/arte-final/<sha256>) y llevan caducidad y una firma HMAC con
+# una clave guardada en el índice del almacén, compartida por UI y API.
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+CHUNK_BYTES = 1024 * 1024
+
+_SHA256_HEX = re.compile(r"[0-9a-f]{64}")
+
+
+def es_sha256(valor: str) -> bool:
+    """True si `valor` es un sha256 en hex (minúsculas): sólo entonces se usa en una ruta."""
+    return isinstance(valor, str) and _SHA256_HEX.fullmatch(valor) is not None
+
+
+class ArteFinalDemasiadoGrande(ValueError):
+    pass
+
+
+@dataclass
+class ArteFinalPreparado:
+    path: str             # objeto del almacén
+    size: int
+    sha256: str
+    adjuntar: bool        # False -> se envía `enlace` en lugar del adjunto
+    enlace: str
+    repetido: bool = False  # el taller ya recibió este mismo fichero
+
+
+class ArchivoLocal:
+    """Arte final indicado por ruta; se lee por bloques al construir el correo."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+
+
+def tamano_arte_final(archivo) -> int:
+    """Tamaño en bytes de un UploadedFile o de un ArchivoLocal."""
+    size = getattr(archivo, "size", None)
+    if size is None:
+        size = os.path.getsize(archivo.path)
+    return size
+
+
+def _abrir(archivo):
+    if hasattr(archivo, "read"):
+        archivo.seek(0)
+        return archivo, False
+    return open(archivo.path, "rb"), True
+
+
+class AlmacenArteFinal:
+    """Almacén local de artes finales indexado por hash, con expulsión LRU por tamaño."""
+
+    def __init__(self, root: str, index_db: str, max_bytes: int):
+        self.root = root
+        self.index_db = index_db
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS objetos (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    entregado_en REAL  -- el correo que lo adjunta ya está en el outbox
+                );
+                CREATE INDEX IF NOT EXISTS idx_objetos_lru ON objetos(last_used_at);
+                CREATE TABLE IF NOT EXISTS referencias (
+                    sha256 TEXT NOT NULL,
+                    cliente TEXT NOT NULL,
+                    referencia TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_referencias_hash ON referencias(sha256);
+                CREATE INDEX IF NOT EXISTS idx_referencias_pedido ON referencias(cliente, referencia);
+                CREATE TABLE IF NOT EXISTS clave_enlaces (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    clave BLOB NOT NULL
+                );
+            """)
+            conn.execute("INSERT OR IGNORE INTO clave_enlaces (id, clave) VALUES (1, ?)", (secrets.token_bytes(32),))
+            self._clave_enlaces = conn.execute("SELECT clave FROM clave_enlaces").fetchone()[0]
+
+    def _connect(self):
+        return sqlite3.connect(self.index_db, timeout=30)
+
+    def ruta(self, sha256: str) -> str:
+        return os.path.join(self.root, f"{sha256}.pdf")
+
+    def firmar(self, sha256: str, caduca_en: int) -> str:
+        """Firma de un enlace de descarga válido hasta `caduca_en` (epoch, s)."""
+        return hmac.new(self._clave_enlaces, f"{sha256}:{int(caduca_en)}".encode(), "sha256").hexdigest()
+
+    def enlace_valido(self, sha256: str, caduca_en: int, firma: str) -> bool:
+        return time.time() < caduca_en and hmac.compare_digest(self.firmar(sha256, caduca_en), firma)
+
+    def guardar(self, archivo, cliente: str, referencia: str):
+        """Vuelca y hashea el fichero por bloques. Devuelve `(sha256, ruta, entregado)`.
+
+        `entregado` indica si el taller ya recibió este contenido (ver `marcar_entregados`).
+        """
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=self.root)
+        origen, cerrar = _abrir(archivo)
+        try:
+            with os.fdopen(fd, "wb") as destino:
+                while True:
+                    bloque = origen.read(CHUNK_BYTES)
+                    if not bloque:
+                        break
+                    digest.update(bloque)
+                    destino.write(bloque)
+            size = os.path.getsize(tmp)
+        finally:
+            if cerrar:
+                origen.close()
+
+        sha256 = digest.hexdigest()
+        path = self.ruta(sha256)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            nuevo = conn.execute(
+                "INSERT OR IGNORE INTO objetos (sha256, size, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (sha256, size, now, now),
+            ).rowcount == 1
+            if nuevo or not os.path.exists(path):
+                os.replace(tmp, path)
+            else:
+                os.remove(tmp)
+            entregado = False
+            if not nuevo:
+                conn.execute("UPDATE objetos SET last_used_at = ? WHERE sha256 = ?", (now, sha256))
+                entregado = conn.execute(
+                    "SELECT entregado_en IS NOT NULL FROM objetos WHERE sha256 = ?", (sha256,)
+                ).fetchone()[0] == 1
+            conn.execute(
+                "INSERT INTO referencias (sha256, cliente, referencia, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, cliente, referencia, now),
+            )
+            self._expulsar(conn, conservar=sha256)
+        return sha256, path, entregado
+
+    def marcar_entregados(self, hashes) -> None:
+        """El correo que lleva estos artes finales ya está encolado para el taller."""
+        with self._connect() as conn:
+            conn.executemany("UPDATE objetos SET entregado_en = ? WHERE sha256 = ? AND entregado_en IS NULL",
+                             [(time.time(), sha256) for sha256 in set(hashes)])
+
+    def buscar(self, sha256: str):
+        """Ruta del objeto si sigue en el almacén (y lo marca como usado)."""
+        if not es_sha256(sha256):
+            return None
+        with self._connect() as conn:
+            encontrado = conn.execute(
+                "UPDATE objetos SET last_used_at = ? WHERE sha256 = ?", (time.time(), sha256)
+            ).rowcount == 1
+        path = self.ruta(sha256)
+        return path if encontrado and os.path.exists(path) else None
+
+    def _expulsar(self, conn, conservar: str):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM objetos").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for sha256, size in conn.execute(
+            "SELECT sha256, size FROM objetos WHERE sha256 != ? ORDER BY last_used_at", (conservar,)
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.ruta(sha256))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM objetos WHERE sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM referencias WHERE sha256 = ?", (sha256,))
+            total -= size
+            logger.info(f"Arte final {sha256[:12]} expulsado del almacén ({size / 2**20:.1f} MB)")
+
+    def uso(self) -> dict:
+        with self._connect() as conn:
+            objetos, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objetos").fetchone()
+        return {"objetos": objetos, "bytes": total, "max_bytes": self.max_bytes}
+
+
+def preparar_arte_final(archivo, cliente: str, referencia: str, almacen: AlmacenArteFinal,
+                        max_bytes: int, adjunto_max_bytes: int,
+                        enlazar: Callable[[str], str]) -> ArteFinalPreparado:
+    """Guarda el arte final en el almacén y decide entre adjunto o enlace.
+
+    Se adjunta mientras el taller no lo haya recibido y no supere
+    `adjunto_max_bytes`; `enlazar(sha256)` da la URL de descarga. Lanza
+    ArteFinalDemasiadoGrande si supera `max_bytes`.
+    """
+    size = tamano_arte_final(archivo)
+    if size > max_bytes:
+        raise ArteFinalDemasiadoGrande(
+            f"El arte final ocupa {size / 2**20:.1f} MB (máximo {max_bytes / 2**20:.0f} MB)"
+        )
+
+    sha256, path, entregado = almacen.guardar(archivo, cliente, referencia)
+    return ArteFinalPreparado(
+        path=path,
+        size=size,
+        sha256=sha256,
+        adjuntar=not entregado and size <= adjunto_max_bytes,
+        enlace=enlazar(sha256),
+        repetido=entregado,
+    )
@@ -0,0 +1,51 @@
+"""CalculadoraProduccion: bucle escalar de Python vs. API por lotes (NumPy).
+
+    python benchmarks/bench_calculadora.py --skus 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from engine import MANDRILES, MATERIALES, CalculadoraProduccion, EspecificacionesDTO  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=10_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    n = args.skus
+    columnas = {
+        "ancho_mm": rng.integers(20, 300, n),
+        "largo_mm": rng.integers(20, 300, n),
+        "cantidad_total": rng.integers(1, 500, n) * 100,
+        "material": rng.choice(MATERIALES, n),
+        "mandril": rng.choice(MANDRILES, n),
+        "uds_rollo": rng.choice([250, 500, 1000, 2000], n),
+    }
+    specs = [
+        EspecificacionesDTO(*(columnas[c][i].item() for c in columnas))
+        for i in range(n)
+    ]
+
+    t0 = time.perf_counter()
+    escalar = [CalculadoraProduccion.calcular_consumos(s) + CalculadoraProduccion.calcular_rollos(s) for s in specs]
+    t_escalar = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    lote = CalculadoraProduccion.calcular_lote(**columnas)
+    t_lote = time.perf_counter() - t0
+
+    assert np.allclose([e[0] for e in escalar], lote["ml"])
+    print(f"{n} SKUs | bucle escalar: {t_escalar * 1000:.1f} ms | lote NumPy: {t_lote * 1000:.2f} ms "
+          f"(x{t_escalar / t_lote:.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Etiquetas de rollo: escritura en streaming vs. documento fpdf completo en memoria.
+
+El modo "fpdf" dibuja cada etiqueta entera con fpdf2 y llama a `output()` al
+final, que es lo que haría un `EnterprisePDF` normal; el modo "streaming" es
+`escribir_etiquetas`. La memoria es el pico de tracemalloc en una pasada aparte.
+
+    python benchmarks/bench_etiquetas_rollo.py --rollos 10000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from engine import ClienteDTO, EspecificacionesDTO, ProduccionDTO, valores_etiqueta  # noqa: E402
+from etiquetas_rollo import EtiquetaRolloPDF, escribir_etiquetas, get_plantilla_etiqueta  # noqa: E402
+
+CLIENTE = ClienteDTO("Etiquetas del Mediterráneo S.L.", "compras@example.com", "ORD-BENCH-000001")
+PROD = ProduccionDTO("3", "", None)
+UDS_ROLLO = 1000
+
+
+def fpdf_completo(destino, valores, rollos, uds_rollo, cantidad_total, formato="termica"):
+    """Una página fpdf por etiqueta (rótulos y valores), todo en memoria hasta `output()`."""
+    huecos = get_plantilla_etiqueta().huecos
+    pdf = EtiquetaRolloPDF()
+    ultimo = cantidad_total - uds_rollo * (rollos - 1)
+    for n in range(rollos):
+        if n:
+            pdf.add_page()
+        pdf.rect(1, 1, 98, 53)
+        textos = dict(valores, rollo=f"{n + 1} / {rollos}", uds=str(uds_rollo if n < rollos - 1 else ultimo))
+        for clave, x, y, w, tamano, estilo in huecos:
+            pdf.set_font('Helvetica', 'B', 6)
+            pdf.set_xy(x, y - 3)
+            pdf.cell(w, 3, clave.upper())
+            pdf.set_font('Helvetica', estilo, tamano)
+            pdf.set_xy(x, y)
+            pdf.cell(w, tamano * 0.45, pdf._ajustar(textos[clave], w))
+    destino.write(pdf.output())
+    return pdf.pages_count
+
+
+def medir(funcion, rollos, formato):
+    valores = valores_etiqueta(CLIENTE, EspecificacionesDTO(100, 50, rollos * UDS_ROLLO - 500, "PP Blanco", "Ø 76 mm", UDS_ROLLO), PROD)
+    args = (valores, rollos, UDS_ROLLO, rollos * UDS_ROLLO - 500, formato)
+    destino = io.BytesIO()
+    t0 = time.perf_counter()
+    paginas = funcion(destino, *args)
+    segundos = time.perf_counter() - t0
+
+    tracemalloc.start()
+    with open(os.devnull, "wb") as nulo:
+        funcion(nulo, *args)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return segundos, paginas, len(destino.getvalue()), pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rollos", type=int, default=10_000)
+    parser.add_argument("--rollos-fpdf", type=int, default=2_000,
+                        help="rollos del modo fpdf (escala lineal y es lento)")
+    args = parser.parse_args()
+
+    get_plantilla_etiqueta()
+    print(f"{'modo':<22}{'rollos':>8}{'s':>9}{'rollos/s':>11}{'páginas':>9}{'KB':>9}{'pico KB':>10}")
+    filas = [
+        ("streaming a4", escribir_etiquetas, args.rollos, "a4"),
+        ("streaming térmica", escribir_etiquetas, args.rollos, "termica"),
+        ("fpdf completo", fpdf_completo, args.rollos_fpdf, "termica"),
+    ]
+    for nombre, funcion, rollos, formato in filas:
+        segundos, paginas, tamano, pico = medir(funcion, rollos, formato)
+        print(f"{nombre:<22}{rollos:>8}{segundos:>9.3f}{rollos / segundos:>11.0f}{paginas:>9}"
+              f"{tamano / 1024:>9.0f}{pico / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Historial de pedidos: búsquedas paginadas y reimpresión con cientos de miles de órdenes.
+
+    python benchmarks/bench_historial.py --pedidos 300000
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from engine import (  # noqa: E402
+    MATERIALES, ClienteDTO, EspecificacionesDTO, ProduccionDTO, generar_orden_pdf, pedido_a_dtos,
+)
+from historial import HistorialPedidos  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pedidos", type=int, default=300_000)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "historial.db")
+        historial = HistorialPedidos(db)
+        t0 = time.perf_counter()
+        lote = []
+        for i in range(args.pedidos):
+            lote.append((
+                ClienteDTO(f"Cliente {i % 5000:04d} S.L.", "compras@cliente.es", f"ORD-{i:07d}"),
+                EspecificacionesDTO(100, 50, 5000, MATERIALES[i % len(MATERIALES)], "Ø 76 mm", 1000),
+                ProduccionDTO("3", "", None),
+                None,
+            ))
+            if len(lote) == 10_000:
+                historial.registrar_lote(lote)
+                lote.clear()
+        historial.registrar_lote(lote)
+        # Un año de pedidos repartidos uniformemente
+        inicio = time.time() - 365 * 86400
+        with sqlite3.connect(db) as conn:
+            conn.execute("UPDATE pedidos SET created_at = ? + id * ?", (inicio, 365 * 86400 / args.pedidos))
+        print(f"{args.pedidos} pedidos insertados en {time.perf_counter() - t0:.1f} s")
+
+        hoy = datetime.date.today()
+        _, cursor = historial.buscar(material=MATERIALES[0])
+        _, cursor_amplio = historial.buscar(texto="ORD")
+        consultas = {
+            "última página": {},
+            "prefijo referencia": {"texto": "ORD-00123"},
+            "prefijo cliente": {"texto": "cliente 01"},
+            # Prefijos amplios: casi todas las filas casan, lo caro es ordenarlas
+            "prefijo amplio ref.": {"texto": "ORD"},
+            "prefijo amplio ref. 2": {"texto": "ORD-0"},
+            "prefijo amplio cliente": {"texto": "cliente"},
+            "prefijo amplio, pág. 2": {"texto": "ORD", "cursor": cursor_amplio},
+            "amplio + material": {"texto": "ORD", "material": MATERIALES[1]},
+            "prefijo medio ref.": {"texto": "ORD-001"},
+            "amplio y antiguo": {"texto": "ORD-00"},
+            "material": {"material": MATERIALES[0]},
+            "material, página 2": {"material": MATERIALES[0], "cursor": cursor},
+            "material + 30 días": {"material": MATERIALES[0], "desde": hoy - datetime.timedelta(days=30), "hasta": hoy},
+            "sin resultados": {"texto": "zzz"},
+        }
+        print(f"{'consulta':<24}{'p50 (ms)':>10}{'max (ms)':>10}")
+        for nombre, filtros in consultas.items():
+            tiempos = []
+            for _ in range(args.repeticiones):
+                t0 = time.perf_counter()
+                historial.buscar(**filtros)
+                tiempos.append((time.perf_counter() - t0) * 1000)
+            tiempos.sort()
+            print(f"{nombre:<24}{tiempos[len(tiempos) // 2]:>10.2f}{tiempos[-1]:>10.2f}")
+
+        t0 = time.perf_counter()
+        for i in range(args.repeticiones):
+            fila = historial.obtener(1 + i * (args.pedidos // args.repeticiones))
+            generar_orden_pdf(*pedido_a_dtos(fila), fecha=datetime.date.fromtimestamp(fila["created_at"]))
+        print(f"reimpresión (obtener + PDF): {(time.perf_counter() - t0) * 1000 / args.repeticiones:.2f} ms/orden")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Latencia y memoria pico de la ficha PDF: fichero temporal + doble base64 vs. en memoria.
+
+    python benchmarks/bench_pdf_pipeline.py --orders 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from engine import (  # noqa: E402
+    ClienteDTO, EmailService, EspecificacionesDTO, ProduccionDTO, generar_orden_pdf,
+)
+
+CLIENTE = ClienteDTO("ACME Etiquetas S.L.", "compras@acme.example", "ORD-BENCH-1")
+SPECS = EspecificacionesDTO(100, 100, 5000, "PP Blanco", "Ø 76 mm", 1000)
+PROD = ProduccionDTO("3", "Revisar registro de color en la tirada.", None)
+
+
+def legado(tmpdir):
+    """Camino anterior: escribe OT_*.pdf, lo relee y codifica la ficha dos veces."""
+    path = os.path.join(tmpdir, f"OT_{CLIENTE.referencia_interna}.pdf")
+    with open(path, "wb") as f:
+        f.write(generar_orden_pdf(CLIENTE, SPECS, PROD))
+    with open(path, "rb") as f:
+        pdf_data = f.read()
+    mensajes = []
+    for nombre in ("Ficha_Taller.pdf", "Ficha_Tecnica.pdf"):
+        msg = MIMEMultipart()
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(pdf_data)
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f'attachment; filename="{nombre}"')
+        msg.attach(part)
+        mensajes.append(msg.as_bytes())
+    os.remove(path)
+    return mensajes
+
+
+def en_memoria(_tmpdir):
+    pdf_data = generar_orden_pdf(CLIENTE, SPECS, PROD)
+    return [m.as_bytes() for m in EmailService.build_messages(CLIENTE, PROD, pdf_data, "bench@example.com")]
+
+
+def medir(fn, orders, tmpdir):
+    fn(tmpdir)  # calentamiento
+    tiempos = []
+    tracemalloc.start()
+    for _ in range(orders):
+        t0 = time.perf_counter()
+        fn(tmpdir)
+        tiempos.append(time.perf_counter() - t0)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2] * 1000, tiempos[int(len(tiempos) * 0.95)] * 1000, pico / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"{'camino':<12}{'p50 (ms)':>10}{'p95 (ms)':>10}{'pico (KiB)':>12}")
+        for nombre, fn in (("fichero", legado), ("memoria", en_memoria)):
+            p50, p95, pico = medir(fn, args.orders, tmpdir)
+            print(f"{nombre:<12}{p50:>10.2f}{p95:>10.2f}{pico:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Render de órdenes de trabajo: EnterprisePDF completo vs. plantilla cacheada.
+
+Para cada tamaño de lote mide el tiempo medio por orden y, en una segunda
+pasada (tracemalloc ralentiza el render), la memoria pico de renderizar las
+órdenes una tras otra.
+
+    python benchmarks/bench_pdf_template.py --counts 1,10,200
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from engine import ClienteDTO, EspecificacionesDTO, ProduccionDTO, generar_orden_pdf  # noqa: E402
+from orden_pdf import get_plantilla_orden  # noqa: E402
+
+SPECS = EspecificacionesDTO(100, 100, 5000, "PP Blanco", "Ø 76 mm", 1000)
+PROD = ProduccionDTO("3", "", None)
+
+
+def _renderizar(n, usar_plantilla):
+    for i in range(n):
+        cliente = ClienteDTO(f"Cliente {i} S.L.", f"c{i}@example.com", f"ORD-BENCH-{i}")
+        generar_orden_pdf(cliente, SPECS, PROD, usar_plantilla=usar_plantilla)
+
+
+def medir(n, usar_plantilla):
+    t0 = time.perf_counter()
+    _renderizar(n, usar_plantilla)
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    _renderizar(n, usar_plantilla)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / n * 1000, pico / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", default="1,10,200", help="tamaños de lote separados por comas")
+    args = parser.parse_args()
+
+    get_plantilla_orden()  # la plantilla se graba una vez por proceso
+    generar_orden_pdf(ClienteDTO("x", "x@x", "x"), SPECS, PROD, usar_plantilla=False)  # calentamiento
+
+    print(f"{'órdenes':>8}{'modo':>11}{'ms/orden':>11}{'pico (KiB)':>12}")
+    for n in (int(c) for c in args.counts.split(",")):
+        for etiqueta, plantilla in (("completo", False), ("plantilla", True)):
+            ms, pico = medir(n, plantilla)
+            print(f"{n:>8}{etiqueta:>11}{ms:>11.2f}{pico:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Coste por interacción: rerun completo de main() vs. rerun de un solo fragmento.
+
+Con AppTest se mide el tiempo de servidor y los bytes de los elementos
+emitidos (tamaño serializado de los protos, lo que viaja por el websocket).
+Para cada fragmento se ejecuta un script que sólo invoca esa función, que es
+exactamente lo que Streamlit re-ejecuta al interactuar con sus widgets.
+
+    python benchmarks/bench_reruns.py --runs 20
+"""
+import argparse
+import os
+import statistics
+import time
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FRAGMENTOS = ["_render_datos_cliente", "_render_especificaciones", "_render_bobinado", "_render_archivos"]
+
+
+def _script_fragmento(root, nombre):
+    import sys
+    sys.path.insert(0, root)
+    import streamlit as st
+    import app
+    st.session_state.setdefault("winding_pos", "3")
+    getattr(app, nombre)()
+
+
+def _bytes_emitidos(at) -> int:
+    def walk(node):
+        children = getattr(node, "children", None)
+        if children:
+            for child in children.values():
+                yield from walk(child)
+        else:
+            yield node
+    return sum(el.proto.ByteSize() for el in walk(at._tree) if getattr(el, "proto", None) is not None)
+
+
+def medir(at, runs):
+    at.run()  # primera ejecución: importación y cachés
+    tiempos = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        at.run()
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos) * 1000, _bytes_emitidos(at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    casos = [("main() completo", AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60))]
+    for nombre in FRAGMENTOS:
+        casos.append((nombre, AppTest.from_function(_script_fragmento, args=(ROOT, nombre), default_timeout=60)))
+
+    print(f"{'rerun':<28}{'p50 (ms)':>10}{'bytes':>10}")
+    for etiqueta, at in casos:
+        p50, size = medir(at, args.runs)
+        print(f"{etiqueta:<28}{p50:>10.2f}{size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Resumen del taller: correos (sesiones SMTP) y bytes hacia el taller, un correo por orden vs. resumen.
+
+Encola `--ordenes` órdenes en un outbox temporal en cada modo y, en modo
+resumen, vuelca los resúmenes de `--max-ordenes` órdenes. Cuenta los mensajes
+y bytes que irían al taller y al cliente y el tiempo de encolado y de resumen.
+
+    python benchmarks/bench_resumen_taller.py --ordenes 200 --max-ordenes 25
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import engine  # noqa: E402
+from engine import (  # noqa: E402
+    MATERIALES, ClienteDTO, EmailService, EspecificacionesDTO, ProduccionDTO, encolar_orden, generar_orden_pdf,
+    get_historial, volcar_resumen_taller,
+)
+from outbox import OutboxQueue  # noqa: E402
+
+
+def trafico(outbox):
+    """{destinatario: (mensajes, bytes)} de lo encolado."""
+    with outbox._connect() as conn:
+        filas = conn.execute("SELECT rcpt_to, raw, raw_path FROM outbox").fetchall()
+    resultado = {}
+    for fila in filas:
+        n, total = resultado.get(fila["rcpt_to"], (0, 0))
+        resultado[fila["rcpt_to"]] = (n + 1, total + (os.path.getsize(fila["raw_path"]) if fila["raw_path"] else len(fila["raw"])))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ordenes", type=int, default=200)
+    parser.add_argument("--max-ordenes", type=int, default=25)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_resumen_")
+    config = {
+        "historial_db": os.path.join(tmp, "historial.db"),
+        "outbox_spool": os.path.join(tmp, "spool"),
+        "arte_final_index_db": os.path.join(tmp, "arte_final.db"),
+        "taller_resumen_max_ordenes": args.max_ordenes,
+    }
+    engine.configurar(lambda key, default=None: config.get(key, default))
+
+    ordenes = []
+    for i in range(args.ordenes):
+        cliente = ClienteDTO(f"Cliente {i} S.L.", f"c{i}@example.com", f"ORD-BENCH-{i:06d}")
+        specs = EspecificacionesDTO(100, 80, 25000, MATERIALES[i % len(MATERIALES)], "Ø 76 mm", 1000)
+        ordenes.append((cliente, specs, ProduccionDTO("3", "", None)))
+    pdf_data = bytes(generar_orden_pdf(*ordenes[0]))
+
+    print(f"{args.ordenes} órdenes | resumen cada {args.max_ordenes}")
+    print(f"{'modo':<12}{'encolado (s)':>14}{'resumen (s)':>13}{'correos taller':>16}{'KB taller':>11}{'correos cliente':>17}")
+    for modo in ("por orden", "resumen"):
+        config["taller_resumen"] = modo == "resumen"
+        outbox = OutboxQueue(os.path.join(tmp, f"outbox_{modo.replace(' ', '_')}.db"))
+        t0 = time.perf_counter()
+        for cliente, specs, prod in ordenes:
+            encolar_orden(outbox, "bench@flexylabel.es", cliente, prod, pdf_data, specs)
+        encolado = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        volcar_resumen_taller(outbox, get_historial(), "bench@flexylabel.es", forzar=True)
+        resumen = time.perf_counter() - t0
+
+        por_destino = trafico(outbox)
+        taller, kb_taller = por_destino.get(EmailService.TALLER_EMAIL, (0, 0))
+        cliente = sum(n for destino, (n, _) in por_destino.items() if destino != EmailService.TALLER_EMAIL)
+        print(f"{modo:<12}{encolado:>14.2f}{resumen:>13.2f}{taller:>16}{kb_taller / 1024:>11.0f}{cliente:>17}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Órdenes/segundo con sesiones SMTP agrupadas vs. una sesión nueva por orden.
+
+Levanta un servidor SMTP local (aiosmtpd) y envía N órdenes (taller + cliente)
+de las dos formas. El servidor local es SMTP plano: contra Gmail (SMTP_SSL +
+login) la diferencia es mucho mayor, porque el handshake TLS domina el coste.
+
+    python benchmarks/bench_smtp_pool.py --orders 200
+"""
+import argparse
+import os
+import sys
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from aiosmtpd.controller import Controller  # noqa: E402
+
+from outbox import mensaje_a_bytes  # noqa: E402
+from smtp_pool import SMTPConfig, SMTPConnectionPool, abrir_sesion_smtp  # noqa: E402
+
+
+class _Sink:
+    async def handle_DATA(self, server, session, envelope):
+        return "250 OK"
+
+
+def _mensajes():
+    out = []
+    for dest in ("covet@etiquetes.com", "cliente@example.com"):
+        msg = MIMEText("Nueva orden generada.\nCliente: ACME\nRef: ORD-BENCH", "plain")
+        msg["From"] = "bench@example.com"
+        msg["To"] = dest
+        msg["Subject"] = "🏭 [PROD] ACME | REF: ORD-BENCH"
+        out.append(("bench@example.com", [dest], mensaje_a_bytes(msg)))
+    return out
+
+
+def sin_pool(config, orders, mensajes):
+    t0 = time.perf_counter()
+    for _ in range(orders):
+        server = abrir_sesion_smtp(config)
+        for mail_from, rcpt, raw in mensajes:
+            server.sendmail(mail_from, rcpt, raw)
+        server.quit()
+    return time.perf_counter() - t0
+
+
+def con_pool(config, orders, mensajes):
+    pool = SMTPConnectionPool(config)
+    t0 = time.perf_counter()
+    for _ in range(orders):
+        for mail_from, rcpt, raw in mensajes:
+            pool.send(mail_from, rcpt, raw)
+    elapsed = time.perf_counter() - t0
+    pool.close_all()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    controller = Controller(_Sink(), hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        config = SMTPConfig(host="127.0.0.1", port=args.port, use_ssl=False)
+        mensajes = _mensajes()
+        t_plain = sin_pool(config, args.orders, mensajes)
+        t_pool = con_pool(config, args.orders, mensajes)
+    finally:
+        controller.stop()
+
+    print(f"{'modo':<12}{'tiempo (s)':>12}{'órdenes/s':>12}")
+    print(f"{'sin pool':<12}{t_plain:>12.3f}{args.orders / t_plain:>12.1f}")
+    print(f"{'con pool':<12}{t_pool:>12.3f}{args.orders / t_pool:>12.1f}")
+    print(f"speedup: x{t_plain / t_pool:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Órdenes en segundo plano: throughput por nº de procesos de render y latencia de una orden con carga.
+
+Cada fila lanza `--ordenes` órdenes desde `--sesiones` sesiones simuladas y mide
+el throughput del gestor de trabajos frente al render síncrono en el hilo del
+script, y el tiempo que tarda en despacharse (y en terminar) una orden nueva
+mientras las demás están en cola.
+
+    python benchmarks/bench_trabajos.py --ordenes 200 --procesos 1,2,4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from engine import ClienteDTO, EspecificacionesDTO, ProduccionDTO, generar_orden_pdf  # noqa: E402
+from trabajos import GestorTrabajos  # noqa: E402
+
+SPECS = EspecificacionesDTO(100, 80, 25000, "PP Blanco", "Ø 76 mm", 1000)
+PROD = ProduccionDTO("3", "Revisar registro de color en la primera bobina.", None)
+
+
+def cliente(i):
+    return ClienteDTO(f"Cliente {i} S.L.", f"c{i}@example.com", f"ORD-BENCH-{i:06d}")
+
+
+def medir_gestor(procesos, ordenes, sesiones):
+    gestor = GestorTrabajos(procesos=procesos, max_por_sesion=ordenes, max_pendientes=ordenes + 1)
+    hechos = threading.Semaphore(0)
+    # Arranque y precalentamiento de los procesos fuera de la medida
+    for i in range(procesos):
+        gestor.enviar("calentamiento", cliente(i), SPECS, PROD, lambda pdf: hechos.release())
+    for _ in range(procesos):
+        hechos.acquire()
+
+    t0 = time.perf_counter()
+    for i in range(ordenes):
+        gestor.enviar(f"s{i % sesiones}", cliente(i), SPECS, PROD, lambda pdf: hechos.release())
+    t_despacho = time.perf_counter()
+    terminada = threading.Event()
+    gestor.enviar("nueva", cliente(ordenes), SPECS, PROD, lambda pdf: terminada.set())
+    despacho_ms = (time.perf_counter() - t_despacho) * 1000
+    for _ in range(ordenes):
+        hechos.acquire()
+    total_s = time.perf_counter() - t0
+    terminada.wait()
+    nueva_s = time.perf_counter() - t_despacho
+    gestor.shutdown()
+    return ordenes / total_s, despacho_ms, nueva_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ordenes", type=int, default=200)
+    parser.add_argument("--sesiones", type=int, default=8)
+    parser.add_argument("--procesos", default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})))
+    args = parser.parse_args()
+
+    generar_orden_pdf(cliente(0), SPECS, PROD)
+    t0 = time.perf_counter()
+    for i in range(args.ordenes):
+        generar_orden_pdf(cliente(i), SPECS, PROD)
+    sincrono = args.ordenes / (time.perf_counter() - t0)
+
+    print(f"{os.cpu_count()} CPUs | {args.ordenes} órdenes | {args.sesiones} sesiones")
+    print(f"{'modo':<22}{'órdenes/s':>10}{'despacho (ms)':>15}{'orden nueva (s)':>17}")
+    print(f"{'síncrono (script)':<22}{sincrono:>10.1f}{1000 / sincrono:>15.2f}{args.ordenes / sincrono:>17.2f}")
+    for procesos in (int(n) for n in args.procesos.split(",")):
+        por_s, despacho_ms, nueva_s = medir_gestor(procesos, args.ordenes, args.sesiones)
+        print(f"{f'{procesos} procesos':<22}{por_s:>10.1f}{despacho_ms:>15.2f}{nueva_s:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""Suite de benchmarks del pipeline de órdenes, con baseline y detección de regresiones.
+
+    python benchmarks/suite.py                      # ejecuta y compara con baseline.json
+    python benchmarks/suite.py --casos pdf,mime     # sólo algunos casos
+    python benchmarks/suite.py --guardar-baseline   # fija la referencia (en esta máquina)
+
+Cada caso se calienta, se mide N veces (p50/p95/p99 en ms por operación) y se
+ejecuta de nuevo en una pasada aparte bajo tracemalloc para el pico de memoria,
+así la instrumentación no contamina los tiempos. Las entradas son fijas y cada
+caso guarda una calibración de CPU con la que se escalan los límites de tiempo.
+Sale con código 1 si algún caso empeora más de la tolerancia respecto a la
+baseline. La baseline incluida se tomó en una VM compartida de 1 vCPU:
+regenérela en la máquina de CI con `--guardar-baseline`.
+
+Los casos `e2e_smtp` y `apptest_main` levantan un SMTP local con aiosmtpd; si
+no está instalado se omiten (y no cuentan como regresión).
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from unittest import mock
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from engine import (  # noqa: E402
+    ClienteDTO, CalculadoraProduccion, EmailService, EspecificacionesDTO, ProduccionDTO, generar_orden_pdf,
+)
+from outbox import OutboxQueue, OutboxWorker, mensaje_a_bytes, order_record  # noqa: E402
+from smtp_pool import SMTPConfig, SMTPConnectionPool  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+CLIENTE = ClienteDTO("Etiquetas Benchmark S.L.", "compras@benchmark.es", "ORD-BENCH-000001")
+SPECS = EspecificacionesDTO(100, 80, 25000, "PP Blanco", "Ø 76 mm", 1000)
+PROD = ProduccionDTO("3", "Revisar registro de color en la primera bobina.", None)
+
+
+@dataclass
+class Caso:
+    operacion: object           # callable sin argumentos: una operación medida
+    repeticiones: int = 200
+    lote: int = 1               # operaciones por muestra (para casos de microsegundos)
+    extra: dict = field(default_factory=dict)  # métricas fijas (p. ej. bytes)
+    cerrar: object = None
+
+
+class Omitido(Exception):
+    pass
+
+
+# --- Entorno compartido: SMTP local y bases de datos temporales ---
+class Entorno:
+    def __init__(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix="flexy_bench_")
+        self._smtp = None
+
+    def smtp(self):
+        if self._smtp is None:
+            try:
+                from aiosmtpd.controller import Controller
+            except ImportError:
+                raise Omitido("requiere aiosmtpd")
+
+            class _Sink:
+                async def handle_DATA(self, server, session, envelope):
+                    return "250 OK"
+
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                puerto = s.getsockname()[1]
+            self._smtp = Controller(_Sink(), hostname="127.0.0.1", port=puerto)
+            self._smtp.start()
+        return self._smtp.hostname, self._smtp.port
+
+    def ruta(self, nombre):
+        return os.path.join(self.tmp.name, nombre)
+
+    def cerrar(self):
+        if self._smtp is not None:
+            self._smtp.stop()
+        self.tmp.cleanup()
+
+
+# --- Casos ---
+def caso_svg_bobinado(entorno):
+    def operacion():
+        app.get_winding_svg.cache_clear()
+        for pos in range(1, 9):
+            app.get_winding_svg(pos)
+    return Caso(operacion, repeticiones=200)
+
+
+def caso_svg_bobinado_cache(entorno):
+    def operacion():
+        for pos in range(1, 9):
+            app.get_winding_svg(pos)
+    return Caso(operacion, repeticiones=200, lote=100)
+
+
+def caso_css_payload(entorno):
+    # Como en .streamlit/config.toml, que sólo se lee si la suite se lanza desde la raíz
+    app.st.config.set_option("server.enableStaticServing", True)
+    payload = []
+    with mock.patch.object(app.st, "markdown", lambda body, **kw: payload.append(body)):
+        app.inject_dynamic_css()
+
+    def operacion():
+        with mock.patch.object(app.st, "markdown", lambda body, **kw: None):
+            app.inject_dynamic_css()
+    return Caso(operacion, repeticiones=100, lote=10,
+                extra={"css_bytes": sum(len(p.encode("utf-8")) for p in payload)})
+
+
+def caso_calcular_consumos(entorno):
+    def operacion():
+        CalculadoraProduccion.calcular_consumos(SPECS)
+    return Caso(operacion, repeticiones=200, lote=200)
+
+
+def caso_pdf(entorno):
+    def operacion():
+        generar_orden_pdf(CLIENTE, SPECS, PROD)
+    return Caso(operacion, repeticiones=200)
+
+
+def caso_mime(entorno):
+    pdf_data = bytes(generar_orden_pdf(CLIENTE, SPECS, PROD))
+
+    def operacion():
+        msg_taller, msg_cliente = EmailService.build_messages(CLIENTE, PROD, pdf_data, "bench@flexylabel.es")
+        mensaje_a_bytes(msg_taller)
+        mensaje_a_bytes(msg_cliente)
+    return Caso(operacion, repeticiones=200)
+
+
+def caso_e2e_smtp(entorno):
+    """Render + MIME + outbox + entrega SMTP real (local) de taller y cliente."""
+    host, port = entorno.smtp()
+    queue = OutboxQueue(entorno.ruta("e2e_outbox.db"))
+    pool = SMTPConnectionPool(SMTPConfig(host=host, port=port, use_ssl=False))
+    worker = OutboxWorker(queue, pool)  # sin arrancar el hilo: drain() síncrono
+
+    def operacion():
+        pdf_data = bytes(generar_orden_pdf(CLIENTE, SPECS, PROD))
+        mensajes, _ = EmailService.preparar_mensajes(CLIENTE, PROD, pdf_data, "bench@flexylabel.es")
+        queue.enqueue(order_record(CLIENTE, SPECS, PROD), mensajes)
+        if worker.drain() != len(mensajes):
+            raise RuntimeError("el outbox no entregó todos los mensajes")
+    return Caso(operacion, repeticiones=100, cerrar=pool.close_all)
+
+
+def caso_apptest_main(entorno):
+    """Rerun completo de main() en AppTest (render de toda la página)."""
+    from streamlit.testing.v1 import AppTest
+
+    host, port = entorno.smtp()
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.secrets.update({
+        "email_usuario": "bench@flexylabel.es", "email_password": "",
+        "smtp_host": host, "smtp_port": port, "smtp_ssl": False,
+        "outbox_db": entorno.ruta("app_outbox.db"), "historial_db": entorno.ruta("app_historial.db"),
+    })
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    def operacion():
+        at.run()
+    return Caso(operacion, repeticiones=30)
+
+
+CASOS = {
+    "svg_bobinado": caso_svg_bobinado,
+    "svg_bobinado_cache": caso_svg_bobinado_cache,
+    "css_payload": caso_css_payload,
+    "calcular_consumos": caso_calcular_consumos,
+    "pdf": caso_pdf,
+    "mime": caso_mime,
+    "e2e_smtp": caso_e2e_smtp,
+    "apptest_main": caso_apptest_main,
+}
+
+
+# --- Medición ---
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def calibrar(rondas: int = 5) -> float:
+    """ms de una carga fija de Python puro (mejor de `rondas`).
+
+    Se mide alrededor de cada ronda y se guarda con el caso: al comparar, los límites
+    de tiempo se escalan por la relación entre la calibración actual y la de la
+    baseline, así una máquina más lenta (o una VM con la CPU estrangulada) no
+    se confunde con una regresión del código.
+    """
+    mejor = float("inf")
+    for _ in range(rondas):
+        t0 = time.perf_counter()
+        acumulado = 0
+        for i in range(200_000):
+            acumulado += (i * 7919) % 1013
+        sorted(str(i) for i in range(20_000))
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor * 1000
+
+
+def medir(caso: Caso, rondas: int = 3, calentamiento: int = 5) -> dict:
+    """Percentiles de la mejor de `rondas` rondas (como timeit: el ruido sólo suma)."""
+    for _ in range(calentamiento):
+        caso.operacion()
+
+    percentiles = []
+    for _ in range(rondas):
+        cal_antes = calibrar(3)
+        muestras = []
+        gc_activo = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(caso.repeticiones):
+                t0 = time.perf_counter()
+                for _ in range(caso.lote):
+                    caso.operacion()
+                muestras.append((time.perf_counter() - t0) * 1000 / caso.lote)
+        finally:
+            if gc_activo:
+                gc.enable()
+        cal = (cal_antes + calibrar(3)) / 2
+        gc.collect()
+        percentiles.append({p: _percentil(muestras, p) for p in (0.50, 0.95, 0.99)} | {"max": max(muestras), "cal": cal})
+    mejor = min(percentiles, key=lambda r: r[0.50])
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        for _ in range(min(caso.repeticiones, 5)):
+            caso.operacion()
+        pico = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": round(mejor[0.50], 4),
+        "p95_ms": round(min(r[0.95] for r in percentiles), 4),
+        "p99_ms": round(min(r[0.99] for r in percentiles), 4),
+        "max_ms": round(min(r["max"] for r in percentiles), 4),
+        "pico_kb": round(max(pico, 0) / 1024, 1),
+        "repeticiones": caso.repeticiones * caso.lote * rondas,
+        "calibracion_ms": round(mejor["cal"], 3),
+        **caso.extra,
+    }
+
+
+def comparar(resultados: dict, baseline: dict, tol_tiempo: float, tol_memoria: float, holgura_ms: float):
+    """Lista de regresiones `(caso, métrica, actual, referencia, límite)`."""
+    regresiones = []
+    for nombre, actual in resultados.items():
+        ref = baseline.get(nombre)
+        if not ref or "omitido" in actual:
+            continue
+        # Velocidad relativa de la CPU respecto a la baseline (acotada contra valores absurdos)
+        escala = 1.0
+        if ref.get("calibracion_ms") and actual.get("calibracion_ms"):
+            escala = min(max(actual["calibracion_ms"] / ref["calibracion_ms"], 0.5), 3.0)
+        for metrica, valor in actual.items():
+            if metrica not in ref or metrica in ("repeticiones", "max_ms", "p99_ms", "calibracion_ms"):
+                continue
+            if metrica.endswith("_ms"):
+                # La cola (p95) es más ruidosa que la mediana: doble tolerancia
+                tolerancia = tol_tiempo * (2 if metrica == "p95_ms" else 1)
+                limite = ref[metrica] * escala * (1 + tolerancia) + holgura_ms
+            else:
+                limite = ref[metrica] * (1 + tol_memoria) + (16 if metrica == "pico_kb" else 0)
+            if valor > limite:
+                regresiones.append((nombre, metrica, valor, ref[metrica], round(limite, 4)))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--casos", default=",".join(CASOS), help=f"lista separada por comas ({', '.join(CASOS)})")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--guardar-baseline", action="store_true", help="escribe los resultados como nueva baseline")
+    parser.add_argument("--rondas", type=int, default=3, help="rondas por caso; se toma la mejor")
+    parser.add_argument("--tolerancia", type=float, default=0.35, help="empeoramiento de tiempo admitido (0.35 = +35%%)")
+    parser.add_argument("--tolerancia-memoria", type=float, default=0.20)
+    parser.add_argument("--holgura-ms", type=float, default=0.05, help="margen absoluto para casos de microsegundos")
+    parser.add_argument("--salida", help="guarda también los resultados en este JSON")
+    args = parser.parse_args(argv)
+
+    # Los spans de metricas.py registran una línea JSON por etapa: fuera de la medición
+    logging.getLogger("FlexyLabel_Enterprise").setLevel(logging.WARNING)
+    logging.getLogger("mail.log").setLevel(logging.WARNING)
+
+    nombres = [n.strip() for n in args.casos.split(",") if n.strip()]
+    desconocidos = [n for n in nombres if n not in CASOS]
+    if desconocidos:
+        parser.error(f"casos desconocidos: {', '.join(desconocidos)}")
+
+    entorno = Entorno()
+    resultados = {}
+    print(f"{'caso':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'pico KB':>10}  extra")
+    try:
+        for nombre in nombres:
+            try:
+                caso = CASOS[nombre](entorno)
+            except Omitido as e:
+                resultados[nombre] = {"omitido": str(e)}
+                print(f"{nombre:<22}  omitido ({e})")
+                continue
+            try:
+                r = resultados[nombre] = medir(caso, args.rondas)
+            finally:
+                if caso.cerrar:
+                    caso.cerrar()
+            extra = " ".join(f"{k}={v}" for k, v in caso.extra.items())
+            print(f"{nombre:<22}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['pico_kb']:>10.1f}  {extra}")
+    finally:
+        entorno.cerrar()
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    if args.guardar_baseline:
+        anterior = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                anterior = json.load(f).get("casos", {})
+        anterior.update({k: v for k, v in resultados.items() if "omitido" not in v})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "entorno": {"python": platform.python_version(), "plataforma": platform.platform(),
+                            "procesador": platform.processor() or platform.machine()},
+                "casos": anterior,
+            }, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Baseline guardada en {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Sin baseline: ejecute con --guardar-baseline para fijar la referencia.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["casos"]
+    regresiones = comparar(resultados, baseline, args.tolerancia, args.tolerancia_memoria, args.holgura_ms)
+    if regresiones:
+        print("\nREGRESIONES:")
+        for nombre, metrica, valor, ref, limite in regresiones:
+            print(f"  {nombre}.{metrica}: {valor} (baseline {ref}, límite {limite})")
+        return 1
+    print("\nSin regresiones respecto a la baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
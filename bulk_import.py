@@ -0,0 +1,292 @@
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from arte_final import ArchivoLocal
+from engine import (
+    EmailService, dtos_desde_campos, generar_orden_pdf, limites_arte_final, marcar_artes_entregados,
+    resumen_taller_activo,
+)
+from historial import CLAVE_CONTENIDO_CADUCIDAD_S, HistorialPedidos
+from outbox import OutboxQueue, order_record
+
+# =============================================================================
+# IMPORTACIÓN MASIVA DE PEDIDOS (CSV / XLSX) — CLI SIN INTERFAZ
+# =============================================================================
+# Lee las filas en streaming, renderiza las órdenes en un pool de procesos con
+# una ventana acotada de trabajos en vuelo y encola los correos en el outbox
+# (y registra los pedidos en el historial) por lotes. La memoria no depende
+# del número de filas del fichero. Las filas ya importadas (misma clave de
+# idempotencia) se descartan, así que relanzar una importación no duplica envíos.
+# Sin `referencia_interna` la clave sólo vale CLAVE_CONTENIDO_CADUCIDAD_S: el
+# mismo pedido fijo importado otro día vuelve a enviarse.
+#
+#   python bulk_import.py pedidos.csv --from pedidos@flexylabel.es
+#
+# Columnas: razon_social, email_contacto, referencia_interna, ancho_mm, largo_mm,
+# cantidad_total, material, mandril, uds_rollo, sentido_bobinado,
+# notas_maquinista, arte_final (ruta a PDF). XLSX requiere `openpyxl` (opcional).
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+@dataclass
+class EstadisticasEtapa:
+    items: int = 0
+    segundos: float = 0.0
+
+    @property
+    def por_segundo(self) -> float:
+        return self.items / self.segundos if self.segundos else 0.0
+
+
+@dataclass
+class ResumenImportacion:
+    filas: int = 0
+    duplicadas: int = 0
+    errores: list = field(default_factory=list)
+    lectura: EstadisticasEtapa = field(default_factory=EstadisticasEtapa)
+    render: EstadisticasEtapa = field(default_factory=EstadisticasEtapa)
+    encolado: EstadisticasEtapa = field(default_factory=EstadisticasEtapa)
+    total_s: float = 0.0
+
+    def informe(self) -> str:
+        lineas = [
+            f"Filas leídas: {self.filas} | Renderizadas: {self.render.items} | Encoladas: {self.encolado.items} | "
+            f"Duplicadas: {self.duplicadas} | Errores: {len(self.errores)}",
+            f"{'etapa':<12}{'items':>10}{'tiempo (s)':>12}{'items/s':>12}",
+        ]
+        for nombre, etapa in (("lectura", self.lectura), ("render", self.render), ("encolado", self.encolado)):
+            lineas.append(f"{nombre:<12}{etapa.items:>10}{etapa.segundos:>12.2f}{etapa.por_segundo:>12.1f}")
+        lineas.append(f"Total: {self.total_s:.2f} s ({self.render.items / self.total_s if self.total_s else 0:.1f} órdenes/s)")
+        return "\n".join(lineas)
+
+
+# --- Lectura en streaming ---
+def _normalizar_cabecera(nombre) -> str:
+    return str(nombre or "").strip().lower().replace(" ", "_")
+
+
+def leer_filas(path: str):
+    """Genera `(numero_fila, dict)` sin cargar el fichero completo en memoria."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise SystemExit("La importación XLSX requiere 'openpyxl' (pip install openpyxl).")
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            filas = wb.active.iter_rows(values_only=True)
+            cabecera = [_normalizar_cabecera(c) for c in next(filas, ())]
+            for n, valores in enumerate(filas, start=2):
+                if any(v not in (None, "") for v in valores):
+                    yield n, dict(zip(cabecera, valores))
+        finally:
+            wb.close()
+        return
+
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t")
+        except csv.Error:
+            dialecto = csv.excel
+        lector = csv.reader(f, dialecto)
+        cabecera = [_normalizar_cabecera(c) for c in next(lector, [])]
+        for n, valores in enumerate(lector, start=2):
+            if any(v.strip() for v in valores):
+                yield n, dict(zip(cabecera, valores))
+
+
+def clave_fila(fila: dict):
+    """Clave de idempotencia de una fila y su caducidad: la misma orden reimportada se descarta.
+
+    Con `referencia_interna` la clave no caduca; sin ella sólo identifica el
+    contenido y caduca a las CLAVE_CONTENIDO_CADUCIDAD_S.
+    """
+    contenido = json.dumps({k: v for k, v in fila.items() if k}, sort_keys=True, default=str)
+    caducidad = None if str(fila.get("referencia_interna") or "").strip() else CLAVE_CONTENIDO_CADUCIDAD_S
+    return "importacion:" + hashlib.sha256(contenido.encode()).hexdigest(), caducidad
+
+
+def fila_a_dtos(fila: dict, numero_fila: int, nueva_referencia=None):
+    """Convierte una fila en los DTOs de la orden. Lanza ValueError si no es válida.
+
+    Sin `referencia_interna` se usa `nueva_referencia()` (secuencia del historial).
+    """
+    arte = str(fila.get("arte_final") or "").strip()
+    if arte and not os.path.exists(arte):
+        raise ValueError(f"no existe el arte final '{arte}'")
+    if arte:
+        # Se rechaza antes de renderizar (mismo límite que aplica `preparar_arte_final`)
+        max_mb, _ = limites_arte_final()
+        size = os.path.getsize(arte)
+        if size > max_mb * 2**20:
+            raise ValueError(f"el arte final ocupa {size / 2**20:.1f} MB (máximo {max_mb} MB)")
+    return dtos_desde_campos(
+        fila,
+        nueva_referencia or (lambda: f"ORD-{datetime.date.today().year}-L{numero_fila}"),
+        ArchivoLocal(arte) if arte else None,
+    )
+
+
+# --- Etapa de render (proceso hijo) ---
+def _render(numero_fila, cliente, specs, prod):
+    return numero_fila, cliente, specs, prod, bytes(generar_orden_pdf(cliente, specs, prod))
+
+
+def importar(path: str, outbox_db: str, mail_from: str, workers: int = None,
+             tam_lote: int = 200, encolar: bool = True, historial_db: str = "historial.db") -> ResumenImportacion:
+    resumen = ResumenImportacion()
+    outbox = OutboxQueue(outbox_db) if encolar else None
+    historial = HistorialPedidos(historial_db) if encolar else None
+    workers = workers or os.cpu_count() or 1
+    max_en_vuelo = workers * 4
+    resumen_taller = resumen_taller_activo()
+    lote = []
+    pedidos_lote = []
+    claves_lote = []
+    reservadas = set()  # claves reservadas aún sin completar ni liberar
+    t_inicio = time.perf_counter()
+    ventana_render = [None, None]  # primer envío al pool / última orden recogida
+
+    def volcar_lote():
+        if not lote:
+            return
+        t0 = time.perf_counter()
+        outbox.enqueue_many(lote)
+        if not resumen_taller:
+            marcar_artes_entregados(sha for _, _, _, sha in pedidos_lote)
+        historial.registrar_lote(pedidos_lote, pendiente_taller=resumen_taller)
+        historial.completar_envios(claves_lote)
+        reservadas.difference_update(clave for clave, _ in claves_lote)
+        resumen.encolado.segundos += time.perf_counter() - t0
+        resumen.encolado.items += len(lote)
+        lote.clear()
+        pedidos_lote.clear()
+        claves_lote.clear()
+
+    def liberar(clave):
+        if historial is not None:
+            historial.liberar_envio(clave)
+            reservadas.discard(clave)
+
+    def recoger(futuros):
+        # `wait()` devuelve un conjunto: cada tanda se encola y registra en orden de fila
+        for fut in sorted(futuros, key=lambda f: en_vuelo[f][0]):
+            try:
+                numero_fila, cliente, specs, prod, pdf_data = fut.result()
+            except Exception as e:
+                numero_fila, clave = en_vuelo.pop(fut)
+                resumen.errores.append((numero_fila, f"render: {e}"))
+                liberar(clave)
+                continue
+            _, clave = en_vuelo.pop(fut)
+            resumen.render.items += 1
+            ventana_render[1] = time.perf_counter()
+            if outbox is None:
+                continue
+            t0 = time.perf_counter()
+            try:
+                mensajes, arte_sha256 = EmailService.preparar_mensajes(cliente, prod, pdf_data, mail_from, specs,
+                                                                       taller=not resumen_taller)
+            except Exception as e:
+                # Un fallo de la fila (arte final, etiquetas...) no detiene la importación
+                resumen.errores.append((numero_fila, f"correo: {e}"))
+                liberar(clave)
+                resumen.encolado.segundos += time.perf_counter() - t0
+                continue
+            lote.append((order_record(cliente, specs, prod), mensajes))
+            pedidos_lote.append((cliente, specs, prod, arte_sha256))
+            claves_lote.append((clave, cliente.referencia_interna))
+            resumen.encolado.segundos += time.perf_counter() - t0
+            if len(lote) >= tam_lote:
+                volcar_lote()
+
+    en_vuelo = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            filas = leer_filas(path)
+            while True:
+                t0 = time.perf_counter()
+                siguiente = next(filas, None)
+                if siguiente is not None:
+                    numero_fila, fila = siguiente
+                    resumen.filas += 1
+                    clave, caducidad = clave_fila(fila)
+                    dtos = None
+                    if historial is not None and historial.reservar_envio(clave, caducidad) is not None:
+                        resumen.duplicadas += 1
+                    else:
+                        if historial is not None:
+                            reservadas.add(clave)
+                        try:
+                            dtos = fila_a_dtos(fila, numero_fila, historial.siguiente_referencia if historial else None)
+                        except (ValueError, TypeError) as e:
+                            resumen.errores.append((numero_fila, str(e)))
+                            liberar(clave)
+                resumen.lectura.segundos += time.perf_counter() - t0
+                resumen.lectura.items = resumen.filas
+
+                if siguiente is None:
+                    break
+                if dtos is None:
+                    continue
+                if ventana_render[0] is None:
+                    ventana_render[0] = time.perf_counter()
+                en_vuelo[pool.submit(_render, numero_fila, *dtos)] = (numero_fila, clave)
+                if len(en_vuelo) >= max_en_vuelo:
+                    hechos, _ = wait(list(en_vuelo), return_when=FIRST_COMPLETED)
+                    recoger(hechos)
+
+            hechos, _ = wait(list(en_vuelo))
+            recoger(hechos)
+            volcar_lote()
+    finally:
+        # Una excepción a mitad (fichero corrupto, Ctrl+C, disco lleno...) no deja
+        # claves en curso: relanzar la importación no debe verlas como duplicadas
+        for clave in reservadas:
+            historial.liberar_envio(clave)
+
+    if ventana_render[1] is not None:
+        # Tiempo de pared de la etapa paralela, no la suma de CPU de los hijos
+        resumen.render.segundos = ventana_render[1] - ventana_render[0]
+
+    resumen.total_s = time.perf_counter() - t_inicio
+    return resumen
+
+
+def main(argv=None):
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Importación masiva de órdenes desde CSV/XLSX")
+    parser.add_argument("fichero", help="CSV (',' o ';') o XLSX con una orden por fila")
+    parser.add_argument("--from", dest="mail_from", default=os.environ.get("FLEXY_SMTP_USER", ""),
+                        help="remitente de los correos (por defecto $FLEXY_SMTP_USER)")
+    parser.add_argument("--outbox", default="outbox.db")
+    parser.add_argument("--historial", default="historial.db", help="base de datos del historial de pedidos")
+    parser.add_argument("--workers", type=int, default=None, help="procesos de render (por defecto nº de CPUs)")
+    parser.add_argument("--lote", type=int, default=200, help="órdenes por transacción del outbox")
+    parser.add_argument("--sin-correo", action="store_true", help="sólo valida y renderiza, no encola")
+    args = parser.parse_args(argv)
+
+    if not args.sin_correo and not args.mail_from:
+        parser.error("indique --from o FLEXY_SMTP_USER")
+
+    resumen = importar(args.fichero, args.outbox, args.mail_from, args.workers, args.lote, not args.sin_correo,
+                       args.historial)
+    for numero_fila, error in resumen.errores:
+        logger.error(f"Fila {numero_fila}: {error}")
+    print(resumen.informe())
+    return 1 if resumen.errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,688 @@
+import base64
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import tomllib
+from dataclasses import dataclass
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.base import MIMEBase
+
+import numpy as np
+
+from arte_final import AlmacenArteFinal, ArchivoLocal, preparar_arte_final
+from historial import HistorialPedidos
+from metricas import span
+from outbox import mensaje_a_bytes, mensaje_a_fichero, order_record
+
+# =============================================================================
+# MOTOR DE ÓRDENES (SIN INTERFAZ)
+# =============================================================================
+# DTOs, cálculo de producción, render de la orden y preparación de los correos,
+# importables desde workers, CLIs y la API sin arrancar Streamlit. fpdf se carga
+# al renderizar la primera orden y smtplib sólo en el proceso que entrega el
+# outbox; `app.py` es una capa de interfaz sobre este módulo.
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+# =============================================================================
+# 1. CONFIGURACIÓN
+# =============================================================================
+def _config_entorno(key: str, default=None):
+    """`FLEXY_<KEY>` del entorno (valor JSON o texto) o `.streamlit/secrets.toml`."""
+    valor = os.environ.get(f"FLEXY_{key.upper()}")
+    if valor is not None:
+        try:
+            return json.loads(valor)
+        except ValueError:
+            return valor
+    return _secrets_toml().get(key, default)
+
+
+@functools.lru_cache(maxsize=1)
+def _secrets_toml() -> dict:
+    for path in (os.path.join(".streamlit", "secrets.toml"), os.path.expanduser("~/.streamlit/secrets.toml")):
+        try:
+            with open(path, "rb") as f:
+                return tomllib.load(f)
+        except FileNotFoundError:
+            continue
+    return {}
+
+
+_fuente_config = _config_entorno
+
+
+def configurar(fuente):
+    """Sustituye el origen de los ajustes: `fuente(key, default)` (p. ej. `st.secrets`)."""
+    global _fuente_config
+    _fuente_config = fuente
+
+
+def get_config(key: str, default=None):
+    """Ajuste opcional; si no está definido se usa el valor por defecto."""
+    return _fuente_config(key, default)
+
+
+# --- DTOs (Data Transfer Objects) ---
+@dataclass
+class ClienteDTO:
+    razon_social: str
+    email_contacto: str
+    referencia_interna: str
+
+@dataclass
+class EspecificacionesDTO:
+    ancho_mm: float
+    largo_mm: float
+    cantidad_total: int
+    material: str
+    mandril: str
+    uds_rollo: int
+
+@dataclass
+class ProduccionDTO:
+    sentido_bobinado: str
+    notas_maquinista: str
+    arte_final: any
+
+
+# =============================================================================
+# 2. LÓGICA DE NEGOCIO
+# =============================================================================
+# Calibre total (frontal + adhesivo + soporte) por material, en mm
+ESPESOR_MATERIAL_MM = {
+    "PP Blanco": 0.140,
+    "PP Transparente": 0.125,
+    "Couché": 0.135,
+    "Térmico Eco": 0.130,
+    "Térmico Top": 0.150,
+    "Verjurado Cream": 0.175,
+}
+MATERIALES = list(ESPESOR_MATERIAL_MM)
+MANDRILES = ["Ø 76 mm", "Ø 40 mm", "Ø 25 mm"]
+GAP_MM = 3
+
+
+@dataclass(frozen=True)
+class CatalogoBanda:
+    """Anchos de bobina madre en stock y separaciones de imposición de un material."""
+    anchos_mm: tuple
+    gap_calle_mm: float = 3.0      # separación entre calles (a lo ancho)
+    gap_desarrollo_mm: float = 3.0  # separación mínima entre etiquetas (a lo largo)
+    refile_mm: float = 5.0         # refile a cada lado de la banda
+
+
+CATALOGO_BANDAS = {
+    "PP Blanco": CatalogoBanda((160, 200, 250, 330)),
+    "PP Transparente": CatalogoBanda((160, 200, 250, 330), gap_calle_mm=4.0, gap_desarrollo_mm=4.0),
+    "Couché": CatalogoBanda((100, 160, 200, 250, 330, 370)),
+    "Térmico Eco": CatalogoBanda((110, 160, 220, 330)),
+    "Térmico Top": CatalogoBanda((110, 160, 220, 330)),
+    "Verjurado Cream": CatalogoBanda((200, 330), refile_mm=6.0),
+}
+# Cilindros de impresión disponibles (dientes); paso de engranaje de 1/8"
+Z_CILINDROS = tuple(range(64, 161, 4))
+PASO_DIENTE_MM = 3.175
+MAX_CALLES = 12
+
+
+@dataclass
+class ResultadoImposicion:
+    ancho_banda_mm: float
+    calles: int
+    etiquetas_vuelta: int
+    z_cilindro: int
+    paso_mm: float
+    ml_consumidos: float
+    m2_consumidos: float
+    m2_netos: float
+    merma_pct: float
+
+
+def diametro_mandril_mm(mandril: str) -> float:
+    """Extrae el diámetro interior de textos como 'Ø 76 mm'."""
+    match = re.search(r"(\d+(?:[.,]\d+)?)", mandril or "")
+    if not match:
+        raise ValueError(f"Mandril no reconocido: {mandril!r}")
+    return float(match.group(1).replace(",", "."))
+
+
+def _mapear(valores, funcion, nombre):
+    """Aplica `funcion` sólo a los valores distintos y reexpande con la forma de `valores`."""
+    valores = np.asarray(valores, dtype=str)
+    unicos, inversa = np.unique(valores, return_inverse=True)
+    try:
+        tabla = np.array([funcion(v) for v in unicos], dtype=float)
+    except KeyError as e:
+        raise ValueError(f"{nombre} desconocido: {e.args[0]!r}") from None
+    return tabla[inversa.reshape(-1)].reshape(valores.shape)
+
+
+class CalculadoraProduccion:
+    @staticmethod
+    def calcular_lote(ancho_mm, largo_mm, cantidad_total, material, mandril, uds_rollo, gap_mm: float = GAP_MM):
+        """Consumos y bobinas para arrays de especificaciones (NumPy).
+
+        Devuelve un dict de arrays: `ml`, `m2`, `rollos` y `diametro_mm`
+        (diámetro exterior de un rollo completo), con la forma de la entrada
+        tras broadcasting: 0-d para una orden con escalares.
+        """
+        ancho = np.asarray(ancho_mm, dtype=float)
+        largo = np.asarray(largo_mm, dtype=float)
+        cantidad = np.asarray(cantidad_total, dtype=float)
+        uds = np.asarray(uds_rollo, dtype=float)
+        espesor = _mapear(material, ESPESOR_MATERIAL_MM.__getitem__, "Material")
+        nucleo = _mapear(mandril, diametro_mandril_mm, "Mandril")
+
+        paso = largo + gap_mm
+        ml = cantidad * paso / 1000
+        m2 = ancho * largo * cantidad / 1_000_000
+        rollos = np.ceil(cantidad / uds)
+        # Espiral de Arquímedes: área anular = espesor x longitud bobinada
+        diametro = np.sqrt(nucleo ** 2 + 4 * espesor * uds * paso / np.pi)
+
+        return {
+            "ml": np.round(ml, 2),
+            "m2": np.round(m2, 2),
+            "rollos": rollos.astype(np.int64),
+            "diametro_mm": np.round(diametro, 1),
+        }
+
+    @staticmethod
+    def calcular_lote_specs(specs_list):
+        """Atajo de `calcular_lote` para una secuencia de EspecificacionesDTO."""
+        campos = ("ancho_mm", "largo_mm", "cantidad_total", "material", "mandril", "uds_rollo")
+        columnas = {c: [getattr(s, c) for s in specs_list] for c in campos}
+        return CalculadoraProduccion.calcular_lote(**columnas)
+
+    @staticmethod
+    def calcular_consumos(specs: EspecificacionesDTO):
+        r = CalculadoraProduccion.calcular_lote_specs([specs])
+        return float(r["ml"][0]), float(r["m2"][0])
+
+    @staticmethod
+    def optimizar_imposicion(ancho_mm: float, largo_mm: float, cantidad_total: int, material: str,
+                             catalogo: CatalogoBanda = None):
+        """Busca la combinación banda x calles x cilindro de mínimo consumo real.
+
+        Evalúa toda la rejilla de una vez con NumPy (anchos x calles x Z) y
+        devuelve un ResultadoImposicion, o None si la etiqueta no cabe en
+        ningún ancho del catálogo.
+        """
+        cat = catalogo or CATALOGO_BANDAS[material]
+        anchos = np.asarray(cat.anchos_mm, dtype=float)[:, None, None]
+        calles = np.arange(1, MAX_CALLES + 1, dtype=float)[None, :, None]
+        z = np.asarray(Z_CILINDROS, dtype=float)[None, None, :]
+
+        ancho_util = calles * ancho_mm + (calles - 1) * cat.gap_calle_mm + 2 * cat.refile_mm
+        circunferencia = z * PASO_DIENTE_MM
+        por_vuelta = np.floor(circunferencia / (largo_mm + cat.gap_desarrollo_mm))
+        valido = (ancho_util <= anchos) & (por_vuelta >= 1)
+        if not valido.any():
+            return None
+
+        vueltas = np.ceil(cantidad_total / np.maximum(calles * por_vuelta, 1))
+        ml = vueltas * circunferencia / 1000
+        m2 = np.where(valido, anchos * ml / 1000, np.inf)
+
+        i, j, k = np.unravel_index(np.argmin(m2), m2.shape)
+        m2_netos = ancho_mm * largo_mm * cantidad_total / 1_000_000
+        m2_min = float(m2[i, j, k])
+        return ResultadoImposicion(
+            ancho_banda_mm=float(anchos[i, 0, 0]),
+            calles=int(calles[0, j, 0]),
+            etiquetas_vuelta=int(por_vuelta[0, 0, k]),
+            z_cilindro=int(z[0, 0, k]),
+            paso_mm=round(float(circunferencia[0, 0, k] / por_vuelta[0, 0, k]), 2),
+            ml_consumidos=round(float(ml[0, j, k]), 2),
+            m2_consumidos=round(m2_min, 2),
+            m2_netos=round(m2_netos, 2),
+            merma_pct=round(100 * (1 - m2_netos / m2_min), 1),
+        )
+
+    @staticmethod
+    def calcular_rollos(specs: EspecificacionesDTO):
+        """Número de rollos y diámetro exterior (mm) de cada rollo."""
+        r = CalculadoraProduccion.calcular_lote_specs([specs])
+        return int(r["rollos"][0]), float(r["diametro_mm"][0])
+
+
+# =============================================================================
+# 3. ORDEN DE TRABAJO (PDF)
+# =============================================================================
+def valores_orden(cliente_dto: ClienteDTO, specs_obj: EspecificacionesDTO, prod_dto: ProduccionDTO,
+                  fecha: datetime.date = None) -> dict:
+    """Textos de los campos variables de la orden, por clave de ORDEN_LAYOUT."""
+    ml_res, m2_res = CalculadoraProduccion.calcular_consumos(specs_obj)
+    rollos_res, diametro_res = CalculadoraProduccion.calcular_rollos(specs_obj)
+    imp = CalculadoraProduccion.optimizar_imposicion(specs_obj.ancho_mm, specs_obj.largo_mm, specs_obj.cantidad_total, specs_obj.material)
+    return {
+        "cliente": cliente_dto.razon_social,
+        "referencia": cliente_dto.referencia_interna,
+        "email": cliente_dto.email_contacto,
+        "fecha": (fecha or datetime.date.today()).strftime("%d/%m/%Y"),
+        "material": specs_obj.material,
+        "mandril": specs_obj.mandril,
+        "medidas": f"{specs_obj.ancho_mm} x {specs_obj.largo_mm} mm",
+        "cantidad": f"{specs_obj.cantidad_total}",
+        "bobinado": f"POSICIÓN {prod_dto.sentido_bobinado}",
+        "uds_rollo": str(specs_obj.uds_rollo),
+        "metraje": f"{ml_res} m",
+        "area": f"{m2_res} m2",
+        "rollos": str(rollos_res),
+        "diametro": f"{diametro_res:.0f} mm",
+        "imposicion": f"{imp.calles} calles / {imp.ancho_banda_mm:.0f} mm" if imp else "-",
+        "cilindro": f"Z{imp.z_cilindro} ({imp.etiquetas_vuelta}/vuelta)" if imp else "-",
+        "consumo_real": f"{imp.m2_consumidos} m2 / {imp.ml_consumidos} m" if imp else "-",
+        "merma": f"{imp.merma_pct} %" if imp else "-",
+    }
+
+
+def generar_orden_pdf(cliente_dto: ClienteDTO, specs_obj: EspecificacionesDTO, prod_dto: ProduccionDTO,
+                      usar_plantilla: bool = True, fecha: datetime.date = None) -> bytes:
+    """Renderiza la orden de trabajo y la devuelve en memoria (sin fichero temporal).
+
+    `fecha` permite reimprimir una orden del historial con su fecha original.
+    """
+    import orden_pdf  # fpdf sólo se importa al renderizar la primera orden
+
+    with span("render_pdf"):
+        valores = valores_orden(cliente_dto, specs_obj, prod_dto, fecha)
+        pdf = orden_pdf.componer_orden(valores, prod_dto.notas_maquinista, usar_plantilla)
+
+    with span("pdf_output"):
+        return pdf.output()
+
+
+def valores_etiqueta(cliente_dto: ClienteDTO, specs_obj: EspecificacionesDTO, prod_dto: ProduccionDTO) -> dict:
+    """Campos comunes a todas las etiquetas de rollo de la orden."""
+    return {
+        "referencia": cliente_dto.referencia_interna,
+        "cliente": cliente_dto.razon_social,
+        "material": specs_obj.material,
+        "mandril": specs_obj.mandril,
+        "medidas": f"{specs_obj.ancho_mm:g} x {specs_obj.largo_mm:g} mm",
+        "bobinado": f"POS {prod_dto.sentido_bobinado}",
+    }
+
+
+def generar_etiquetas_rollo(destino, cliente_dto: ClienteDTO, specs_obj: EspecificacionesDTO,
+                            prod_dto: ProduccionDTO, formato: str = None) -> int:
+    """Escribe en `destino` (fichero binario) una etiqueta por rollo. Devuelve el nº de páginas.
+
+    `formato` es "a4" (hoja de 10 etiquetas) o "termica" (una por página);
+    por defecto `etiquetas_rollo_formato`.
+    """
+    import etiquetas_rollo
+
+    rollos, _ = CalculadoraProduccion.calcular_rollos(specs_obj)
+    with span("etiquetas_rollo"):
+        return etiquetas_rollo.escribir_etiquetas(
+            destino, valores_etiqueta(cliente_dto, specs_obj, prod_dto),
+            rollos, specs_obj.uds_rollo, specs_obj.cantidad_total,
+            formato or get_config("etiquetas_rollo_formato", "a4"),
+        )
+
+
+@contextlib.contextmanager
+def etiquetas_rollo_en_spool(ordenes, spool_dir: str):
+    """Escribe las etiquetas de rollo de cada `(cliente, specs, prod)` en ficheros del spool.
+
+    Devuelve la lista de adjuntos `(ruta, nombre)` para `mensaje_a_fichero`,
+    que los codifica por bloques: ni el PDF ni su base64 pasan por memoria,
+    que no depende del nº de rollos. Los ficheros se borran al salir. Con
+    `etiquetas_rollo_adjuntar` desactivado la lista queda vacía.
+    """
+    adjuntos = []
+    try:
+        if ordenes and get_config("etiquetas_rollo_adjuntar", True):
+            os.makedirs(spool_dir, exist_ok=True)
+            for cliente, specs, prod in ordenes:
+                fd, path = tempfile.mkstemp(prefix="etiquetas_", suffix=".pdf", dir=spool_dir)
+                adjuntos.append((path, f"Etiquetas_{cliente.referencia_interna}.pdf"))
+                with os.fdopen(fd, "wb") as f:
+                    generar_etiquetas_rollo(f, cliente, specs, prod)
+        yield list(adjuntos)  # copia: el llamante puede añadir otros adjuntos (arte final)
+    finally:
+        for path, _ in adjuntos:
+            os.remove(path)
+
+
+# =============================================================================
+# 4. CORREO Y ALMACENES
+# =============================================================================
+class EmailService:
+    TALLER_EMAIL = "covet@etiquetes.com"
+
+    @staticmethod
+    def _adjunto_base64(encoded: str, filename: str) -> MIMEBase:
+        """Adjunto PDF a partir de un payload ya codificado en base64."""
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(encoded)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+        return part
+
+    @staticmethod
+    def build_messages(client_data: ClienteDTO, prod_data: ProduccionDTO, pdf_data: bytes, user: str,
+                       nota_arte_final: str = None):
+        """Construye los mensajes MIME de taller y cliente (sin enviarlos).
+
+        El arte final no se adjunta aquí: lo añade `preparar_mensajes` en
+        streaming, o se referencia en el cuerpo con `nota_arte_final`.
+        """
+        # --- 1. EMAIL TALLER ---
+        msg_taller = MIMEMultipart()
+        msg_taller['From'] = user
+        msg_taller['To'] = EmailService.TALLER_EMAIL
+        msg_taller['Subject'] = f"🏭 [PROD] {client_data.razon_social} | REF: {client_data.referencia_interna}"
+
+        cuerpo_taller = f"Nueva orden generada.\nCliente: {client_data.razon_social}\nRef: {client_data.referencia_interna}"
+        if nota_arte_final:
+            cuerpo_taller += f"\n\n{nota_arte_final}"
+        msg_taller.attach(MIMEText(cuerpo_taller, 'plain'))
+
+        # La ficha se codifica una sola vez y ambos adjuntos comparten el mismo texto base64
+        ficha_b64 = base64.encodebytes(pdf_data).decode("ascii")
+
+        # Adjunto Ficha Taller
+        msg_taller.attach(EmailService._adjunto_base64(ficha_b64, f"Ficha_{client_data.referencia_interna}.pdf"))
+
+        # --- 2. EMAIL CLIENTE ---
+        msg_cliente = MIMEMultipart()
+        msg_cliente['From'] = user
+        msg_cliente['To'] = client_data.email_contacto
+        msg_cliente['Subject'] = f"✅ Pedido Recibido: {client_data.referencia_interna} - FlexyLabel"
+
+        msg_cliente.attach(MIMEText(f"Hola,\n\nSu pedido para {client_data.razon_social} está en marcha.\nAdjuntamos ficha técnica.", 'plain'))
+
+        # Adjunto Ficha Cliente
+        msg_cliente.attach(EmailService._adjunto_base64(ficha_b64, "Ficha_Tecnica.pdf"))
+
+        return msg_taller, msg_cliente
+
+    @staticmethod
+    def preparar_mensajes(client_data: ClienteDTO, prod_data: ProduccionDTO, pdf_data: bytes, user: str,
+                          specs: EspecificacionesDTO = None, taller: bool = True):
+        """Mensajes listos para el outbox: `(from, [destinatarios], bytes | ruta)`.
+
+        Devuelve `(mensajes, sha256 del arte final o None)`.
+
+        El arte final se guarda en el almacén por contenido y se codifica en
+        streaming dentro del mensaje del taller hasta que éste lo recibe
+        (`marcar_artes_entregados`). Si ya lo recibió o supera el umbral de
+        adjunto, sólo se envía el enlace. Con `specs` el taller recibe también
+        las etiquetas de rollo. Con `taller=False` (modo resumen) sólo se
+        prepara la confirmación al cliente.
+        """
+        spool_dir = get_config("outbox_spool", "outbox_spool")
+        arte = None
+        nota = None
+        if prod_data.arte_final:
+            max_mb, adjunto_max_mb = limites_arte_final()
+            with span("arte_final"):
+                arte = preparar_arte_final(
+                    prod_data.arte_final, client_data.razon_social, client_data.referencia_interna,
+                    get_almacen_arte_final(),
+                    max_bytes=max_mb * 2**20,
+                    adjunto_max_bytes=adjunto_max_mb * 2**20,
+                    enlazar=enlace_arte_final,
+                )
+            if arte.repetido:
+                nota = f"Arte final sin cambios (ya recibido, sha256 {arte.sha256[:12]}): {arte.enlace}"
+            elif not arte.adjuntar:
+                nota = f"Arte final (descarga): {arte.enlace}"
+
+        with span("mime"):
+            msg_taller, msg_cliente = EmailService.build_messages(
+                client_data, prod_data, pdf_data, user, nota_arte_final=nota,
+            )
+            raw_cliente = mensaje_a_bytes(msg_cliente)
+            if not taller:
+                return [(user, [client_data.email_contacto], raw_cliente)], arte.sha256 if arte else None
+            etiquetas = [(client_data, specs, prod_data)] if specs is not None else []
+            with etiquetas_rollo_en_spool(etiquetas, spool_dir) as adjuntos:
+                if arte and arte.adjuntar:
+                    adjuntos.append((arte.path, "ARTE_FINAL.pdf"))
+                raw_taller = mensaje_a_fichero(msg_taller, adjuntos, spool_dir) if adjuntos else mensaje_a_bytes(msg_taller)
+
+            mensajes = [
+                (user, [EmailService.TALLER_EMAIL], raw_taller),
+                (user, [client_data.email_contacto], raw_cliente),
+            ]
+        return mensajes, arte.sha256 if arte else None
+
+
+ARTE_FINAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arte_final")
+# Ubicación anterior, servida en público por Streamlit en /app/static
+ARTE_FINAL_DIR_STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "arte_final")
+
+
+def limites_arte_final():
+    """(máximo aceptado, máximo como adjunto) del arte final, en MB."""
+    return int(get_config("arte_final_max_mb", 200)), int(get_config("arte_final_adjunto_max_mb", 20))
+
+
+@functools.lru_cache(maxsize=1)
+def get_almacen_arte_final() -> AlmacenArteFinal:
+    """Almacén de artes finales compartido por el proceso (UI, importación masiva y API)."""
+    if os.path.isdir(ARTE_FINAL_DIR_STATIC) and not os.path.exists(ARTE_FINAL_DIR):
+        os.replace(ARTE_FINAL_DIR_STATIC, ARTE_FINAL_DIR)
+        logger.info(f"Almacén de arte final movido de {ARTE_FINAL_DIR_STATIC} a {ARTE_FINAL_DIR}")
+    return AlmacenArteFinal(
+        ARTE_FINAL_DIR,
+        get_config("arte_final_index_db", "arte_final.db"),
+        max_bytes=int(get_config("arte_final_store_max_mb", 10240)) * 2**20,
+    )
+
+
+def enlace_arte_final(sha256: str) -> str:
+    """URL firmada de descarga de un arte final del almacén (la sirve api.py)."""
+    caduca_en = int(time.time()) + int(get_config("arte_final_enlace_dias", 30)) * 86400
+    firma = get_almacen_arte_final().firmar(sha256, caduca_en)
+    api_url = get_config("api_url", "http://localhost:8600").rstrip("/")
+    return f"{api_url}/api/v1/arte-final/{sha256}?exp={caduca_en}&firma={firma}"
+
+
+def marcar_artes_entregados(hashes) -> None:
+    """Llamar tras encolar el correo del taller: a partir de ahí esos artes finales van por enlace."""
+    hashes = [sha for sha in hashes if sha]
+    if hashes:
+        get_almacen_arte_final().marcar_entregados(hashes)
+
+
+@functools.lru_cache(maxsize=1)
+def get_historial() -> HistorialPedidos:
+    return HistorialPedidos(get_config("historial_db", "historial.db"))
+
+
+def pedido_a_dtos(fila):
+    """DTOs de un pedido del historial; el arte final se recupera del almacén por hash."""
+    cliente = ClienteDTO(fila["razon_social"], fila["email_contacto"], fila["referencia_interna"])
+    specs = EspecificacionesDTO(fila["ancho_mm"], fila["largo_mm"], fila["cantidad_total"],
+                                fila["material"], fila["mandril"], fila["uds_rollo"])
+    ruta_arte = get_almacen_arte_final().buscar(fila["arte_sha256"]) if fila["arte_sha256"] else None
+    prod = ProduccionDTO(fila["sentido_bobinado"], fila["notas_maquinista"], ArchivoLocal(ruta_arte) if ruta_arte else None)
+    return cliente, specs, prod
+
+
+def encolar_orden(outbox, mail_from: str, client_data: ClienteDTO, prod_data: ProduccionDTO, pdf_data: bytes,
+                  specs: EspecificacionesDTO = None, registrar: bool = True):
+    """Prepara los correos de la orden y los encola en `outbox`. Devuelve el sha256 del arte final.
+
+    Con `specs` y `registrar` la orden queda además en el historial (los
+    reenvíos desde el historial no crean un pedido nuevo) y, en modo resumen,
+    el taller la recibe en el siguiente resumen en lugar de en un correo propio.
+    """
+    registrar = registrar and specs is not None
+    resumen = registrar and resumen_taller_activo()
+    mensajes, arte_sha256 = EmailService.preparar_mensajes(client_data, prod_data, pdf_data, mail_from, specs,
+                                                           taller=not resumen)
+    dtos = [d for d in (client_data, specs, prod_data) if d is not None]
+    with span("encolado"):
+        outbox.enqueue(order_record(*dtos), mensajes)
+        if not resumen:
+            marcar_artes_entregados([arte_sha256])
+        if registrar:
+            get_historial().registrar(client_data, specs, prod_data, arte_sha256, pendiente_taller=resumen)
+    return arte_sha256
+
+
+def _numero(valor, tipo=float):
+    if isinstance(valor, str):
+        valor = valor.strip().replace(",", ".")
+    return tipo(float(valor))
+
+
+def dtos_desde_campos(campos: dict, referencia_por_defecto, arte_final=None):
+    """DTOs de una orden a partir de campos planos (fila CSV o JSON de la API).
+
+    Lanza ValueError si no es válida. Sin `referencia_interna` se usa
+    `referencia_por_defecto()`.
+    """
+    def texto(col, defecto=""):
+        valor = campos.get(col)
+        return defecto if valor is None else str(valor).strip()
+
+    if not texto("razon_social") or not texto("email_contacto"):
+        raise ValueError("faltan razon_social o email_contacto")
+
+    specs = EspecificacionesDTO(
+        _numero(campos.get("ancho_mm")),
+        _numero(campos.get("largo_mm")),
+        _numero(campos.get("cantidad_total"), int),
+        texto("material", "PP Blanco"),
+        texto("mandril", "Ø 76 mm"),
+        _numero(campos.get("uds_rollo") or 1000, int),
+    )
+    if min(specs.ancho_mm, specs.largo_mm, specs.cantidad_total, specs.uds_rollo) <= 0:
+        raise ValueError("medidas y cantidades deben ser positivas")
+    if specs.material not in MATERIALES:
+        raise ValueError(f"material desconocido '{specs.material}'")
+    diametro_mandril_mm(specs.mandril)
+
+    prod = ProduccionDTO(texto("sentido_bobinado", "3"), texto("notas_maquinista"), arte_final)
+    cliente = ClienteDTO(texto("razon_social"), texto("email_contacto"),
+                         texto("referencia_interna") or referencia_por_defecto())
+    return cliente, specs, prod
+
+
+# =============================================================================
+# 5. RESUMEN DEL TALLER
+# =============================================================================
+# En modo resumen (`taller_resumen`) cada orden nueva sólo envía al momento la
+# confirmación al cliente; el taller recibe un único correo cada
+# `taller_resumen_ventana_s` segundos o `taller_resumen_max_ordenes` órdenes,
+# lo que antes ocurra. Los pedidos esperan en el historial y el worker del
+# outbox los agrupa (`volcar_resumen_taller`), así que el resumen sobrevive a
+# reinicios y se vuelve a renderizar desde los datos guardados.
+
+def resumen_taller_activo() -> bool:
+    return bool(get_config("taller_resumen", False))
+
+
+def resumen_por_material(specs_list) -> list:
+    """Filas `(material, órdenes, metros, m2, rollos)` con los consumos sumados por material y el total."""
+    r = CalculadoraProduccion.calcular_lote_specs(specs_list)
+    materiales = np.array([s.material for s in specs_list])
+    filas = []
+    for material in sorted(set(materiales.tolist())):
+        m = materiales == material
+        filas.append((material, int(m.sum()), float(r["ml"][m].sum()), float(r["m2"][m].sum()), int(r["rollos"][m].sum())))
+    filas.append(("TOTAL", len(specs_list), float(r["ml"].sum()), float(r["m2"].sum()), int(r["rollos"].sum())))
+    return filas
+
+
+def preparar_resumen_taller(pedidos, user: str):
+    """Mensaje del resumen para las filas `pedidos` del historial: `(from, [taller], bytes | ruta)`.
+
+    Adjunta un único PDF (consumos por material + las órdenes re-renderizadas
+    con su fecha original), las etiquetas de rollo de cada orden y cada arte
+    final distinto una sola vez (los que superan el umbral de adjunto van por enlace).
+    """
+    import orden_pdf
+
+    ordenes = [(pedido_a_dtos(fila), datetime.date.fromtimestamp(fila["created_at"])) for fila in pedidos]
+    resumen = resumen_por_material([specs for (_, specs, _), _ in ordenes])
+    referencias = [cliente.referencia_interna for (cliente, _, _), _ in ordenes]
+    with span("render_resumen"):
+        pdf = orden_pdf.componer_resumen(
+            [(material, str(n), f"{ml:.2f} m", f"{m2:.2f} m2", str(rollos))
+             for material, n, ml, m2, rollos in resumen],
+            [(valores_orden(c, s, p, fecha), p.notas_maquinista) for (c, s, p), fecha in ordenes],
+        )
+        pdf_data = bytes(pdf.output())
+
+    # Arte final deduplicado por hash: varias órdenes con el mismo fichero lo adjuntan una vez
+    _, adjunto_max_mb = limites_arte_final()
+    artes, lineas_arte = {}, []
+    for fila in pedidos:
+        sha = fila["arte_sha256"]
+        if not sha:
+            continue
+        if sha not in artes:
+            ruta = get_almacen_arte_final().buscar(sha)
+            artes[sha] = ruta if ruta and os.path.getsize(ruta) <= adjunto_max_mb * 2**20 else None
+        destino = f"ARTE_FINAL_{sha[:12]}.pdf" if artes[sha] else enlace_arte_final(sha)
+        lineas_arte.append(f"  {fila['referencia_interna']}: {destino}")
+
+    cuerpo = [f"Resumen de {len(pedidos)} órdenes.", "", "Consumos por material:"]
+    cuerpo += [f"  {material:<18}{n:>4} órdenes {ml:>12.2f} m {m2:>10.2f} m2 {rollos:>6} rollos"
+               for material, n, ml, m2, rollos in resumen]
+    cuerpo += ["", "Órdenes:"] + [f"  {c.referencia_interna}  {c.razon_social}" for (c, _, _), _ in ordenes]
+    if lineas_arte:
+        cuerpo += ["", "Arte final:"] + lineas_arte
+
+    with span("mime"):
+        msg = MIMEMultipart()
+        msg['From'] = user
+        msg['To'] = EmailService.TALLER_EMAIL
+        msg['Subject'] = f"🏭 [PROD] Resumen de {len(pedidos)} órdenes | {referencias[0]} … {referencias[-1]}"
+        msg.attach(MIMEText("\n".join(cuerpo), 'plain'))
+        msg.attach(EmailService._adjunto_base64(
+            base64.encodebytes(pdf_data).decode("ascii"),
+            f"Resumen_Taller_{datetime.datetime.now():%Y%m%d_%H%M}.pdf",
+        ))
+        spool_dir = get_config("outbox_spool", "outbox_spool")
+        with etiquetas_rollo_en_spool([dtos for dtos, _ in ordenes], spool_dir) as adjuntos:
+            adjuntos += [(ruta, f"ARTE_FINAL_{sha[:12]}.pdf") for sha, ruta in artes.items() if ruta]
+            raw = mensaje_a_fichero(msg, adjuntos, spool_dir) if adjuntos else mensaje_a_bytes(msg)
+    return user, [EmailService.TALLER_EMAIL], raw
+
+
+def volcar_resumen_taller(outbox, historial: HistorialPedidos, mail_from: str, forzar: bool = False) -> int:
+    """Encola resúmenes mientras haya pedidos pendientes y haya vencido la ventana o se llegue al máximo.
+
+    Pensado como tarea del OutboxWorker. Si el modo resumen se desactiva, lo
+    pendiente se envía en la siguiente pasada. Devuelve el nº de órdenes resumidas.
+    """
+    max_ordenes = int(get_config("taller_resumen_max_ordenes", 25))
+    ventana_s = float(get_config("taller_resumen_ventana_s", 900))
+    total = 0
+    while True:
+        n, antiguo = historial.estado_pendientes_taller()
+        if not n or (not forzar and resumen_taller_activo() and n < max_ordenes and time.time() - antiguo < ventana_s):
+            return total
+        pedidos = historial.tomar_pendientes_taller(max_ordenes)
+        if not pedidos:
+            return total
+        ids = [fila["id"] for fila in pedidos]
+        try:
+            with span("resumen_taller"):
+                mensaje = preparar_resumen_taller(pedidos, mail_from)
+                outbox.enqueue({"ResumenTaller": {"referencias": [f["referencia_interna"] for f in pedidos]},
+                                "encolado": datetime.datetime.now().isoformat(timespec="seconds")}, [mensaje])
+            marcar_artes_entregados(fila["arte_sha256"] for fila in pedidos)
+        except Exception:
+            historial.liberar_pendientes_taller(ids)
+            raise
+        historial.completar_pendientes_taller(ids)
+        logger.info(f"Resumen del taller encolado: {len(ids)} órdenes")
+        total += len(ids)
@@ -0,0 +1,222 @@
+import functools
+import zlib
+from dataclasses import dataclass
+
+from fpdf import FPDF
+
+# =============================================================================
+# ETIQUETAS DE IDENTIFICACIÓN DE ROLLO (PDF EN STREAMING)
+# =============================================================================
+# Una etiqueta por rollo. fpdf2 guarda todas las páginas en memoria hasta
+# `output()`, así que aquí sólo se usa para dibujar trozos de contenido: la
+# parte estática (marco, banner, rótulos) se graba una vez por proceso y, con
+# los datos de la orden, forma un Form XObject que cada etiqueta reutiliza.
+# Por rollo sólo cambian el número y las unidades, y cada página se escribe
+# en el destino en cuanto está lista: la memoria no depende del nº de rollos
+# (salvo los offsets de la tabla xref, dos enteros por página).
+
+ETIQUETA_MM = (100, 55)
+
+# formato -> ((ancho, alto) de la página en mm, columnas, filas)
+FORMATOS = {
+    "a4": ((210, 297), 2, 5),
+    "termica": (ETIQUETA_MM, 1, 1),
+}
+
+PT_POR_MM = 72 / 25.4
+
+
+@dataclass(frozen=True)
+class PlantillaEtiqueta:
+    """Parte estática de la etiqueta grabada una vez (marco, banner y rótulos)."""
+    contenido: bytes  # stream de contenido en coordenadas de la etiqueta
+    fuentes: tuple    # ((fontkey, fuente), ...) en el orden de registro del stream
+    huecos: tuple     # ((clave, x, y, ancho, tamaño, estilo), ...) posiciones de los valores
+    variables: bytes  # nº de rollo y unidades maquetados con los marcadores {rollo} y {uds}
+
+
+class EtiquetaRolloPDF(FPDF):
+    """Página del tamaño de una etiqueta donde se dibujan los trozos de contenido."""
+
+    def __init__(self, plantilla: PlantillaEtiqueta = None):
+        super().__init__(unit="mm", format=ETIQUETA_MM)
+        self.set_auto_page_break(False)
+        self.set_margins(0, 0, 0)
+        self._huecos = []
+        self.add_page()
+        if plantilla is not None:
+            # Los ids de fuente (/F1, /F2...) deben coincidir con los de la plantilla
+            self.fonts.update(plantilla.fuentes)
+
+    def campo(self, rotulo: str, clave: str, x: float, y: float, w: float, tamano: float = 9, estilo: str = ""):
+        self.set_font('Helvetica', 'B', 6)
+        self.set_text_color(100, 116, 139)
+        self.set_xy(x, y)
+        self.cell(w, 3, rotulo)
+        self._huecos.append((clave, x, y + 3, w, tamano, estilo))
+
+    def capturar(self) -> bytes:
+        """Devuelve y vacía el contenido dibujado desde la última captura."""
+        contenido = bytes(self.pages[self.page].contents)
+        self.pages[self.page].contents = bytearray()
+        self.current_font_is_set_on_page = False
+        return contenido
+
+    def escribir_valores(self, huecos, valores: dict):
+        """Escribe los `valores` presentes en sus huecos sobre la página actual."""
+        self.set_text_color(15, 23, 42)
+        for clave, x, y, w, tamano, estilo in huecos:
+            if clave in valores:
+                self.set_font('Helvetica', estilo, tamano)
+                self.set_xy(x, y)
+                self.cell(w, tamano * 0.45, self._ajustar(str(valores[clave]), w))
+
+    def rellenar(self, huecos, valores: dict) -> bytes:
+        """Contenido con los `valores` presentes escritos en sus huecos."""
+        self.escribir_valores(huecos, valores)
+        return self.capturar()
+
+    def _ajustar(self, texto: str, w: float) -> str:
+        if self.get_string_width(texto) <= w:
+            return texto
+        while texto and self.get_string_width(texto + "...") > w:
+            texto = texto[:-1]
+        return texto + "..."
+
+
+def dibujar_etiqueta(pdf: EtiquetaRolloPDF):
+    """Marco, banner y rótulos de la etiqueta; registra los huecos de los valores en `pdf._huecos`."""
+    ancho, alto = ETIQUETA_MM
+    pdf.set_draw_color(51, 65, 85)
+    pdf.set_line_width(0.3)
+    pdf.rect(1, 1, ancho - 2, alto - 2)
+    pdf.set_fill_color(15, 23, 42)
+    pdf.rect(1, 1, ancho - 2, 8, 'F')
+    pdf.set_xy(4, 2.5)
+    pdf.set_font('Helvetica', 'B', 8)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(0, 5, 'FLEXYLABEL · IDENTIFICACIÓN DE ROLLO')
+
+    pdf.campo("REFERENCIA", "referencia", 4, 11, 58, 11, 'B')
+    pdf.campo("BOBINADO", "bobinado", 66, 11, 30, 11, 'B')
+    pdf.campo("CLIENTE", "cliente", 4, 20, 92)
+    pdf.campo("MATERIAL", "material", 4, 28, 34)
+    pdf.campo("MANDRIL", "mandril", 40, 28, 24)
+    pdf.campo("MEDIDAS", "medidas", 66, 28, 30)
+    pdf.set_fill_color(241, 245, 249)
+    pdf.rect(1, 37, ancho - 2, alto - 38, 'F')
+    pdf.campo("ROLLO", "rollo", 4, 39, 58, 18, 'B')
+    pdf.campo("UDS / ROLLO", "uds", 66, 39, 30, 14, 'B')
+
+
+@functools.lru_cache(maxsize=1)
+def get_plantilla_etiqueta() -> PlantillaEtiqueta:
+    """Graba una vez la parte estática de la etiqueta (cacheado por proceso)."""
+    pdf = EtiquetaRolloPDF()
+    dibujar_etiqueta(pdf)
+    # Registra todas las fuentes de los valores para que tengan id en la plantilla
+    for estilo in {h[5] for h in pdf._huecos}:
+        pdf.set_font('Helvetica', estilo, 8)
+    contenido = pdf.capturar()
+    # Los valores van alineados a la izquierda: su posición no depende del texto,
+    # así que el nº de rollo y las unidades se maquetan una vez con marcadores
+    variables = pdf.rellenar(pdf._huecos, {"rollo": "{rollo}", "uds": "{uds}"})
+    return PlantillaEtiqueta(
+        contenido=contenido,
+        fuentes=tuple(pdf.fonts.items()),
+        huecos=tuple(pdf._huecos),
+        variables=variables,
+    )
+
+
+class EscritorPDF:
+    """PDF escrito objeto a objeto sobre un fichero; sólo guarda los offsets de la xref."""
+
+    def __init__(self, destino):
+        self.destino = destino
+        self.offsets = [0]
+        self.posicion = 0
+        self._escribir(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _escribir(self, datos: bytes):
+        self.destino.write(datos)
+        self.posicion += len(datos)
+
+    def reservar(self) -> int:
+        self.offsets.append(0)
+        return len(self.offsets) - 1
+
+    def objeto(self, cuerpo: bytes, numero: int = None) -> int:
+        numero = numero or self.reservar()
+        self.offsets[numero] = self.posicion
+        self._escribir(b"%d 0 obj\n%s\nendobj\n" % (numero, cuerpo))
+        return numero
+
+    def stream(self, datos: bytes, diccionario: bytes = b"") -> int:
+        datos = zlib.compress(datos)
+        return self.objeto(b"<< /Length %d /Filter /FlateDecode %s >>\nstream\n%s\nendstream"
+                           % (len(datos), diccionario, datos))
+
+    def cerrar(self, raiz: int):
+        inicio_xref = self.posicion
+        self._escribir(b"xref\n0 %d\n0000000000 65535 f \n" % len(self.offsets))
+        for offset in self.offsets[1:]:
+            self._escribir(b"%010d 00000 n \n" % offset)
+        self._escribir(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                       % (len(self.offsets), raiz, inicio_xref))
+
+
+def escribir_etiquetas(destino, valores: dict, rollos: int, uds_rollo: int, cantidad_total: int,
+                       formato: str = "a4") -> int:
+    """Escribe en `destino` (fichero binario) una etiqueta por rollo. Devuelve el nº de páginas.
+
+    `valores` son los campos comunes de la orden (referencia, cliente, material...);
+    el último rollo lleva las unidades restantes.
+    """
+    (ancho_pag, alto_pag), columnas, filas = FORMATOS[formato]
+    ancho, alto = ETIQUETA_MM
+    plantilla = get_plantilla_etiqueta()
+    pdf = EtiquetaRolloPDF(plantilla)
+    comunes = pdf.rellenar(plantilla.huecos, valores)
+
+    escritor = EscritorPDF(destino)
+    catalogo, paginas = escritor.reservar(), escritor.reservar()
+    fuentes = b" ".join(
+        b"/F%d %d 0 R" % (fuente.i, escritor.objeto(
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % fuente.name.encode("ascii")
+        ))
+        for _, fuente in pdf.fonts.items()
+    )
+    etiqueta = escritor.stream(
+        plantilla.contenido + comunes,
+        b"/Type /XObject /Subtype /Form /BBox [0 0 %.2f %.2f] /Resources << /Font << %s >> >>"
+        % (ancho * PT_POR_MM, alto * PT_POR_MM, fuentes),
+    )
+    recursos = b"<< /Font << %s >> /XObject << /Etq %d 0 R >> >>" % (fuentes, etiqueta)
+
+    # Rejilla centrada en la página; origen PDF abajo a la izquierda
+    x0 = (ancho_pag - columnas * ancho) / 2
+    y0 = (alto_pag - filas * alto) / 2
+    posiciones = [
+        ((x0 + c * ancho) * PT_POR_MM, (alto_pag - y0 - (f + 1) * alto) * PT_POR_MM)
+        for f in range(filas) for c in range(columnas)
+    ]
+    variables = plantilla.variables.replace(b"{rollo}", b"%d / " + str(rollos).encode()).replace(b"{uds}", b"%d")
+    ultimo = cantidad_total - uds_rollo * (rollos - 1)
+    kids = []
+    for primero in range(0, rollos, len(posiciones)):
+        partes = []
+        for (dx, dy), n in zip(posiciones, range(primero, min(primero + len(posiciones), rollos))):
+            partes.append(b"q 1 0 0 1 %.2f %.2f cm /Etq Do\n" % (dx, dy)
+                          + variables % (n + 1, uds_rollo if n < rollos - 1 else ultimo) + b"Q\n")
+        contenido = escritor.stream(b"".join(partes))
+        kids.append(escritor.objeto(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Contents %d 0 R /Resources %s >>"
+            % (paginas, ancho_pag * PT_POR_MM, alto_pag * PT_POR_MM, contenido, recursos)
+        ))
+
+    escritor.objeto(b"<< /Type /Pages /Kids [%s] /Count %d >>"
+                    % (b" ".join(b"%d 0 R" % k for k in kids), len(kids)), paginas)
+    escritor.objeto(b"<< /Type /Catalog /Pages %d 0 R >>" % paginas, catalogo)
+    escritor.cerrar(catalogo)
+    return len(kids)
@@ -0,0 +1,302 @@
+import sqlite3
+import time
+import datetime
+from dataclasses import asdict
+
+# =============================================================================
+# HISTORIAL DE PEDIDOS (SQLite INDEXADO)
+# =============================================================================
+# Cada orden enviada se guarda con sus tres DTOs aplanados. Las búsquedas usan
+# índices por referencia, razón social, fecha y material y paginan por cursor
+# (created_at, id), de modo que el coste no crece con la página consultada.
+#
+# La misma base guarda las secuencias de referencias (ORD-<año>-<nº>) y las
+# claves de idempotencia de los envíos: un doble clic o un rerun a mitad de
+# proceso encuentra la clave ya reservada y no vuelve a renderizar ni enviar.
+#
+# En modo resumen del taller, los pedidos nuevos quedan en `taller_pendientes`
+# hasta que el worker los agrupa en un único correo (ver `engine.volcar_resumen_taller`).
+
+ENVIO_EN_CURSO = "en_curso"
+ENVIO_COMPLETADO = "completado"
+
+# Una reserva en curso más antigua que esto se da por abandonada (proceso caído)
+RESERVA_CADUCIDAD_S = 600
+
+# A partir de estas coincidencias un prefijo de búsqueda se trata como amplio
+# (ver `HistorialPedidos._buscar_texto`)
+BUSQUEDA_PREFIJO_AMPLIO = 2000
+# Filas más recientes que se miran antes de buscar la coincidencia más reciente
+BUSQUEDA_VENTANA_RECIENTE = 5000
+
+# Claves derivadas sólo del contenido (fila CSV o JSON sin referencia ni
+# Idempotency-Key): protegen de reintentos, pero un pedido fijo que se repite
+# con el mismo contenido días después es un pedido nuevo
+CLAVE_CONTENIDO_CADUCIDAD_S = 24 * 3600
+
+COLUMNAS_PEDIDO = (
+    "razon_social", "email_contacto", "referencia_interna",
+    "ancho_mm", "largo_mm", "cantidad_total", "material", "mandril", "uds_rollo",
+    "sentido_bobinado", "notas_maquinista",
+)
+
+
+class HistorialPedidos:
+    def __init__(self, db_path: str = "historial.db"):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS pedidos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    razon_social TEXT NOT NULL COLLATE NOCASE,
+                    email_contacto TEXT NOT NULL,
+                    referencia_interna TEXT NOT NULL COLLATE NOCASE,
+                    ancho_mm REAL NOT NULL,
+                    largo_mm REAL NOT NULL,
+                    cantidad_total INTEGER NOT NULL,
+                    material TEXT NOT NULL,
+                    mandril TEXT NOT NULL,
+                    uds_rollo INTEGER NOT NULL,
+                    sentido_bobinado TEXT NOT NULL,
+                    notas_maquinista TEXT NOT NULL DEFAULT '',
+                    arte_sha256 TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_pedidos_referencia ON pedidos(referencia_interna, created_at);
+                CREATE INDEX IF NOT EXISTS idx_pedidos_cliente ON pedidos(razon_social, created_at);
+                CREATE INDEX IF NOT EXISTS idx_pedidos_fecha ON pedidos(created_at, id);
+                CREATE INDEX IF NOT EXISTS idx_pedidos_material ON pedidos(material, created_at);
+                CREATE TABLE IF NOT EXISTS secuencias (
+                    nombre TEXT PRIMARY KEY,
+                    ultimo INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS envios (
+                    clave TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    estado TEXT NOT NULL,
+                    referencia TEXT
+                );
+                CREATE TABLE IF NOT EXISTS taller_pendientes (
+                    pedido_id INTEGER PRIMARY KEY REFERENCES pedidos(id),
+                    created_at REAL NOT NULL,
+                    tomado_en REAL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _fila(cliente, specs, prod, arte_sha256, created_at):
+        datos = {**asdict(cliente), **asdict(specs), **asdict(prod)}
+        datos["notas_maquinista"] = datos.get("notas_maquinista") or ""
+        datos["sentido_bobinado"] = str(datos["sentido_bobinado"])
+        return (created_at, *(datos[c] for c in COLUMNAS_PEDIDO), arte_sha256)
+
+    def registrar_lote(self, pedidos, pendiente_taller: bool = False) -> None:
+        """Inserta `(cliente, specs, prod, arte_sha256)` en una sola transacción.
+
+        Con `pendiente_taller` los pedidos quedan a la espera del resumen del taller.
+        """
+        now = time.time()
+        sql = (f"INSERT INTO pedidos (created_at, {', '.join(COLUMNAS_PEDIDO)}, arte_sha256) "
+               f"VALUES ({', '.join('?' * (len(COLUMNAS_PEDIDO) + 2))})")
+        filas = [self._fila(c, s, p, sha, now) for c, s, p, sha in pedidos]
+        with self._connect() as conn:
+            if not pendiente_taller:
+                conn.executemany(sql, filas)
+                return
+            ids = [conn.execute(sql, fila).lastrowid for fila in filas]
+            conn.executemany("INSERT INTO taller_pendientes (pedido_id, created_at) VALUES (?, ?)",
+                             [(pedido_id, now) for pedido_id in ids])
+
+    def registrar(self, cliente, specs, prod, arte_sha256: str = None, pendiente_taller: bool = False) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"INSERT INTO pedidos (created_at, {', '.join(COLUMNAS_PEDIDO)}, arte_sha256) "
+                f"VALUES ({', '.join('?' * (len(COLUMNAS_PEDIDO) + 2))})",
+                self._fila(cliente, specs, prod, arte_sha256, now),
+            )
+            if pendiente_taller:
+                conn.execute("INSERT INTO taller_pendientes (pedido_id, created_at) VALUES (?, ?)",
+                             (cur.lastrowid, now))
+            return cur.lastrowid
+
+    # --- Resumen del taller ---
+    def estado_pendientes_taller(self):
+        """`(nº de pedidos libres a la espera del resumen, created_at del más antiguo)`."""
+        with self._connect() as conn:
+            n, antiguo = conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM taller_pendientes WHERE tomado_en IS NULL OR tomado_en < ?",
+                (time.time() - RESERVA_CADUCIDAD_S,),
+            ).fetchone()
+        return n, antiguo
+
+    def tomar_pendientes_taller(self, limite: int) -> list:
+        """Reserva hasta `limite` pedidos pendientes (los más antiguos) y devuelve sus filas.
+
+        Una reserva no completada caduca como las de `reservar_envio`, así que
+        dos workers no envían el mismo pedido y un proceso caído no lo pierde.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [r[0] for r in conn.execute(
+                "SELECT pedido_id FROM taller_pendientes WHERE tomado_en IS NULL OR tomado_en < ? "
+                "ORDER BY pedido_id LIMIT ?",
+                (now - RESERVA_CADUCIDAD_S, limite),
+            )]
+            conn.executemany("UPDATE taller_pendientes SET tomado_en = ? WHERE pedido_id = ?",
+                             [(now, i) for i in ids])
+            return conn.execute(
+                f"SELECT * FROM pedidos WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY id", ids
+            ).fetchall()
+
+    def completar_pendientes_taller(self, ids) -> None:
+        """El resumen con estos pedidos ya está en el outbox."""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM taller_pendientes WHERE pedido_id = ?", [(i,) for i in ids])
+
+    def liberar_pendientes_taller(self, ids) -> None:
+        """Anula la reserva tras un fallo, para el siguiente intento del worker."""
+        with self._connect() as conn:
+            conn.executemany("UPDATE taller_pendientes SET tomado_en = NULL WHERE pedido_id = ?",
+                             [(i,) for i in ids])
+
+    # --- Referencias y claves de idempotencia ---
+    def siguiente_referencia(self, prefijo: str = "ORD", anio: int = None) -> str:
+        """Referencia única `PREFIJO-AÑO-NNNNNN` de una secuencia persistente por año."""
+        anio = anio or datetime.date.today().year
+        with self._connect() as conn:
+            numero = conn.execute(
+                "INSERT INTO secuencias (nombre, ultimo) VALUES (?, 1) "
+                "ON CONFLICT(nombre) DO UPDATE SET ultimo = ultimo + 1 RETURNING ultimo",
+                (f"{prefijo}-{anio}",),
+            ).fetchone()[0]
+        return f"{prefijo}-{anio}-{numero:06d}"
+
+    def reservar_envio(self, clave: str, caducidad_s: float = None):
+        """Reserva la clave de un envío.
+
+        Devuelve None si la clave es nueva (el llamante debe procesar la orden)
+        o la fila previa de `envios` si es un duplicado, ya completado o en curso.
+        Con `caducidad_s`, un envío completado hace más de ese tiempo ya no
+        cuenta como duplicado (ver CLAVE_CONTENIDO_CADUCIDAD_S).
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            previo = conn.execute("SELECT * FROM envios WHERE clave = ?", (clave,)).fetchone()
+            if previo and previo["estado"] == ENVIO_COMPLETADO:
+                if caducidad_s is None or now - previo["created_at"] < caducidad_s:
+                    return previo
+            elif previo and now - previo["created_at"] < RESERVA_CADUCIDAD_S:
+                return previo
+            conn.execute(
+                "INSERT OR REPLACE INTO envios (clave, created_at, estado, referencia) VALUES (?, ?, ?, NULL)",
+                (clave, now, ENVIO_EN_CURSO),
+            )
+        return None
+
+    def completar_envios(self, pares) -> None:
+        """Marca como completadas las claves `(clave, referencia)` en una transacción."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE envios SET estado = ?, referencia = ?, created_at = ? WHERE clave = ?",
+                [(ENVIO_COMPLETADO, referencia, now, clave) for clave, referencia in pares],
+            )
+
+    def completar_envio(self, clave: str, referencia: str):
+        self.completar_envios([(clave, referencia)])
+
+    def liberar_envio(self, clave: str):
+        """Anula una reserva tras un fallo, para que el usuario pueda reintentar."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM envios WHERE clave = ? AND estado = ?", (clave, ENVIO_EN_CURSO))
+
+    def obtener(self, pedido_id: int):
+        with self._connect() as conn:
+            return conn.execute("SELECT * FROM pedidos WHERE id = ?", (pedido_id,)).fetchone()
+
+    def buscar(self, texto: str = None, material: str = None, desde: datetime.date = None,
+               hasta: datetime.date = None, limite: int = 25, cursor=None):
+        """Página de pedidos, del más reciente al más antiguo.
+
+        `texto` filtra por prefijo de referencia o de razón social. `cursor` es
+        el `(created_at, id)` devuelto por la página anterior; la función
+        devuelve `(filas, cursor_siguiente)` con `cursor_siguiente=None` al final.
+        """
+        condiciones, params = [], []
+        if material:
+            condiciones.append("material = ?")
+            params.append(material)
+        if desde:
+            condiciones.append("created_at >= ?")
+            params.append(time.mktime(desde.timetuple()))
+        if hasta:
+            condiciones.append("created_at < ?")
+            params.append(time.mktime((hasta + datetime.timedelta(days=1)).timetuple()))
+        if cursor:
+            # Comparación de fila: SQLite la resuelve como rango de idx_pedidos_fecha (un OR no)
+            condiciones.append("(created_at, id) < (?, ?)")
+            params += [cursor[0], cursor[1]]
+
+        orden = f"ORDER BY created_at DESC, id DESC LIMIT {int(limite) + 1}"
+        with self._connect() as conn:
+            if not texto:
+                where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+                filas = conn.execute(f"SELECT * FROM pedidos {where} {orden}", params).fetchall()
+            else:
+                filas = self._buscar_texto(conn, texto, condiciones, params, orden, limite + 1)
+        siguiente = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            siguiente = (filas[-1]["created_at"], filas[-1]["id"])
+        return filas, siguiente
+
+    def _buscar_texto(self, conn, texto, condiciones, params, orden, n):
+        """Filtro por prefijo con el plan según cuántas filas casan.
+
+        Un prefijo estrecho se resuelve con los índices de referencia y de
+        cliente: cada rama ordena pocas filas y se combinan. Con un prefijo
+        amplio ("ORD", "cliente") ordenar todas las coincidencias costaría
+        cientos de ms; se recorre el índice por fecha desde el final, primero
+        en las filas más recientes y, si no llenan la página, a partir de la
+        coincidencia más reciente.
+        """
+        prefijo = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        ramas = ("referencia_interna", "razon_social")
+        like = "{} LIKE ? ESCAPE '\\'"
+        amplio = any(
+            conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM pedidos WHERE {like.format(col)} LIMIT ?)",
+                         (prefijo, BUSQUEDA_PREFIJO_AMPLIO)).fetchone()[0] >= BUSQUEDA_PREFIJO_AMPLIO
+            for col in ramas
+        )
+        if not amplio:
+            consultas = [
+                f"SELECT * FROM (SELECT * FROM pedidos WHERE {' AND '.join([like.format(col), *condiciones])} {orden})"
+                for col in ramas
+            ]
+            return conn.execute(f"{' UNION '.join(consultas)} {orden}", (prefijo, *params) * len(ramas)).fetchall()
+
+        # `+col` descarta los índices de texto: se recorre el de fecha (o el de material)
+        texto_sql = "(" + " OR ".join(like.format(f"+{col}") for col in ramas) + ")"
+        resto = "".join(f" AND {c}" for c in condiciones)
+        suelo = conn.execute(
+            f"SELECT created_at FROM pedidos WHERE 1{resto} ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+            (*params, BUSQUEDA_VENTANA_RECIENTE),
+        ).fetchone()
+        filas = conn.execute(f"SELECT * FROM pedidos WHERE {texto_sql}{resto} AND created_at >= ? {orden}",
+                             (prefijo, prefijo, *params, suelo[0] if suelo else 0)).fetchall()
+        if len(filas) >= n or suelo is None:
+            return filas
+        # Coincidencias antiguas o dispersas: el recorrido empieza en la más reciente
+        tope = max((conn.execute(f"SELECT MAX(created_at) FROM pedidos WHERE {like.format(col)}", (prefijo,))
+                    .fetchone()[0] or 0) for col in ramas)
+        return conn.execute(f"SELECT * FROM pedidos WHERE {texto_sql}{resto} AND created_at <= ? {orden}",
+                            (prefijo, prefijo, *params, tope)).fetchall()
@@ -0,0 +1,263 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# =============================================================================
+# MÉTRICAS: SPANS POR ETAPA, HISTOGRAMAS Y EXPORTACIÓN PROMETHEUS
+# =============================================================================
+# `span("etapa")` cronometra un bloque, lo acumula en el histograma
+# `flexylabel_etapa_segundos{etapa=...}`, cuenta los errores por tipo de
+# excepción y emite una línea JSON en el logger `FlexyLabel_Enterprise.metricas`.
+# El registro es global al proceso (compartido por sesiones y workers) y se
+# exporta en formato texto de Prometheus, a fichero o por HTTP en /metrics.
+# En un proceso hijo (pool de render) `capturar_spans()` recoge los spans para
+# devolverlos con el resultado; el padre los registra con `registrar_spans`.
+
+logger = logging.getLogger("FlexyLabel_Enterprise.metricas")
+
+BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Campos extra de las líneas JSON (p. ej. la referencia de la orden en curso).
+# No se convierten en etiquetas Prometheus para no disparar la cardinalidad.
+_contexto_log = contextvars.ContextVar("contexto_log", default={})
+# Lista activa de `capturar_spans()`: los spans se guardan ahí en lugar de registrarse
+_spans_capturados = contextvars.ContextVar("spans_capturados", default=None)
+
+
+class Histograma:
+    __slots__ = ("buckets", "cuentas", "suma", "total")
+
+    def __init__(self, buckets=BUCKETS_S):
+        self.buckets = buckets
+        self.cuentas = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        i = bisect.bisect_left(self.buckets, valor)
+        if i < len(self.cuentas):
+            self.cuentas[i] += 1
+        self.suma += valor
+        self.total += 1
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in labels) + "}"
+
+
+class RegistroMetricas:
+    """Histogramas, contadores y gauges en memoria, thread-safe."""
+
+    def __init__(self, prefijo: str = "flexylabel"):
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._histogramas = {}  # (nombre, labels) -> Histograma
+        self._contadores = {}   # (nombre, labels) -> float
+        self._gauges = {}       # nombre -> (ayuda, función que devuelve {labels: valor} o un número)
+        self._ayuda = {}
+
+    # --- Registro ---
+    def observar(self, nombre: str, valor: float, ayuda: str = "", **labels):
+        clave = (nombre, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histogramas.get(clave)
+            if hist is None:
+                hist = self._histogramas[clave] = Histograma()
+                self._ayuda.setdefault(nombre, ayuda)
+            hist.observar(valor)
+
+    def incrementar(self, nombre: str, valor: float = 1, ayuda: str = "", **labels):
+        clave = (nombre, tuple(sorted(labels.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+            self._ayuda.setdefault(nombre, ayuda)
+
+    def registrar_gauge(self, nombre: str, funcion, ayuda: str = ""):
+        """`funcion()` se evalúa en cada exportación."""
+        with self._lock:
+            self._gauges[nombre] = (ayuda, funcion)
+
+    @contextmanager
+    def span(self, etapa: str, **labels):
+        """Cronometra un bloque; las excepciones se cuentan y se propagan."""
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            duracion = time.perf_counter() - t0
+            # Las interrupciones de Streamlit (rerun/stop) no son errores de la etapa
+            es_error = isinstance(error, Exception) and type(error).__name__ not in ("RerunException", "StopException")
+            registro = {"etapa": etapa, "duracion": duracion, "labels": labels}
+            if es_error:
+                registro["error"] = (type(error).__name__, str(error)[:300])
+            capturados = _spans_capturados.get()
+            if capturados is not None:
+                capturados.append(registro)
+            else:
+                self.registrar_spans([registro])
+
+    def registrar_spans(self, registros):
+        """Registra spans medidos en otro proceso (ver `capturar_spans`) como si fueran locales."""
+        for registro in registros:
+            etapa, duracion, labels = registro["etapa"], registro["duracion"], registro["labels"]
+            error = registro.get("error")
+            self.observar("etapa_segundos", duracion, "Duración de cada etapa del envío", etapa=etapa, **labels)
+            if error:
+                self.incrementar("errores_total", ayuda="Errores por etapa y tipo de excepción",
+                                 etapa=etapa, tipo=error[0], **labels)
+            linea = {"evento": "span", "etapa": etapa, "duracion_ms": round(duracion * 1000, 3),
+                     "ok": not error, **labels, **_contexto_log.get()}
+            if error:
+                linea["error"] = error[1]
+            logger.info(json.dumps(linea, ensure_ascii=False, default=str))
+
+    # --- Exportación ---
+    def exportar_prometheus(self) -> str:
+        with self._lock:
+            histogramas = [(k, list(h.cuentas), h.suma, h.total, h.buckets) for k, h in self._histogramas.items()]
+            contadores = list(self._contadores.items())
+            gauges = list(self._gauges.items())
+            ayuda = dict(self._ayuda)
+
+        lineas = []
+        vistos = set()
+
+        def cabecera(nombre, tipo):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                lineas.append(f"# HELP {self.prefijo}_{nombre} {ayuda.get(nombre) or nombre}")
+                lineas.append(f"# TYPE {self.prefijo}_{nombre} {tipo}")
+
+        for (nombre, labels), cuentas, suma, total, buckets in sorted(histogramas, key=lambda h: h[0]):
+            cabecera(nombre, "histogram")
+            acumulado = 0
+            for limite, cuenta in zip(buckets, cuentas):
+                acumulado += cuenta
+                lineas.append(f"{self.prefijo}_{nombre}_bucket{_etiquetas(labels + (('le', repr(limite)),))} {acumulado}")
+            lineas.append(f"{self.prefijo}_{nombre}_bucket{_etiquetas(labels + (('le', '+Inf'),))} {total}")
+            lineas.append(f"{self.prefijo}_{nombre}_sum{_etiquetas(labels)} {suma:.6f}")
+            lineas.append(f"{self.prefijo}_{nombre}_count{_etiquetas(labels)} {total}")
+
+        for (nombre, labels), valor in sorted(contadores):
+            cabecera(nombre, "counter")
+            lineas.append(f"{self.prefijo}_{nombre}{_etiquetas(labels)} {valor}")
+
+        for nombre, (texto_ayuda, funcion) in sorted(gauges, key=lambda g: g[0]):
+            try:
+                valores = funcion()
+            except Exception as e:
+                logger.error(f"Gauge {nombre} no disponible: {e}")
+                continue
+            ayuda[nombre] = texto_ayuda
+            cabecera(nombre, "gauge")
+            if not isinstance(valores, dict):
+                valores = {(): valores}
+            for labels, valor in valores.items():
+                if valor is not None:
+                    lineas.append(f"{self.prefijo}_{nombre}{_etiquetas(labels)} {valor}")
+
+        return "\n".join(lineas) + "\n"
+
+    def escribir_fichero(self, path: str):
+        """Escritura atómica (formato textfile del node_exporter)."""
+        directorio = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directorio, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".metricas_", dir=directorio)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.exportar_prometheus())
+        os.replace(tmp, path)
+
+
+METRICAS = RegistroMetricas()
+span = METRICAS.span
+
+
+@contextmanager
+def contexto_log(**campos):
+    """Añade `campos` a las líneas JSON de los spans del bloque."""
+    token = _contexto_log.set({**_contexto_log.get(), **campos})
+    try:
+        yield
+    finally:
+        _contexto_log.reset(token)
+
+
+@contextmanager
+def capturar_spans():
+    """Recoge en una lista los spans del bloque, sin registrarlos.
+
+    Para procesos hijo, cuyo registro y logging no llegan al proceso
+    principal: la lista (serializable) se devuelve con el resultado y el
+    padre la registra con `METRICAS.registrar_spans`.
+    """
+    registros = []
+    token = _spans_capturados.set(registros)
+    try:
+        yield registros
+    finally:
+        _spans_capturados.reset(token)
+
+
+class ExportadorMetricas(threading.Thread):
+    """Vuelca las métricas a fichero cada `intervalo` segundos y/o las sirve por HTTP."""
+
+    def __init__(self, registro: RegistroMetricas = METRICAS, fichero: str = None,
+                 puerto: int = None, host: str = "0.0.0.0", intervalo: float = 15.0):
+        super().__init__(name="metricas-exportador", daemon=True)
+        self.registro = registro
+        self.fichero = fichero
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self.servidor = None
+        if puerto:
+            registro_http = registro
+
+            class _Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    cuerpo = registro_http.exportar_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(cuerpo)))
+                    self.end_headers()
+                    self.wfile.write(cuerpo)
+
+                def log_message(self, *args):
+                    pass
+
+            self.servidor = ThreadingHTTPServer((host, int(puerto)), _Handler)
+            self.servidor.daemon_threads = True
+
+    def run(self):
+        if self.servidor:
+            threading.Thread(target=self.servidor.serve_forever, name="metricas-http", daemon=True).start()
+            logger.info(f"Métricas Prometheus en http://{self.servidor.server_address[0]}:{self.servidor.server_address[1]}/metrics")
+        while self.fichero and not self._detener.wait(self.intervalo):
+            try:
+                self.registro.escribir_fichero(self.fichero)
+            except OSError as e:
+                logger.error(f"No se pudo escribir {self.fichero}: {e}")
+
+    def stop(self):
+        self._detener.set()
+        if self.servidor:
+            self.servidor.shutdown()
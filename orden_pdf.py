@@ -0,0 +1,202 @@
+import functools
+from dataclasses import dataclass
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+# =============================================================================
+# MOTOR DE PDF (FPDF)
+# =============================================================================
+# Separado del motor para que fpdf sólo se importe al renderizar la primera
+# orden: `engine.generar_orden_pdf` calcula los valores y delega aquí el dibujo.
+
+@dataclass(frozen=True)
+class PlantillaPDF:
+    """Parte estática de la orden renderizada una vez (banner, títulos y etiquetas)."""
+    contenido: bytes  # stream de contenido de la página 1
+    fuentes: tuple    # ((fontkey, fuente), ...) en el orden de registro del stream
+    huecos: tuple     # ((clave, x, y, ancho), ...) posiciones de los valores variables
+    y_final: float
+
+
+class EnterprisePDF(FPDF):
+    def __init__(self, plantilla: PlantillaPDF = None):
+        super().__init__()
+        self.set_auto_page_break(auto=True, margin=15)
+        self.plantilla = plantilla
+        self.pagina_plantilla = 1  # página que lleva la plantilla (la primera de cada orden)
+        self._huecos = None  # lista activa sólo al grabar una plantilla
+
+    def header(self):
+        if self.plantilla is not None and self.page == self.pagina_plantilla:
+            # Los ids de fuente (/F1, /F2...) del stream cacheado deben coincidir
+            self.fonts.update(self.plantilla.fuentes)
+            self._out(b"q\n" + self.plantilla.contenido + b"Q")
+            self._resource_catalog.index_stream_resources(self.plantilla.contenido.decode("latin-1"), self.page)
+            self.current_font_is_set_on_page = False
+            self.set_y(self.plantilla.y_final)
+            return
+
+        self.set_fill_color(15, 23, 42)
+        self.rect(0, 0, 210, 45, 'F')
+        self.set_xy(10, 12)
+        self.set_font('Helvetica', 'B', 24)
+        self.set_text_color(255, 255, 255)
+        self.cell(0, 15, 'FLEXYLABEL PRODUCTION', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_font('Helvetica', '', 10)
+        self.set_text_color(56, 189, 248) # Cyan Accent
+        self.cell(0, 5, 'SISTEMA DE GESTIÓN DE ORDENES DE TRABAJO v6.0', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.ln(20)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Helvetica', 'I', 8)
+        self.set_text_color(128, 128, 128)
+        self.cell(0, 10, f'Página {self.page_no()} | Generado por FlexyLabel Enterprise', 0, align='C')
+
+    def chapter_title(self, label):
+        self.set_font('Helvetica', 'B', 12)
+        self.set_fill_color(241, 245, 249)
+        self.set_text_color(15, 23, 42)
+        self.ln(5)
+        self.cell(0, 10, f"  {label.upper()}", 0, align='L', fill=True, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.ln(2)
+
+    def _valor(self, w, value):
+        if self._huecos is not None:
+            # Grabando plantilla: `value` es la clave del campo
+            ancho = w or (self.w - self.r_margin - self.get_x())
+            self._huecos.append((value, self.get_x(), self.get_y(), ancho))
+            self.cell(w, 8, "", 0)
+        else:
+            self.cell(w, 8, f"{value}", 0)
+
+    def chapter_body_row(self, label, value, label2=None, value2=None):
+        self.set_font('Helvetica', 'B', 10)
+        self.set_text_color(71, 85, 105)
+        self.cell(40, 8, f"{label}:", 0)
+        self.set_font('Helvetica', '', 10)
+        self.set_text_color(15, 23, 42)
+        self._valor(55, value)
+        if label2 and value2:
+            self.set_font('Helvetica', 'B', 10)
+            self.set_text_color(71, 85, 105)
+            self.cell(40, 8, f"{label2}:", 0)
+            self.set_font('Helvetica', '', 10)
+            self.set_text_color(15, 23, 42)
+            self._valor(0, value2)
+        self.ln(8)
+
+    def add_notes(self, text):
+        self.ln(5)
+        self.set_font('Helvetica', '', 10)
+        self.set_text_color(50, 50, 50)
+        self.multi_cell(0, 5, text)
+
+    def rellenar(self, valores: dict):
+        """Escribe sólo los campos variables sobre la plantilla cacheada."""
+        self.set_font('Helvetica', '', 10)
+        self.set_text_color(15, 23, 42)
+        for clave, x, y, w in self.plantilla.huecos:
+            self.set_xy(x, y)
+            self.cell(w, 8, f"{valores[clave]}", 0)
+        self.set_y(self.plantilla.y_final)
+
+
+# Estructura fija de la orden: (sección, ((etiqueta, clave, etiqueta2, clave2), ...))
+ORDEN_LAYOUT = (
+    ("Datos Generales", (
+        ("Cliente", "cliente", "Ref", "referencia"),
+        ("Email", "email", "Fecha", "fecha"),
+    )),
+    ("Especificaciones", (
+        ("Material", "material", "Mandril", "mandril"),
+        ("Medidas", "medidas", "Cantidad", "cantidad"),
+    )),
+    ("Configuración", (
+        ("Bobinado", "bobinado", "Uds/Rollo", "uds_rollo"),
+        ("Metraje", "metraje", "Área", "area"),
+        ("Rollos", "rollos", "Ø Exterior", "diametro"),
+        ("Imposición", "imposicion", "Cilindro", "cilindro"),
+        ("Consumo real", "consumo_real", "Merma", "merma"),
+    )),
+)
+
+
+
+@functools.lru_cache(maxsize=1)
+def get_plantilla_orden() -> PlantillaPDF:
+    """Graba una vez el layout estático de la orden (cacheado por proceso)."""
+    pdf = EnterprisePDF()
+    pdf._huecos = []
+    pdf.add_page()
+    for titulo, filas in ORDEN_LAYOUT:
+        pdf.chapter_title(titulo)
+        for label, clave, label2, clave2 in filas:
+            pdf.chapter_body_row(label, clave, label2, clave2)
+    return PlantillaPDF(
+        contenido=bytes(pdf.pages[1].contents),
+        fuentes=tuple(pdf.fonts.items()),
+        huecos=tuple(pdf._huecos),
+        y_final=pdf.get_y(),
+    )
+
+
+
+
+def _dibujar_orden(pdf: EnterprisePDF, valores: dict, notas: str):
+    if pdf.plantilla is not None:
+        pdf.rellenar(valores)
+    else:
+        for titulo, filas in ORDEN_LAYOUT:
+            pdf.chapter_title(titulo)
+            for label, clave, label2, clave2 in filas:
+                pdf.chapter_body_row(label, valores[clave], label2, valores[clave2])
+
+    if notas:
+        pdf.chapter_title("Notas")
+        pdf.add_notes(notas)
+
+
+def componer_orden(valores: dict, notas: str = "", usar_plantilla: bool = True) -> EnterprisePDF:
+    """Dibuja la orden con los `valores` de cada clave de ORDEN_LAYOUT."""
+    pdf = EnterprisePDF(get_plantilla_orden() if usar_plantilla else None)
+    pdf.add_page()
+    _dibujar_orden(pdf, valores, notas)
+    return pdf
+
+
+# Columnas de la tabla del resumen del taller: (título, ancho mm, alineación)
+RESUMEN_COLUMNAS = (
+    ("Material", 58, "L"), ("Órdenes", 24, "R"), ("Metros", 36, "R"), ("m2", 36, "R"), ("Rollos", 36, "R"),
+)
+
+
+def componer_resumen(resumen, ordenes, usar_plantilla: bool = True) -> EnterprisePDF:
+    """Resumen del taller: consumos por material y, detrás, cada orden desde una página nueva.
+
+    `resumen` son filas con los textos de RESUMEN_COLUMNAS (la última, el total);
+    `ordenes` son pares `(valores, notas)` como los de `componer_orden`.
+    """
+    pdf = EnterprisePDF(get_plantilla_orden() if usar_plantilla else None)
+    pdf.pagina_plantilla = None
+    pdf.add_page()
+    pdf.chapter_title(f"Resumen de {len(ordenes)} órdenes por material")
+    pdf.set_font('Helvetica', 'B', 10)
+    pdf.set_text_color(71, 85, 105)
+    for titulo, ancho, alineacion in RESUMEN_COLUMNAS:
+        pdf.cell(ancho, 8, titulo, 'B', align=alineacion)
+    pdf.ln(8)
+    pdf.set_text_color(15, 23, 42)
+    for i, fila in enumerate(resumen):
+        total = i == len(resumen) - 1
+        pdf.set_font('Helvetica', 'B' if total else '', 10)
+        for texto, (_, ancho, alineacion) in zip(fila, RESUMEN_COLUMNAS):
+            pdf.cell(ancho, 8, texto, 'T' if total else 0, align=alineacion)
+        pdf.ln(8)
+
+    for valores, notas in ordenes:
+        pdf.pagina_plantilla = pdf.page + 1
+        pdf.add_page()
+        _dibujar_orden(pdf, valores, notas)
+    return pdf
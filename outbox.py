@@ -0,0 +1,383 @@
+import sqlite3
+import base64
+import os
+import tempfile
+import threading
+import datetime
+import time
+import json
+import logging
+from dataclasses import asdict
+from email import policy
+from typing import TYPE_CHECKING
+
+from metricas import contexto_log, span
+
+if TYPE_CHECKING:  # smtplib sólo se importa en el proceso que entrega
+    from smtp_pool import SMTPConnectionPool
+
+# =============================================================================
+# OUTBOX PERSISTENTE (SQLite) + WORKER DE ENTREGA
+# =============================================================================
+# El formulario sólo construye los mensajes MIME y los encola aquí; un hilo (o
+# un proceso con `python outbox.py`) los entrega por SMTP con reintentos.
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+SMTP_LINESEP = policy.compat32.clone(linesep="\r\n")
+
+ESTADO_PENDIENTE = "PENDIENTE"
+ESTADO_ENVIANDO = "ENVIANDO"  # tomado por un worker (reserva con caducidad)
+ESTADO_ENVIADO = "ENVIADO"
+ESTADO_FALLIDO = "FALLIDO"
+
+# Un mensaje tomado hace más de esto sin resolverse se da por abandonado (worker caído)
+RESERVA_CADUCIDAD_S = 600
+
+
+def mensaje_a_bytes(msg) -> bytes:
+    """Serializa un mensaje MIME con saltos CRLF, listo para DATA."""
+    return msg.as_bytes(policy=SMTP_LINESEP)
+
+
+# Múltiplo de 57 bytes: cada bloque produce líneas base64 completas de 76 caracteres
+B64_CHUNK_BYTES = 57 * 16384
+
+
+def mensaje_a_fichero(msg, adjuntos, spool_dir: str) -> str:
+    """Escribe `msg` (multipart) en disco añadiendo adjuntos codificados por bloques.
+
+    `adjuntos` es una lista de `(ruta, nombre)`. Cada fichero se lee y codifica
+    en base64 trozo a trozo directamente en el fichero del mensaje: la memoria
+    no depende de su tamaño. Devuelve la ruta del mensaje, lista para
+    `OutboxQueue.enqueue`.
+    """
+    boundary = "===============" + os.urandom(12).hex() + "=="
+    msg.set_boundary(boundary)
+    raw = mensaje_a_bytes(msg)
+    cierre = f"--{boundary}--".encode("ascii")
+    corte = raw.rindex(cierre)
+
+    os.makedirs(spool_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="msg_", suffix=".eml", dir=spool_dir)
+    with os.fdopen(fd, "wb") as out:
+        out.write(raw[:corte])
+        for adjunto_path, filename in adjuntos:
+            out.write(
+                f"--{boundary}\r\n"
+                "Content-Type: application/octet-stream\r\n"
+                "MIME-Version: 1.0\r\n"
+                "Content-Transfer-Encoding: base64\r\n"
+                f'Content-Disposition: attachment; filename="{filename}"\r\n\r\n'.encode("ascii")
+            )
+            with open(adjunto_path, "rb") as adjunto:
+                while True:
+                    bloque = adjunto.read(B64_CHUNK_BYTES)
+                    if not bloque:
+                        break
+                    out.write(base64.encodebytes(bloque).replace(b"\n", b"\r\n"))
+            out.write(b"\r\n")
+        out.write(cierre + b"\r\n")
+        out.flush()
+        os.fsync(out.fileno())
+    return path
+
+
+class OutboxQueue:
+    """Cola durable de mensajes salientes respaldada por SQLite."""
+
+    def __init__(self, db_path: str = "outbox.db"):
+        self.db_path = db_path
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    payload TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER REFERENCES outbox_orders(id),
+                    created_at REAL NOT NULL,
+                    mail_from TEXT NOT NULL,
+                    rcpt_to TEXT NOT NULL,
+                    raw BLOB NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    sent_at REAL,
+                    last_error TEXT,
+                    tomado_en REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at);
+            """)
+            columnas = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "raw_path" not in columnas:
+                # Mensajes grandes: el cuerpo vive en un fichero del spool
+                conn.execute("ALTER TABLE outbox ADD COLUMN raw_path TEXT")
+
+    # --- Productor ---
+    def enqueue(self, order: dict, messages) -> int:
+        """Persiste el pedido y sus mensajes en una única transacción.
+
+        `messages` es una lista de `(mail_from, [destinatarios], raw)`, donde
+        `raw` son los bytes del mensaje o la ruta de un fichero creado con
+        `mensaje_a_fichero`. Devuelve el id del pedido en el outbox.
+        """
+        return self.enqueue_many([(order, messages)])[0]
+
+    def enqueue_many(self, items) -> list:
+        """Encola varios pedidos `(order, messages)` en una sola transacción (carga masiva)."""
+        now = time.time()
+        order_ids = []
+        with self._connect() as conn:
+            for order, messages in items:
+                cur = conn.execute(
+                    "INSERT INTO outbox_orders (created_at, payload) VALUES (?, ?)",
+                    (now, json.dumps(order, ensure_ascii=False, default=str)),
+                )
+                order_id = cur.lastrowid
+                conn.executemany(
+                    "INSERT INTO outbox (order_id, created_at, mail_from, rcpt_to, raw, raw_path, status, next_attempt_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (order_id, now, mail_from, ",".join(rcpt_to),
+                         sqlite3.Binary(raw if isinstance(raw, (bytes, bytearray)) else b""),
+                         None if isinstance(raw, (bytes, bytearray)) else os.fspath(raw),
+                         ESTADO_PENDIENTE, now)
+                        for mail_from, rcpt_to, raw in messages
+                    ],
+                )
+                order_ids.append(order_id)
+        return order_ids
+
+    # --- Consumidor ---
+    def due(self, limit: int = 50):
+        """Toma hasta `limit` mensajes vencidos y los devuelve.
+
+        La reserva es atómica (`BEGIN IMMEDIATE`): varios workers sobre el mismo
+        outbox.db (la app, `python outbox.py`, `api.py --worker`) nunca reciben
+        el mismo mensaje. Un mensaje tomado y no resuelto vuelve a estar
+        disponible tras RESERVA_CADUCIDAD_S, como las reservas del historial.
+        Cada fila incluye `tomado_en`, la marca de su reserva, que se pasa a
+        `mark_sent`/`mark_failed`.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            filas = conn.execute(
+                "SELECT id, created_at, mail_from, rcpt_to, raw, raw_path, attempts FROM outbox "
+                "WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND tomado_en < ?) "
+                "ORDER BY id LIMIT ?",
+                (ESTADO_PENDIENTE, now, ESTADO_ENVIANDO, now - RESERVA_CADUCIDAD_S, limit),
+            ).fetchall()
+            conn.executemany("UPDATE outbox SET status = ?, tomado_en = ? WHERE id = ?",
+                             [(ESTADO_ENVIANDO, now, fila["id"]) for fila in filas])
+        return [dict(fila, tomado_en=now) for fila in filas]
+
+    # mark_sent/mark_failed sólo actualizan la fila si la reserva `tomado_en` sigue
+    # siendo la suya: un worker cuya reserva caducó no pisa el estado que deja el
+    # worker que la retomó. Devuelven False si la reserva ya no era suya.
+    def mark_sent(self, msg_id: int, tomado_en: float) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE outbox SET status = ?, sent_at = ?, attempts = attempts + 1, last_error = NULL "
+                "WHERE id = ? AND status = ? AND tomado_en = ?",
+                (ESTADO_ENVIADO, time.time(), msg_id, ESTADO_ENVIANDO, tomado_en),
+            ).rowcount == 1
+
+    def mark_failed(self, msg_id: int, tomado_en: float, error: str, next_attempt_at: float,
+                    definitivo: bool = False) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ? "
+                "WHERE id = ? AND status = ? AND tomado_en = ?",
+                (ESTADO_FALLIDO if definitivo else ESTADO_PENDIENTE, next_attempt_at, error[:500],
+                 msg_id, ESTADO_ENVIANDO, tomado_en),
+            ).rowcount == 1
+
+    # --- Métricas ---
+    def depth(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)",
+                                (ESTADO_PENDIENTE, ESTADO_ENVIANDO)).fetchone()[0]
+
+    def metrics(self, window: int = 200) -> dict:
+        """Profundidad de la cola y latencia de entrega (últimos `window` envíos)."""
+        now = time.time()
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM outbox WHERE status IN (?, ?)", (ESTADO_PENDIENTE, ESTADO_ENVIANDO)
+            ).fetchone()[0]
+            latencias = sorted(
+                row[0] for row in conn.execute(
+                    "SELECT sent_at - created_at FROM outbox WHERE status = ? ORDER BY sent_at DESC LIMIT ?",
+                    (ESTADO_ENVIADO, window),
+                )
+            )
+
+        def percentil(p):
+            if not latencias:
+                return None
+            return round(latencias[min(len(latencias) - 1, int(p * len(latencias)))], 3)
+
+        return {
+            "queue_depth": counts.get(ESTADO_PENDIENTE, 0) + counts.get(ESTADO_ENVIANDO, 0),
+            "sent_total": counts.get(ESTADO_ENVIADO, 0),
+            "failed_total": counts.get(ESTADO_FALLIDO, 0),
+            "oldest_pending_age_s": round(now - oldest, 3) if oldest else 0.0,
+            "delivery_latency_p50_s": percentil(0.50),
+            "delivery_latency_p95_s": percentil(0.95),
+        }
+
+
+class OutboxWorker(threading.Thread):
+    """Hilo que drena el outbox con reintentos y backoff exponencial."""
+
+    def __init__(self, queue: OutboxQueue, pool: "SMTPConnectionPool", poll_interval: float = 2.0,
+                 max_attempts: int = 8, base_backoff: float = 5.0, max_backoff: float = 900.0,
+                 tareas=()):
+        super().__init__(name="FlexyLabel-Outbox", daemon=True)
+        self.queue = queue
+        self.pool = pool
+        # Callables sin argumentos que se ejecutan antes de cada drenado (p.ej. el resumen del taller)
+        self.tareas = list(tareas)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._wake = threading.Event()
+        self._detener = threading.Event()
+
+    def wake(self):
+        """Despierta al worker tras encolar (entrega inmediata)."""
+        self._wake.set()
+
+    def stop(self):
+        self._detener.set()
+        self._wake.set()
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.max_backoff, self.base_backoff * (2 ** attempts))
+
+    def run(self):
+        logger.info("Outbox worker iniciado (%s:%s)", self.pool.config.host, self.pool.config.port)
+        while not self._detener.is_set():
+            for tarea in self.tareas:
+                try:
+                    tarea()
+                except Exception as e:
+                    logger.error(f"Error en tarea del outbox worker: {e}")
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error(f"Error en outbox worker: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def drain(self) -> int:
+        """Entrega todos los mensajes vencidos. Devuelve cuántos se enviaron."""
+        enviados = 0
+        while not self._detener.is_set():
+            rows = self.queue.due()
+            if not rows:
+                return enviados
+            for row in rows:
+                try:
+                    with contexto_log(outbox_id=row["id"], intento=row["attempts"] + 1), span("smtp_envio"):
+                        if row["raw_path"]:
+                            self.pool.send_file(row["mail_from"], row["rcpt_to"].split(","), row["raw_path"])
+                        else:
+                            self.pool.send(row["mail_from"], row["rcpt_to"].split(","), row["raw"])
+                except Exception as e:
+                    self._reprogramar(row, e)
+                    continue
+                if self.queue.mark_sent(row["id"], row["tomado_en"]):
+                    self._borrar_spool(row)
+                    enviados += 1
+                else:
+                    logger.warning(f"Outbox #{row['id']} enviado con la reserva caducada: lo retomó otro worker")
+        return enviados
+
+    def _reprogramar(self, row, error):
+        attempts = row["attempts"] + 1
+        definitivo = attempts >= self.max_attempts
+        logger.error(f"Error SMTP (outbox #{row['id']}, intento {attempts}): {error}")
+        if self.queue.mark_failed(row["id"], row["tomado_en"], str(error),
+                                  time.time() + self.backoff(attempts), definitivo) and definitivo:
+            self._borrar_spool(row)
+
+    @staticmethod
+    def _borrar_spool(row):
+        """El fichero del mensaje ya no hace falta (enviado o fallido sin más reintentos)."""
+        if row["raw_path"]:
+            try:
+                os.remove(row["raw_path"])
+            except FileNotFoundError:
+                pass
+
+
+def order_record(*dtos) -> dict:
+    """Registro serializable del pedido (sin el archivo adjunto)."""
+    record = {}
+    for dto in dtos:
+        data = asdict(dto)
+        data.pop("arte_final", None)
+        record[type(dto).__name__] = data
+    record["encolado"] = datetime.datetime.now().isoformat(timespec="seconds")
+    return record
+
+
+if __name__ == "__main__":
+    # Worker como proceso independiente: credenciales por variables de entorno
+    import argparse
+
+    from smtp_pool import SMTPConfig, SMTPConnectionPool
+
+    parser = argparse.ArgumentParser(description="Worker de entrega del outbox de FlexyLabel")
+    parser.add_argument("--db", default="outbox.db")
+    parser.add_argument("--host", default=os.environ.get("FLEXY_SMTP_HOST", "smtp.gmail.com"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("FLEXY_SMTP_PORT", "465")))
+    parser.add_argument("--no-ssl", action="store_true", help="SMTP plano (p.ej. servidor local de pruebas)")
+    parser.add_argument("--metricas-puerto", type=int, default=None, help="sirve /metrics (Prometheus) en este puerto")
+    parser.add_argument("--metricas-fichero", default=None, help="vuelca las métricas a este fichero .prom")
+    parser.add_argument("--historial", default=None,
+                        help="agrupa también los pedidos de este historial pendientes del resumen del taller")
+    args = parser.parse_args()
+
+    config = SMTPConfig(
+        host=args.host,
+        port=args.port,
+        user=os.environ.get("FLEXY_SMTP_USER", ""),
+        password=os.environ.get("FLEXY_SMTP_PASSWORD", ""),
+        use_ssl=not args.no_ssl,
+    )
+    queue = OutboxQueue(args.db)
+    tareas = []
+    if args.historial:
+        # El resumen se renderiza aquí: sólo entonces se importa el motor (numpy, fpdf)
+        from engine import volcar_resumen_taller
+        from historial import HistorialPedidos
+        historial = HistorialPedidos(args.historial)
+        tareas.append(lambda: volcar_resumen_taller(queue, historial, config.user))
+    worker = OutboxWorker(queue, SMTPConnectionPool(config), tareas=tareas)
+    worker.start()
+    if args.metricas_puerto or args.metricas_fichero:
+        from metricas import METRICAS, ExportadorMetricas
+        METRICAS.registrar_gauge("outbox_pendientes", queue.depth, "Mensajes pendientes en el outbox")
+        ExportadorMetricas(fichero=args.metricas_fichero, puerto=args.metricas_puerto).start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,201 @@
+import smtplib
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# =============================================================================
+# POOL DE SESIONES SMTP (COMPARTIDO POR PROCESO)
+# =============================================================================
+# El handshake TLS + login cuesta más que todo lo demás en el envío. Las
+# sesiones se mantienen abiertas, se validan con NOOP tras un periodo de
+# inactividad y se reciclan al superar `max_age`.
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+
+@dataclass
+class SMTPConfig:
+    host: str = "smtp.gmail.com"
+    port: int = 465
+    user: str = ""
+    password: str = ""
+    use_ssl: bool = True
+    timeout: float = 30.0
+
+
+def abrir_sesion_smtp(config: SMTPConfig):
+    """Abre y autentica una sesión SMTP según la configuración."""
+    if config.use_ssl:
+        server = smtplib.SMTP_SSL(config.host, config.port, timeout=config.timeout)
+    else:
+        server = smtplib.SMTP(config.host, config.port, timeout=config.timeout)
+    if config.password:
+        server.login(config.user, config.password)
+    return server
+
+
+class _Sesion:
+    __slots__ = ("server", "created_at", "last_used")
+
+    def __init__(self, server):
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class SMTPConnectionPool:
+    """Pool thread-safe de sesiones SMTP autenticadas y de larga duración."""
+
+    def __init__(self, config: SMTPConfig, max_size: int = 2, max_age: float = 300.0,
+                 keepalive: float = 30.0):
+        self.config = config
+        self.max_size = max_size
+        self.max_age = max_age
+        self.keepalive = keepalive
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.stats = {"connects": 0, "reused": 0, "expired": 0, "noop_failures": 0, "reconnects": 0}
+
+    # --- Ciclo de vida de sesiones ---
+    def _connect(self) -> _Sesion:
+        self.stats["connects"] += 1
+        return _Sesion(abrir_sesion_smtp(self.config))
+
+    @staticmethod
+    def _close(sesion: _Sesion):
+        try:
+            sesion.server.quit()
+        except Exception:
+            try:
+                sesion.server.close()
+            except Exception:
+                pass
+
+    def _healthy(self, sesion: _Sesion) -> bool:
+        now = time.monotonic()
+        if now - sesion.created_at > self.max_age:
+            self.stats["expired"] += 1
+            return False
+        if now - sesion.last_used > self.keepalive:
+            try:
+                code, _ = sesion.server.noop()
+            except smtplib.SMTPException:
+                code = None
+            except OSError:
+                code = None
+            if code != 250:
+                self.stats["noop_failures"] += 1
+                return False
+        return True
+
+    def _acquire(self) -> _Sesion:
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    sesion = self._idle.pop() if self._idle else None
+                if sesion is None:
+                    return self._connect()
+                if self._healthy(sesion):
+                    self.stats["reused"] += 1
+                    return sesion
+                self._close(sesion)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, sesion: _Sesion, reusable: bool):
+        try:
+            if reusable:
+                sesion.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(sesion)
+            else:
+                self._close(sesion)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self):
+        """Presta una sesión; se descarta si la conexión falla durante el uso."""
+        sesion = self._acquire()
+        reusable = True
+        try:
+            yield sesion.server
+        except (smtplib.SMTPServerDisconnected, OSError):
+            reusable = False
+            raise
+        finally:
+            self._release(sesion, reusable)
+
+    # --- API de envío ---
+    def send(self, mail_from: str, rcpt_to, raw: bytes):
+        """Envía un mensaje; si la sesión estaba caída, reconecta y reintenta una vez."""
+        try:
+            with self.session() as server:
+                return server.sendmail(mail_from, rcpt_to, raw)
+        except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+            logger.info(f"Sesión SMTP perdida ({e}); reconectando")
+            self.stats["reconnects"] += 1
+            with self.session() as server:
+                return server.sendmail(mail_from, rcpt_to, raw)
+
+    def send_file(self, mail_from: str, rcpt_to, path: str):
+        """Envía un mensaje desde disco en streaming (DATA por bloques, sin cargarlo entero)."""
+        try:
+            with self.session() as server:
+                return self._data_desde_fichero(server, mail_from, rcpt_to, path)
+        except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+            logger.info(f"Sesión SMTP perdida ({e}); reconectando")
+            self.stats["reconnects"] += 1
+            with self.session() as server:
+                return self._data_desde_fichero(server, mail_from, rcpt_to, path)
+
+    @staticmethod
+    def _data_desde_fichero(server, mail_from, rcpt_to, path):
+        # Mismo protocolo que smtplib.sendmail, pero el cuerpo se lee del fichero
+        server.ehlo_or_helo_if_needed()
+        code, resp = server.mail(mail_from)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, mail_from)
+        rechazados = {}
+        for rcpt in rcpt_to:
+            code, resp = server.rcpt(rcpt)
+            if code not in (250, 251):
+                rechazados[rcpt] = (code, resp)
+        if len(rechazados) == len(rcpt_to):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(rechazados)
+        code, resp = server.docmd("data")
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        buffer = bytearray()
+        with open(path, "rb") as f:
+            for linea in f:  # el fichero ya viene con saltos CRLF
+                if linea.startswith(b"."):
+                    buffer += b"."
+                buffer += linea
+                if len(buffer) >= 64 * 1024:
+                    server.send(bytes(buffer))
+                    buffer.clear()
+        if buffer and not buffer.endswith(b"\r\n"):
+            buffer += b"\r\n"
+        buffer += b".\r\n"
+        server.send(bytes(buffer))
+        code, resp = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        return rechazados
+
+    def close_all(self):
+        with self._lock:
+            sesiones, self._idle = list(self._idle), deque()
+        for sesion in sesiones:
+            self._close(sesion)
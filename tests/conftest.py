@@ -0,0 +1,71 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# Los módulos viven en la raíz del repositorio (como en benchmarks/)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import engine  # noqa: E402
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServidorSMTP:
+    """SMTP local (aiosmtpd) que guarda los mensajes recibidos; se puede arrancar tarde."""
+
+    def __init__(self, puerto: int):
+        self.puerto = puerto
+        self.recibidos = []
+        self._controller = None
+
+    def arrancar(self):
+        from aiosmtpd.controller import Controller
+
+        recibidos = self.recibidos
+
+        class _Handler:
+            async def handle_DATA(self, server, session, envelope):
+                recibidos.append((envelope.mail_from, list(envelope.rcpt_tos), envelope.content))
+                return "250 OK"
+
+        self._controller = Controller(_Handler(), hostname="127.0.0.1", port=self.puerto)
+        self._controller.start()
+
+    def parar(self):
+        if self._controller:
+            self._controller.stop()
+            self._controller = None
+
+
+@pytest.fixture
+def smtp():
+    """Servidor SMTP sin arrancar en un puerto libre: el test decide cuándo está disponible."""
+    pytest.importorskip("aiosmtpd")
+    servidor = ServidorSMTP(puerto_libre())
+    yield servidor
+    servidor.parar()
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Ajustes del motor apuntando a bases y almacenes temporales (modificables por el test)."""
+    ajustes = {
+        "historial_db": str(tmp_path / "historial.db"),
+        "outbox_spool": str(tmp_path / "spool"),
+        "arte_final_index_db": str(tmp_path / "arte_final.db"),
+    }
+    monkeypatch.setattr(engine, "ARTE_FINAL_DIR", str(tmp_path / "arte_final"))
+    monkeypatch.setattr(engine, "ARTE_FINAL_DIR_STATIC", str(tmp_path / "static_arte_final"))
+    engine.configurar(lambda key, default=None: ajustes.get(key, default))
+    engine.get_almacen_arte_final.cache_clear()
+    engine.get_historial.cache_clear()
+    yield ajustes
+    engine.configurar(engine._config_entorno)
+    engine.get_almacen_arte_final.cache_clear()
+    engine.get_historial.cache_clear()
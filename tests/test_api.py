@@ -0,0 +1,107 @@
+"""API de pedidos: fallos por pedido, ciclo de vida de las subidas y enlaces de arte final."""
+import io
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from api import ESTADO_CREADO, ESTADO_DUPLICADO, ESTADO_ERROR, ServicioPedidos, crear_servidor
+from arte_final import ArchivoLocal
+from conftest import puerto_libre
+from engine import EmailService, enlace_arte_final, get_almacen_arte_final
+from historial import HistorialPedidos
+from outbox import OutboxQueue
+
+
+def pedido(n, **extra):
+    return {"razon_social": f"Cliente {n}", "email_contacto": f"c{n}@x.es", "referencia_interna": f"REF-{n}",
+            "ancho_mm": 50, "largo_mm": 30, "cantidad_total": 1000, **extra}
+
+
+@pytest.fixture
+def servicio(tmp_path, config):
+    servicio = ServicioPedidos(OutboxQueue(str(tmp_path / "outbox.db")), HistorialPedidos(config["historial_db"]),
+                               "pedidos@x.es", str(tmp_path / "subidas"), workers=1)
+    yield servicio
+    servicio.pool.shutdown()
+
+
+def subir(servicio, datos: bytes) -> str:
+    return servicio.guardar_arte_final(io.BytesIO(datos), len(datos))
+
+
+def test_un_pedido_que_falla_no_descarta_el_lote(servicio, monkeypatch):
+    original = EmailService.preparar_mensajes
+
+    def preparar(cliente, *args, **kwargs):
+        if cliente.referencia_interna == "REF-2":
+            raise OSError("spool lleno")
+        return original(cliente, *args, **kwargs)
+
+    monkeypatch.setattr(EmailService, "preparar_mensajes", staticmethod(preparar))
+    resultados = servicio.recibir([pedido(1), pedido(2), pedido(3)])
+
+    assert [r["estado"] for r in resultados] == [ESTADO_CREADO, ESTADO_ERROR, ESTADO_CREADO]
+    assert resultados[1]["error"] == "correo: spool lleno"
+    assert servicio.outbox.depth() == 4
+
+    # La clave del pedido fallido se libera: el reintento lo crea; los demás son duplicados
+    monkeypatch.undo()
+    assert [r["estado"] for r in servicio.recibir([pedido(1), pedido(2), pedido(3)])] == [
+        ESTADO_DUPLICADO, ESTADO_CREADO, ESTADO_DUPLICADO,
+    ]
+
+
+def test_subida_compartida_se_borra_al_quedar_en_el_almacen(servicio):
+    sha = subir(servicio, b"%PDF-1.4 arte")
+    subida = os.path.join(servicio.arte_dir, f"{sha}.pdf")
+
+    reservadas = []
+    en_curso = servicio._arte_final(sha, reservadas)  # otra petición la está usando
+    assert servicio.recibir([pedido(1, arte_final_sha256=sha)])[0]["estado"] == ESTADO_CREADO
+    assert os.path.exists(subida) and open(en_curso.path, "rb").read() == b"%PDF-1.4 arte"
+
+    servicio._soltar_subidas(reservadas)
+    assert not os.path.exists(subida)
+    # Los pedidos siguientes la encuentran en el almacén
+    assert servicio.recibir([pedido(2, arte_final_sha256=sha)])[0]["estado"] == ESTADO_CREADO
+
+
+def test_subidas_sin_usar_caducan(servicio, config):
+    config["api_arte_caducidad_h"] = 1
+    viejas = [subir(servicio, f"%PDF-1.4 {n}".encode()) for n in range(2)]
+    for sha in viejas:
+        path = os.path.join(servicio.arte_dir, f"{sha}.pdf")
+        os.utime(path, (0, 0))
+    servicio._arte_final(viejas[0], [])  # reservada por un pedido en curso
+
+    nueva = subir(servicio, b"%PDF-1.4 nueva")
+    assert sorted(os.listdir(servicio.arte_dir)) == sorted([f"{viejas[0]}.pdf", f"{nueva}.pdf"])
+
+
+def test_enlace_firmado_de_arte_final(servicio, config, tmp_path):
+    puerto = puerto_libre()
+    config["api_url"] = f"http://127.0.0.1:{puerto}"
+    servidor = crear_servidor(servicio, "127.0.0.1", puerto, token="secreto")
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        (tmp_path / "arte.pdf").write_bytes(b"%PDF-1.4 arte")
+        sha, _, _ = get_almacen_arte_final().guardar(ArchivoLocal(str(tmp_path / "arte.pdf")), "Cliente", "REF-1")
+        enlace = enlace_arte_final(sha)
+
+        # Sin token: el taller abre el enlace desde el correo
+        with urllib.request.urlopen(enlace) as respuesta:
+            assert respuesta.headers["Content-Type"] == "application/pdf"
+            assert respuesta.read() == b"%PDF-1.4 arte"
+
+        manipulado = enlace.replace(sha, "0" * 64)
+        caducado = f"{config['api_url']}/api/v1/arte-final/{sha}?exp=1&firma={get_almacen_arte_final().firmar(sha, 1)}"
+        for url in (manipulado, caducado):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url)
+            assert error.value.code == 403
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
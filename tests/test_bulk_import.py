@@ -0,0 +1,102 @@
+"""Importación masiva: los fallos de una fila no detienen el lote ni dejan claves reservadas."""
+import csv
+
+import pytest
+
+import bulk_import
+from engine import EmailService
+from historial import HistorialPedidos
+from outbox import OutboxQueue, OutboxWorker
+from smtp_pool import SMTPConfig, SMTPConnectionPool
+
+COLUMNAS = ["razon_social", "email_contacto", "referencia_interna", "ancho_mm", "largo_mm",
+            "cantidad_total", "material", "arte_final"]
+
+
+def escribir_csv(path, filas):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f)
+        escritor.writerow(COLUMNAS)
+        escritor.writerows(filas)
+    return str(path)
+
+
+def fila(n, arte=""):
+    return [f"Cliente {n}", f"cliente{n}@x.es", f"REF-{n}", 50, 30, 1000, "PP Blanco", arte]
+
+
+@pytest.fixture
+def pedidos(tmp_path, config):
+    config["arte_final_max_mb"] = 1
+    arte_grande = tmp_path / "grande.pdf"
+    arte_grande.write_bytes(b"%PDF-1.4\n" + b"0" * 2**21)
+    return escribir_csv(tmp_path / "pedidos.csv", [fila(1), fila(2, str(arte_grande)), fila(3), fila(4)])
+
+
+def importar(tmp_path, pedidos):
+    return bulk_import.importar(pedidos, str(tmp_path / "outbox.db"), "pedidos@x.es", workers=1,
+                                historial_db=str(tmp_path / "historial.db"))
+
+
+def fallar_correo(monkeypatch, referencia):
+    """Preparar el correo de la orden `referencia` falla como con el spool lleno."""
+    original = EmailService.preparar_mensajes
+
+    def preparar(cliente, *args, **kwargs):
+        if cliente.referencia_interna == referencia:
+            raise OSError("spool lleno")
+        return original(cliente, *args, **kwargs)
+
+    monkeypatch.setattr(EmailService, "preparar_mensajes", staticmethod(preparar))
+
+
+def test_fallos_de_fila_no_detienen_la_importacion(tmp_path, pedidos, smtp, monkeypatch):
+    fallar_correo(monkeypatch, "REF-3")
+    resumen = importar(tmp_path, pedidos)
+
+    assert resumen.filas == 4 and resumen.duplicadas == 0
+    errores = dict(resumen.errores)
+    assert set(errores) == {3, 4}  # número de fila del CSV (la cabecera es la 1)
+    assert "máximo 1 MB" in errores[3]
+    assert errores[4] == "correo: spool lleno"
+
+    # Las filas válidas se entregan: orden al taller y confirmación al cliente
+    smtp.arrancar()
+    pool = SMTPConnectionPool(SMTPConfig(host="127.0.0.1", port=smtp.puerto, use_ssl=False, timeout=5))
+    assert OutboxWorker(OutboxQueue(str(tmp_path / "outbox.db")), pool).drain() == 4
+    clientes = sorted(rcpt[0] for _, rcpt, _ in smtp.recibidos if rcpt != [EmailService.TALLER_EMAIL])
+    assert clientes == ["cliente1@x.es", "cliente4@x.es"]
+
+    # Claves de las filas válidas completadas; las de las fallidas, liberadas
+    historial = HistorialPedidos(str(tmp_path / "historial.db"))
+    previas = {fila["referencia_interna"]: historial.reservar_envio(bulk_import.clave_fila(fila)[0])
+               for _, fila in bulk_import.leer_filas(pedidos)}
+    assert {ref: previa and previa["referencia"] for ref, previa in previas.items()} == {
+        "REF-1": "REF-1", "REF-2": None, "REF-3": None, "REF-4": "REF-4",
+    }
+    assert [p["referencia_interna"] for p in historial.buscar()[0]] == ["REF-4", "REF-1"]
+
+
+def test_reimportar_solo_reintenta_las_filas_fallidas(tmp_path, pedidos, monkeypatch):
+    with monkeypatch.context() as mp:
+        fallar_correo(mp, "REF-3")
+        importar(tmp_path, pedidos)
+    resumen = importar(tmp_path, pedidos)
+
+    assert resumen.duplicadas == 2
+    assert [n for n, _ in resumen.errores] == [3]  # el arte sigue siendo demasiado grande
+    assert resumen.encolado.items == 1
+
+
+def test_excepcion_a_mitad_libera_las_claves(tmp_path, pedidos, monkeypatch):
+    def disco_lleno(self, lote):
+        raise OSError("disco lleno")
+
+    with monkeypatch.context() as mp:
+        mp.setattr(OutboxQueue, "enqueue_many", disco_lleno)
+        with pytest.raises(OSError):
+            importar(tmp_path, pedidos)
+
+    resumen = importar(tmp_path, pedidos)
+    assert resumen.duplicadas == 0
+    assert resumen.encolado.items == 3
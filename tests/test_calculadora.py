@@ -0,0 +1,12 @@
+"""Calculadora de producción: forma de los resultados del cálculo por lotes."""
+from engine import CalculadoraProduccion
+
+
+def test_calcular_lote_conserva_la_forma_de_la_entrada():
+    escalar = CalculadoraProduccion.calcular_lote(50, 30, 1000, "PP Blanco", "76 mm", 500)
+    assert {k: v.shape for k, v in escalar.items()} == {"ml": (), "m2": (), "rollos": (), "diametro_mm": ()}
+    assert float(escalar["diametro_mm"]) > 76
+
+    lote = CalculadoraProduccion.calcular_lote([50, 50], [30, 40], [1000, 2000], ["PP Blanco"] * 2, ["76 mm"] * 2, 500)
+    assert {k: v.shape for k, v in lote.items()} == {"ml": (2,), "m2": (2,), "rollos": (2,), "diametro_mm": (2,)}
+    assert lote["diametro_mm"][0] == escalar["diametro_mm"]
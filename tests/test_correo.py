@@ -0,0 +1,38 @@
+"""Mensajes del outbox: los adjuntos grandes van por el spool, codificados por bloques."""
+import email
+import io
+import os
+
+from engine import ClienteDTO, EmailService, EspecificacionesDTO, ProduccionDTO, generar_etiquetas_rollo
+
+CLIENTE = ClienteDTO("Etiquetas del Mediterráneo S.L.", "compras@example.com", "ORD-2026-000123")
+SPECS = EspecificacionesDTO(100, 80, 250000, "PP Blanco", "Ø 76 mm", 1000)
+PROD = ProduccionDTO("3", "", None)
+
+
+def adjuntos(raw):
+    if not isinstance(raw, (bytes, bytearray)):
+        with open(raw, "rb") as f:
+            raw = f.read()
+    msg = email.message_from_bytes(raw)
+    return {parte.get_filename(): parte.get_payload(decode=True) for parte in msg.walk() if parte.get_filename()}
+
+
+def test_etiquetas_de_rollo_por_el_spool(config):
+    (_, _, raw_taller), (_, _, raw_cliente) = EmailService.preparar_mensajes(CLIENTE, PROD, b"%PDF-ficha", "a@x.es",
+                                                                             SPECS)[0]
+    esperado = io.BytesIO()
+    generar_etiquetas_rollo(esperado, CLIENTE, SPECS, PROD)
+
+    assert isinstance(raw_taller, str)  # mensaje en fichero, no en memoria
+    assert adjuntos(raw_taller)[f"Etiquetas_{CLIENTE.referencia_interna}.pdf"] == esperado.getvalue()
+    assert "Etiquetas_ORD-2026-000123.pdf" not in adjuntos(raw_cliente)
+    # Sólo queda el mensaje: los PDF temporales de etiquetas se borran
+    assert os.listdir(config["outbox_spool"]) == [os.path.basename(raw_taller)]
+
+
+def test_sin_adjuntar_etiquetas_el_mensaje_va_en_memoria(config):
+    config["etiquetas_rollo_adjuntar"] = False
+    (_, _, raw_taller), _ = EmailService.preparar_mensajes(CLIENTE, PROD, b"%PDF-ficha", "a@x.es", SPECS)[0]
+    assert isinstance(raw_taller, bytes)
+    assert list(adjuntos(raw_taller)) == [f"Ficha_{CLIENTE.referencia_interna}.pdf"]
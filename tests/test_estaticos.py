@@ -0,0 +1,16 @@
+"""Recursos estáticos de la interfaz: todo lo que cita la hoja de estilos existe en static/."""
+import os
+import re
+
+RAIZ = os.path.join(os.path.dirname(__file__), "..", "static")
+CSS = os.path.join(RAIZ, "css", "flexylabel.css")
+
+
+def test_fuentes_de_la_hoja_estan_en_static():
+    with open(CSS, encoding="utf-8") as f:
+        urls = re.findall(r'url\("([^"]+)"\)', f.read())
+    assert urls
+    for url in urls:
+        path = os.path.normpath(os.path.join(os.path.dirname(CSS), url))
+        with open(path, "rb") as f:
+            assert f.read(4) == b"wOF2", url
@@ -0,0 +1,67 @@
+"""Claves de idempotencia de `envios`: reserva, finalización, liberación y caducidades."""
+import sqlite3
+
+import pytest
+
+from historial import (CLAVE_CONTENIDO_CADUCIDAD_S, ENVIO_COMPLETADO, ENVIO_EN_CURSO,
+                       RESERVA_CADUCIDAD_S, HistorialPedidos)
+
+
+@pytest.fixture
+def historial(tmp_path):
+    return HistorialPedidos(str(tmp_path / "historial.db"))
+
+
+def envejecer(historial, clave, segundos):
+    with sqlite3.connect(historial.db_path) as conn:
+        conn.execute("UPDATE envios SET created_at = created_at - ? WHERE clave = ?", (segundos, clave))
+
+
+def test_reserva_nueva_y_duplicado_en_curso(historial):
+    assert historial.reservar_envio("k") is None
+    previo = historial.reservar_envio("k")
+    assert previo["estado"] == ENVIO_EN_CURSO and previo["referencia"] is None
+
+
+def test_completar_envio_marca_duplicado_con_referencia(historial):
+    historial.reservar_envio("k")
+    historial.completar_envio("k", "ORD-2026-000001")
+    previo = historial.reservar_envio("k")
+    assert (previo["estado"], previo["referencia"]) == (ENVIO_COMPLETADO, "ORD-2026-000001")
+
+
+def test_liberar_envio_permite_reintentar(historial):
+    historial.reservar_envio("k")
+    historial.liberar_envio("k")
+    assert historial.reservar_envio("k") is None
+
+
+def test_liberar_no_borra_envios_completados(historial):
+    historial.reservar_envio("k")
+    historial.completar_envio("k", "ORD-1")
+    historial.liberar_envio("k")
+    assert historial.reservar_envio("k")["referencia"] == "ORD-1"
+
+
+def test_reserva_en_curso_caduca(historial):
+    historial.reservar_envio("k")
+    envejecer(historial, "k", RESERVA_CADUCIDAD_S + 1)
+    assert historial.reservar_envio("k") is None
+
+
+def test_claves_de_contenido_caducan_y_las_explicitas_no(historial):
+    for clave in ("contenido", "explicita"):
+        historial.reservar_envio(clave)
+        historial.completar_envio(clave, "ORD-1")
+        envejecer(historial, clave, CLAVE_CONTENIDO_CADUCIDAD_S + 1)
+
+    assert historial.reservar_envio("contenido", caducidad_s=CLAVE_CONTENIDO_CADUCIDAD_S) is None
+    assert historial.reservar_envio("explicita")["estado"] == ENVIO_COMPLETADO
+
+
+def test_completar_renueva_la_caducidad(historial):
+    historial.reservar_envio("k", caducidad_s=CLAVE_CONTENIDO_CADUCIDAD_S)
+    envejecer(historial, "k", RESERVA_CADUCIDAD_S - 1)
+    historial.completar_envio("k", "ORD-1")
+    envejecer(historial, "k", CLAVE_CONTENIDO_CADUCIDAD_S - RESERVA_CADUCIDAD_S)
+    assert historial.reservar_envio("k", caducidad_s=CLAVE_CONTENIDO_CADUCIDAD_S) is not None
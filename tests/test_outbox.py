@@ -0,0 +1,124 @@
+"""Entrega del outbox contra un SMTP local: reintentos con backoff y varios workers sobre la misma base."""
+import sqlite3
+import threading
+
+from outbox import ESTADO_ENVIADO, ESTADO_FALLIDO, ESTADO_PENDIENTE, OutboxQueue, OutboxWorker
+from smtp_pool import SMTPConfig, SMTPConnectionPool
+
+
+def mensaje(n: int) -> bytes:
+    return f"Subject: Orden {n}\r\n\r\nCuerpo {n}\r\n".encode()
+
+
+def crear_worker(db, puerto, **kwargs) -> OutboxWorker:
+    pool = SMTPConnectionPool(SMTPConfig(host="127.0.0.1", port=puerto, use_ssl=False, timeout=5))
+    return OutboxWorker(OutboxQueue(db), pool, **kwargs)
+
+
+def vencer_reintentos(db):
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE outbox SET next_attempt_at = 0")
+
+
+def estados(db):
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT status, attempts, last_error FROM outbox ORDER BY id").fetchall()
+
+
+def test_smtp_caido_reintenta_y_entrega(tmp_path, smtp):
+    db = str(tmp_path / "outbox.db")
+    OutboxQueue(db).enqueue({"pedido": 1}, [("taller@x.es", ["covet@x.es"], mensaje(1))])
+    worker = crear_worker(db, smtp.puerto, base_backoff=60.0)
+
+    assert worker.drain() == 0
+    [(estado, intentos, error)] = estados(db)
+    assert (estado, intentos) == (ESTADO_PENDIENTE, 1) and error
+
+    smtp.arrancar()
+    vencer_reintentos(db)
+    assert worker.drain() == 1
+    assert estados(db) == [(ESTADO_ENVIADO, 2, None)]
+    assert [rcpt for _, rcpt, _ in smtp.recibidos] == [["covet@x.es"]]
+
+
+def test_backoff_aplaza_el_reintento(tmp_path, smtp):
+    db = str(tmp_path / "outbox.db")
+    OutboxQueue(db).enqueue({}, [("a@x.es", ["b@x.es"], mensaje(1))])
+    worker = crear_worker(db, smtp.puerto, base_backoff=60.0)
+
+    assert worker.drain() == 0
+    smtp.arrancar()
+    # El siguiente intento no vence hasta dentro de 120 s (60 * 2**1)
+    assert worker.drain() == 0
+    assert smtp.recibidos == []
+
+
+def test_fallo_definitivo_tras_max_intentos(tmp_path, smtp):
+    db = str(tmp_path / "outbox.db")
+    OutboxQueue(db).enqueue({}, [("a@x.es", ["b@x.es"], mensaje(1))])
+    worker = crear_worker(db, smtp.puerto, base_backoff=0.0, max_attempts=2)
+
+    # Sin espera entre intentos, un solo drain agota los reintentos
+    assert worker.drain() == 0
+    assert estados(db)[0][:2] == (ESTADO_FALLIDO, 2)
+    assert worker.queue.due() == []
+
+
+def test_dos_workers_no_duplican_envios(tmp_path, smtp):
+    db = str(tmp_path / "outbox.db")
+    total = 60
+    cola = OutboxQueue(db)
+    for n in range(total):
+        cola.enqueue({"pedido": n}, [("a@x.es", ["b@x.es"], mensaje(n))])
+    smtp.arrancar()
+    workers = [crear_worker(db, smtp.puerto) for _ in range(2)]
+    for worker in workers:
+        worker.queue.due = lambda limit=5, _due=worker.queue.due: _due(limit)  # lotes pequeños: más intercalado
+
+    hilos = [threading.Thread(target=worker.drain) for worker in workers]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(30)
+
+    asuntos = sorted(contenido.split(b"\r\n", 1)[0] for _, _, contenido in smtp.recibidos)
+    assert asuntos == sorted(f"Subject: Orden {n}".encode() for n in range(total))
+    assert {estado for estado, _, _ in estados(db)} == {ESTADO_ENVIADO}
+
+
+def test_reserva_de_un_worker_caido_caduca(tmp_path):
+    db = str(tmp_path / "outbox.db")
+    cola = OutboxQueue(db)
+    cola.enqueue({}, [("a@x.es", ["b@x.es"], mensaje(1))])
+
+    assert len(cola.due()) == 1
+    assert cola.due() == []  # tomado por el primer worker
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE outbox SET tomado_en = tomado_en - 3600")
+    assert len(cola.due()) == 1
+
+
+def test_worker_con_la_reserva_caducada_no_pisa_el_estado(tmp_path):
+    db = str(tmp_path / "outbox.db")
+    cola = OutboxQueue(db)
+    cola.enqueue({}, [("a@x.es", ["b@x.es"], mensaje(1))])
+
+    [lento] = cola.due()
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE outbox SET tomado_en = tomado_en - 3600")
+    [relevo] = cola.due()
+    assert cola.mark_failed(relevo["id"], relevo["tomado_en"], "timeout", 0.0)
+
+    assert not cola.mark_sent(lento["id"], lento["tomado_en"])
+    assert estados(db) == [(ESTADO_PENDIENTE, 1, "timeout")]
+
+
+def test_fallo_definitivo_borra_el_mensaje_del_spool(tmp_path, smtp):
+    db = str(tmp_path / "outbox.db")
+    fichero = tmp_path / "msg.eml"
+    fichero.write_bytes(mensaje(1))
+    OutboxQueue(db).enqueue({}, [("a@x.es", ["b@x.es"], str(fichero))])
+
+    crear_worker(db, smtp.puerto, base_backoff=0.0, max_attempts=1).drain()
+    assert estados(db)[0][0] == ESTADO_FALLIDO
+    assert not fichero.exists()
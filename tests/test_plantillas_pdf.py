@@ -0,0 +1,64 @@
+"""Las plantillas cacheadas reutilizan internos de fpdf2: su salida debe ser idéntica al render completo.
+
+Se rasterizan ambas versiones con PyMuPDF (opcional, sólo para las pruebas)
+y se comparan píxel a píxel. Si una versión nueva de fpdf2 cambia esos
+internos, estas pruebas fallan antes que las órdenes del taller.
+"""
+import datetime
+import io
+
+import pytest
+
+from engine import (
+    ClienteDTO, EspecificacionesDTO, ProduccionDTO, generar_orden_pdf, valores_etiqueta, valores_orden,
+)
+from etiquetas_rollo import EtiquetaRolloPDF, dibujar_etiqueta, escribir_etiquetas
+
+pymupdf = pytest.importorskip("pymupdf")
+
+CLIENTE = ClienteDTO("Etiquetas del Mediterráneo S.L.", "compras@example.com", "ORD-2026-000123")
+SPECS = EspecificacionesDTO(100, 80, 25000, "PP Blanco", "Ø 76 mm", 1000)
+PROD = ProduccionDTO("3", "Revisar registro de color en la primera bobina.", None)
+FECHA = datetime.date(2026, 1, 15)
+
+
+def paginas(pdf_data):
+    doc = pymupdf.open(stream=bytes(pdf_data))
+    return [(pagina.get_pixmap(dpi=100).samples, sorted(w[4] for w in pagina.get_text("words"))) for pagina in doc]
+
+
+@pytest.mark.parametrize("prod", [PROD, ProduccionDTO("8", "", None)], ids=["con_notas", "sin_notas"])
+def test_orden_plantilla_igual_a_render_completo(prod):
+    con = generar_orden_pdf(CLIENTE, SPECS, prod, usar_plantilla=True, fecha=FECHA)
+    sin = generar_orden_pdf(CLIENTE, SPECS, prod, usar_plantilla=False, fecha=FECHA)
+    assert paginas(con) == paginas(sin)
+
+
+def test_resumen_taller_plantilla_igual_a_render_completo():
+    import orden_pdf
+
+    resumen = [("PP Blanco", "2", "10.00 m", "1.00 m2", "3"), ("TOTAL", "2", "10.00 m", "1.00 m2", "3")]
+    ordenes = [(valores_orden(CLIENTE, SPECS, PROD, FECHA), PROD.notas_maquinista),
+               (valores_orden(CLIENTE, SPECS, ProduccionDTO("1", "", None), FECHA), "")]
+    con = orden_pdf.componer_resumen(resumen, ordenes, usar_plantilla=True).output()
+    sin = orden_pdf.componer_resumen(resumen, ordenes, usar_plantilla=False).output()
+    assert len(paginas(con)) == 3
+    assert paginas(con) == paginas(sin)
+
+
+CLIENTE_LARGO = ClienteDTO("Cliente con una razón social tan larga que no cabe en la etiqueta S.L.",
+                           "c@example.com", "ORD-2026-000124")
+
+
+@pytest.mark.parametrize("cliente", [CLIENTE, CLIENTE_LARGO], ids=["normal", "texto_recortado"])
+def test_etiquetas_streaming_igual_a_render_fpdf(cliente):
+    """Cada etiqueta escrita en streaming (Form XObject) frente a la misma etiqueta dibujada con fpdf2."""
+    valores = valores_etiqueta(cliente, SPECS, PROD)
+    destino = io.BytesIO()
+    assert escribir_etiquetas(destino, valores, 3, 1000, 2500, "termica") == 3
+    streaming = paginas(destino.getvalue())
+    for n, uds in enumerate((1000, 1000, 500)):
+        pdf = EtiquetaRolloPDF()
+        dibujar_etiqueta(pdf)
+        pdf.escribir_valores(pdf._huecos, dict(valores, rollo=f"{n + 1} / 3", uds=str(uds)))
+        assert streaming[n] == paginas(pdf.output())[0]
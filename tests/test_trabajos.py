@@ -0,0 +1,37 @@
+"""Render en el pool de procesos: las métricas del hijo se registran en el proceso principal."""
+import json
+import logging
+import re
+import threading
+
+from engine import ClienteDTO, EspecificacionesDTO, ProduccionDTO
+from metricas import METRICAS
+from trabajos import TRABAJO_COMPLETADO, GestorTrabajos
+
+
+def cuenta_etapa(etapa: str) -> int:
+    m = re.search(rf'^flexylabel_etapa_segundos_count{{etapa="{etapa}"}} (\d+)$', METRICAS.exportar_prometheus(), re.M)
+    return int(m.group(1)) if m else 0
+
+
+def test_spans_del_render_llegan_al_proceso_principal(caplog):
+    cliente = ClienteDTO("Cliente", "c@x.es", "ORD-2026-000001")
+    specs = EspecificacionesDTO(50, 30, 1000, "PP Blanco", "Ø 76 mm", 1000)
+    antes = {etapa: cuenta_etapa(etapa) for etapa in ("render_pdf", "pdf_output", "cola_render")}
+    hecho = threading.Event()
+
+    gestor = GestorTrabajos(procesos=1, hilos=1)
+    try:
+        with caplog.at_level(logging.INFO, logger="FlexyLabel_Enterprise.metricas"):
+            trabajo = gestor.enviar("sesion", cliente, specs, ProduccionDTO("3", "", None), lambda pdf: hecho.set())
+            assert hecho.wait(120)
+    finally:
+        gestor.shutdown()
+
+    assert trabajo.estado == TRABAJO_COMPLETADO
+    assert {etapa: cuenta_etapa(etapa) - n for etapa, n in antes.items()} == {
+        "render_pdf": 1, "pdf_output": 1, "cola_render": 1,
+    }
+    lineas = [json.loads(r.getMessage()) for r in caplog.records if r.name == "FlexyLabel_Enterprise.metricas"]
+    render = [linea for linea in lineas if linea["etapa"] == "render_pdf"]
+    assert render and render[0]["referencia"] == "ORD-2026-000001"
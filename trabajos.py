@@ -0,0 +1,190 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+
+from engine import generar_orden_pdf
+from metricas import METRICAS, capturar_spans, contexto_log, span
+
+# =============================================================================
+# TRABAJOS EN SEGUNDO PLANO: RENDER EN PROCESOS, E/S EN HILOS
+# =============================================================================
+# El botón de envío sólo valida y despacha: el PDF se renderiza en un pool de
+# procesos acotado (escala con los núcleos y no compite por el GIL del servidor
+# Streamlit) y la preparación de correos, el encolado y el historial corren en
+# un pool de hilos. Cada sesión tiene un máximo de órdenes en curso y el total
+# pendiente está acotado; el formulario consulta el estado con `de_sesion`.
+
+logger = logging.getLogger("FlexyLabel_Enterprise")
+
+TRABAJO_EN_COLA = "en_cola"
+TRABAJO_RENDER = "renderizando"
+TRABAJO_ENCOLANDO = "encolando"
+TRABAJO_COMPLETADO = "completado"
+TRABAJO_ERROR = "error"
+
+
+class LimiteTrabajos(RuntimeError):
+    pass
+
+
+@dataclass
+class Trabajo:
+    id: str
+    sesion: str
+    referencia: str
+    creado: float
+    estado: str = TRABAJO_EN_COLA
+    error: str = None
+    terminado: float = None
+    futuro: object = field(default=None, repr=False)
+
+    @property
+    def activo(self) -> bool:
+        return self.terminado is None
+
+    @property
+    def duracion_s(self) -> float:
+        return (self.terminado or time.time()) - self.creado
+
+
+def _precalentar():
+    # Cada proceso importa fpdf y graba la plantilla una vez, antes de la primera orden
+    from orden_pdf import get_plantilla_orden
+    get_plantilla_orden()
+
+
+def _renderizar(cliente, specs, prod, fecha, encolado_en):
+    """Proceso hijo: devuelve `(pdf, segundos en cola, spans del render)`.
+
+    Las métricas y el logging del hijo no llegan al servidor: los spans
+    (render_pdf, pdf_output) vuelven con el PDF y se registran en el padre.
+    """
+    espera_s = time.time() - encolado_en
+    with capturar_spans() as spans:
+        pdf_data = bytes(generar_orden_pdf(cliente, specs, prod, fecha=fecha))
+    return pdf_data, espera_s, spans
+
+
+class GestorTrabajos:
+    """Pools compartidos por todas las sesiones del proceso."""
+
+    def __init__(self, procesos: int = None, hilos: int = 4, max_por_sesion: int = 2,
+                 max_pendientes: int = None, retencion_s: float = 600):
+        self.procesos = int(procesos or os.cpu_count() or 1)
+        self.max_por_sesion = max_por_sesion
+        self.max_pendientes = int(max_pendientes or self.procesos * 8)
+        self.retencion_s = retencion_s
+        self._lock = threading.Lock()
+        self._trabajos = {}  # id -> Trabajo, en orden de llegada
+        self._io = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="trabajos-io")
+        self._render = self._nuevo_pool()
+
+    def _nuevo_pool(self) -> ProcessPoolExecutor:
+        # spawn: los hijos sólo importan el motor, no heredan los hilos del servidor
+        return ProcessPoolExecutor(max_workers=self.procesos, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_precalentar)
+
+    def activos(self) -> int:
+        with self._lock:
+            return sum(t.activo for t in self._trabajos.values())
+
+    def de_sesion(self, sesion: str) -> list:
+        """Trabajos recientes de la sesión, del más antiguo al más nuevo."""
+        with self._lock:
+            self._purgar()
+            trabajos = [t for t in self._trabajos.values() if t.sesion == sesion]
+        for t in trabajos:
+            if t.estado == TRABAJO_EN_COLA and t.futuro is not None and t.futuro.running():
+                t.estado = TRABAJO_RENDER
+        return trabajos
+
+    def _purgar(self):
+        limite = time.time() - self.retencion_s
+        for id_ in [i for i, t in self._trabajos.items() if t.terminado and t.terminado < limite]:
+            del self._trabajos[id_]
+
+    def _comprobar_limites(self, sesion: str):
+        activos = [t for t in self._trabajos.values() if t.activo]
+        if sum(t.sesion == sesion for t in activos) >= self.max_por_sesion:
+            raise LimiteTrabajos(f"Máximo {self.max_por_sesion} órdenes en curso por sesión. "
+                                 "Espere a que termine alguna.")
+        if len(activos) >= self.max_pendientes:
+            raise LimiteTrabajos("Sistema saturado: demasiadas órdenes en curso. Inténtelo en unos segundos.")
+
+    def comprobar(self, sesion: str):
+        """Lanza LimiteTrabajos si `enviar` rechazaría ahora una orden de la sesión."""
+        with self._lock:
+            self._comprobar_limites(sesion)
+
+    def enviar(self, sesion: str, cliente, specs, prod, tarea_io, al_fallar=None, fecha=None) -> Trabajo:
+        """Renderiza la orden en el pool de procesos y después ejecuta `tarea_io(pdf)` en un hilo.
+
+        `al_fallar()` se llama si cualquiera de las dos fases falla. Lanza
+        LimiteTrabajos si la sesión o el proceso tienen demasiadas órdenes en curso.
+        """
+        with self._lock:
+            self._purgar()
+            self._comprobar_limites(sesion)
+            trabajo = Trabajo(uuid.uuid4().hex, sesion, cliente.referencia_interna, time.time())
+            self._trabajos[trabajo.id] = trabajo
+
+        # El arte final no hace falta para el render (y un UploadedFile no se puede enviar a otro proceso)
+        args = (_renderizar, cliente, specs, replace(prod, arte_final=None), fecha, trabajo.creado)
+        try:
+            try:
+                trabajo.futuro = self._render.submit(*args)
+            except BrokenProcessPool:
+                logger.error("Pool de render caído; se recrea")
+                self._render = self._nuevo_pool()
+                trabajo.futuro = self._render.submit(*args)
+        except Exception as e:
+            self._terminar(trabajo, e, al_fallar)
+            raise
+        trabajo.futuro.add_done_callback(lambda f: self._tras_render(trabajo, f, tarea_io, al_fallar))
+        return trabajo
+
+    def _tras_render(self, trabajo, futuro, tarea_io, al_fallar):
+        try:
+            pdf_data, espera_s, spans = futuro.result()
+        except Exception as e:
+            self._terminar(trabajo, e, al_fallar)
+            return
+        METRICAS.observar("etapa_segundos", espera_s, etapa="cola_render")
+        with contexto_log(referencia=trabajo.referencia):
+            METRICAS.registrar_spans(spans)
+        trabajo.estado = TRABAJO_ENCOLANDO
+        self._io.submit(self._ejecutar_io, trabajo, tarea_io, pdf_data, al_fallar)
+
+    def _ejecutar_io(self, trabajo, tarea_io, pdf_data, al_fallar):
+        try:
+            with contexto_log(referencia=trabajo.referencia), span("trabajo_io"):
+                tarea_io(pdf_data)
+        except Exception as e:
+            self._terminar(trabajo, e, al_fallar)
+            return
+        self._terminar(trabajo)
+
+    def _terminar(self, trabajo, error=None, al_fallar=None):
+        if error is not None:
+            logger.error(f"Orden {trabajo.referencia} fallida: {error}")
+            trabajo.error = str(error) or type(error).__name__
+            if al_fallar:
+                try:
+                    al_fallar()
+                except Exception as e:
+                    logger.error(f"Error al liberar la orden {trabajo.referencia}: {e}")
+        trabajo.estado = TRABAJO_ERROR if error is not None else TRABAJO_COMPLETADO
+        trabajo.terminado = time.time()
+        METRICAS.observar("etapa_segundos", trabajo.duracion_s, etapa="trabajo_total")
+        METRICAS.incrementar("trabajos_total", ayuda="Órdenes procesadas en segundo plano, por resultado",
+                             estado=trabajo.estado)
+
+    def shutdown(self):
+        self._render.shutdown(cancel_futures=True)
+        self._io.shutdown()